@@ -0,0 +1,197 @@
+import os
+import sys
+import numpy as np
+
+# The benchmarks run against the source tree and generate their data with
+# the synthetic data generator.
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'scripts', 'synthetic_bgq_counters'))
+
+import generate_bgq_synthetic_data as synthetic
+
+# Torus shapes of the synthetic runs. The 3D runs are used by every case,
+# the 5D run only by the cases that do not need a 3D torus.
+sizes = {
+    'small' : [8, 8, 8],
+    'medium' : [16, 16, 8],
+    'large' : [16, 16, 16],
+    'sequoia' : [16, 16, 16, 12, 2],
+}
+
+# (name, setup function) of each registered case, in order
+cases = list()
+
+
+def benchmark(name):
+    """Registers the decorated function as the setup of the named
+       benchmark case. The setup is called with a loaded Run and returns
+       the function to time, or None if the case does not apply to the
+       run.
+    """
+    def benchmark_inner(setup):
+        cases.append((name, setup))
+        return setup
+    return benchmark_inner
+
+
+def generateRun(size, data_dir):
+    """Returns the meta file of the synthetic run of the given size,
+       generating the run into data_dir if it is not there yet.
+    """
+    output = os.path.join(data_dir, size)
+    meta = os.path.join(output, 'bgq_synthetic_meta.yaml')
+    if not os.path.exists(meta):
+        if not os.path.isdir(output):
+            os.makedirs(output)
+        synthetic.generate(sizes[size], 2, 'code_region', 'center', 4, True,
+            False, output, 'bgq_synthetic',
+            'TEST_%dD_TORUS' % len(sizes[size]), 0)
+    return meta
+
+
+class Run(object):
+    """The data a case needs: the meta file of a synthetic run, a
+       DataTree holding it, and its node and link tables.
+    """
+
+    def __init__(self, meta):
+        from boxfish.DataModel import DataTree
+        from PySide.QtCore import QModelIndex
+
+        self.meta = meta
+        self.datatree = DataTree()
+        self.datatree.insertRun(meta)
+        self.item = self.datatree.getItem(self.datatree.index(0, 0,
+            QModelIndex()))
+        hardware = self.item["hardware"]
+        self.coords = hardware["coords"]
+        self.nodes = self.item.getTable(hardware["coords_table"])
+        self.links = self.item.getTable(hardware["link_coords_table"])
+
+    def attributeIndex(self, table, attribute):
+        """Returns the DataTree index of the named attribute of table."""
+        for item in table._children:
+            if item.name == attribute:
+                return self.datatree.indexOfItem(item)
+        raise ValueError("No attribute " + attribute + " in " + table.name)
+
+    def agent(self):
+        """Returns a ModuleAgent on the run with a nodes and a links
+           request keeping only the first code region.
+        """
+        from boxfish.ModuleAgent import ModuleAgent
+        from boxfish.Filter import ValueFilter
+
+        agent = ModuleAgent(None, self.datatree)
+        for name in ["nodes", "links"]:
+            agent.addRequest(name)
+            agent.requests[name].coupler.modifier_chain \
+                = [ValueFilter('code_region', 1)]
+        return agent
+
+
+@benchmark('load_table')
+def loadTable(run):
+    import boxfish.YamlLoader as yl
+
+    path = os.path.join(os.path.dirname(run.meta), run.links['filename'])
+    return lambda: yl.load_table(path)
+
+
+@benchmark('insert_run')
+def insertRun(run):
+    from boxfish.DataModel import DataTree
+
+    return lambda: DataTree().insertRun(run.meta)
+
+
+@benchmark('node_link_projection')
+def nodeLinkProjection(run):
+    from boxfish.Projection import NodeLinkProjection
+
+    def project():
+        # The dicts are made on first use, so build them to time them
+        NodeLinkProjection(run = run.item, node_policy = 'Source',
+            link_policy = 'Source').build()
+    return project
+
+
+@benchmark('build_where_clause')
+def buildWhereClause(run):
+    from boxfish.Query import Clause, TableAttribute
+
+    table = run.links._table
+    identifiers = table.identifiers()
+    condition = Clause('and',
+        Clause('=', TableAttribute('code_region'), 1),
+        Clause('>', TableAttribute('packets'),
+            int(np.median(table._data['packets']))))
+    return lambda: table.build_where_clause(condition, identifiers)
+
+
+@benchmark('aggregate_domain')
+def aggregateDomain(run):
+    from boxfish.ModuleAgent import ModuleRequest
+
+    request = run.agent().requests["links"]
+    request.indices = [run.attributeIndex(run.links, 'packets')]
+
+    def evaluate():
+        ModuleRequest.result_cache.clear()
+        return request.aggregateDomain(run.nodes, 'mean', 'mean')
+    return evaluate
+
+
+@benchmark('generalized_group_by')
+def generalizedGroupBy(run):
+    request = run.agent().requests["nodes"]
+    request.indices = [run.attributeIndex(run.nodes, run.coords[0])]
+    desired = [run.attributeIndex(run.links, 'packets')]
+    return lambda: request.generalizedGroupBy(desired, 'mean', 'mean')
+
+
+@benchmark('highlight_ids')
+def highlightIDs(run):
+    agent = run.agent()
+    node_ids = np.unique(run.nodes._table._data[run.nodes['field']])
+    agent.setHighlights([run.nodes], [run.item], [node_ids[::10].tolist()])
+    return lambda: agent.getHighlightIDs(run.links, run.item)
+
+
+def torusModel(run):
+    """Returns a Torus3dAgent holding the packets of the run's links and
+       the data model it updates, or None if the run is not a 3D torus.
+    """
+    if len(run.coords) != 3:
+        return None
+
+    from boxfish.mods.Torus3dModule import Torus3dAgent, \
+        Torus3dFrameDataModel
+
+    agent = Torus3dAgent(None, run.datatree)
+    model = Torus3dFrameDataModel()
+    model.agent = agent
+    agent.torusUpdateSignal.connect(model.updateTorus)
+    agent.registerNodeAttributes([run.attributeIndex(run.nodes,
+        run.coords[0])])
+    agent.registerLinkAttributes([run.attributeIndex(run.links, 'packets')])
+    return agent, model
+
+
+@benchmark('torus_node_update')
+def torusNodeUpdate(run):
+    torus = torusModel(run)
+    if torus is None:
+        return None
+    agent, model = torus
+    return lambda: model.updateNodeData(agent.nodeids, agent.nodevals)
+
+
+@benchmark('torus_link_update')
+def torusLinkUpdate(run):
+    torus = torusModel(run)
+    if torus is None:
+        return None
+    agent, model = torus
+    return lambda: model.updateLinkData(agent.linkids, agent.linkvals)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+import subprocess
+import multiprocessing
+import cases
+
+# Times the data pipeline hot paths on synthetic runs of several sizes.
+# Every case runs in its own process so that its peak memory is its own
+# and no cache is shared between cases. Results are appended to a JSON
+# history and compared against a stored baseline; a case more than the
+# threshold slower or larger than its baseline is flagged as a regression.
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Cases faster than this are not flagged, their timings are mostly noise
+noise_floor = 0.005
+
+
+def peakMemory():
+    """Returns the peak resident memory of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': # bytes rather than KB
+        peak /= 1024
+    return peak / 1024.0
+
+
+def runCase(name, size, meta, repeat):
+    """Sets up the named case on the run in the given meta file and times
+       it repeat times. Returns a result dict, or None if the case does
+       not apply to the run.
+    """
+    setup = dict(cases.cases)[name]
+
+    # The pipeline prints progress we don't want in the report
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        function = setup(cases.Run(meta))
+        if function is None:
+            return None
+
+        timings = list()
+        for i in range(repeat):
+            start = time.time()
+            function()
+            timings.append(time.time() - start)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    timings.sort()
+    return { 'case' : name, 'size' : size, 'seconds' : timings[0],
+        'median' : timings[len(timings) / 2], 'peak_mb' : peakMemory() }
+
+
+def runCaseJob(job):
+    """Runs runCase on a tuple of its arguments."""
+    return runCase(*job)
+
+
+def runIsolated(job):
+    """Runs the case job in a fresh process and returns its result."""
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(runCaseJob, (job,))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def resultKey(result):
+    return result['case'] + '/' + result['size']
+
+
+def loadJSON(filename, default):
+    """Returns the contents of the JSON file, or default if it does not
+       exist.
+    """
+    if not os.path.exists(filename):
+        return default
+    with open(filename, 'r') as json_file:
+        return json.load(json_file)
+
+
+def saveJSON(filename, contents):
+    with open(filename, 'w') as json_file:
+        json.dump(contents, json_file, indent = 1, sort_keys = True)
+
+
+def commitOf(directory):
+    """Returns the git commit checked out in directory, or None."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+            'HEAD'], cwd = directory, stderr = open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Prints each result against its baseline and returns the list of
+       (result, reasons) pairs of the regressions.
+    """
+    regressions = list()
+    print '%-22s %-8s %10s %10s %10s %8s' % ('case', 'size', 'seconds',
+        'baseline', 'peak MB', 'change')
+    for result in results:
+        base = baseline.get(resultKey(result))
+        reasons = list()
+        change = ''
+        if base is not None:
+            change = '%+.0f%%' % (100.0 * (result['seconds'] - base['seconds'])
+                / max(base['seconds'], 1e-9))
+            if result['seconds'] > noise_floor \
+                and result['seconds'] > base['seconds'] * (1 + threshold):
+                reasons.append('time')
+            if result['peak_mb'] > base['peak_mb'] * (1 + threshold):
+                reasons.append('memory')
+
+        base_seconds = '-'
+        if base is not None:
+            base_seconds = '%.4f' % base['seconds']
+        flag = ''
+        if reasons:
+            flag = 'REGRESSION (' + ', '.join(reasons) + ')'
+            regressions.append((result, reasons))
+
+        print '%-22s %-8s %10.4f %10s %10.1f %8s %s' % (result['case'],
+            result['size'], result['seconds'], base_seconds,
+            result['peak_mb'], change, flag)
+
+    return regressions
+
+
+def main(argv = None):
+    """Runs the benchmarks. Returns 1 if any case regressed."""
+    case_names = [name for name, setup in cases.cases]
+    parser = argparse.ArgumentParser(description = 'Times the Boxfish data '
+        + 'pipeline on synthetic runs and flags regressions.')
+    parser.add_argument('-s', '--size', action = 'append', default = list(),
+        dest = 'sizes', choices = sorted(cases.sizes.keys()),
+        help = 'run size to benchmark, defaults to small and medium')
+    parser.add_argument('-c', '--case', action = 'append', default = list(),
+        dest = 'cases', choices = case_names,
+        help = 'case to run, defaults to all of them')
+    parser.add_argument('-r', '--repeat', type = int, default = 3,
+        help = 'number of timings of each case, the fastest is kept')
+    parser.add_argument('-t', '--threshold', type = float, default = 0.25,
+        help = 'fraction over the baseline at which a case regressed')
+    parser.add_argument('--data', default = os.path.join(benchmark_dir,
+        'data'), help = 'directory holding the generated runs')
+    parser.add_argument('--history', default = os.path.join(benchmark_dir,
+        'history.json'), help = 'JSON file to which results are appended')
+    parser.add_argument('--baseline', default = os.path.join(benchmark_dir,
+        'baseline.json'), help = 'JSON file of the baseline results')
+    parser.add_argument('--save-baseline', action = 'store_true',
+        default = False, help = 'store these results as the new baseline')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or ['small', 'medium']
+    names = args.cases or case_names
+
+    results = list()
+    for size in sizes:
+        meta = cases.generateRun(size, args.data)
+        for name in names:
+            result = runIsolated((name, size, meta, max(args.repeat, 1)))
+            if result is not None:
+                results.append(result)
+
+    history = loadJSON(args.history, list())
+    history.append({
+        'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit' : commitOf(cases.root),
+        'host' : socket.gethostname(),
+        'python' : sys.version.split()[0],
+        'results' : results,
+    })
+    saveJSON(args.history, history)
+
+    baseline = loadJSON(args.baseline, dict())
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        baseline.update((resultKey(result), result) for result in results)
+        saveJSON(args.baseline, baseline)
+        print 'Saved baseline to', args.baseline
+    elif not baseline:
+        print 'No baseline to compare with. Store one with --save-baseline.'
+
+    if regressions:
+        print len(regressions), 'regression(s) over the baseline by more', \
+            'than %.0f%%.' % (100 * args.threshold)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import numpy as np
+from SubDomain import *
+from Projection import *
+from Filter import *
+from TimeSeries import TimeSeriesTable
+import Profiler
+
+# Evaluation of data requests on the DataTree items. This holds no Qt state
+# so it can be shared by ModuleRequest and batch processing.
+
+operator = {
+    'sum' : sum,
+    'mean' : lambda x: sum(x) / float(len(x)),
+    'max' : max,
+    'min' : min,
+}
+
+# The same operators on partial aggregates (sum, count, max, min)
+partial_operator = {
+    'sum' : lambda partial: partial[0],
+    'mean' : lambda partial: partial[0] / float(partial[1]),
+    'max' : lambda partial: partial[2],
+    'min' : lambda partial: partial[3],
+}
+
+
+def mergePartials(first, second):
+    """Returns the partial aggregate (sum, count, max, min) of the values
+       of two partial aggregates together.
+    """
+    return (first[0] + second[0], first[1] + second[1],
+        max(first[2], second[2]), min(first[3], second[3]))
+
+
+def timeWindow(table, modifier_chain):
+    """If the TableItem's table is a time series and every modifier in the
+       chain only selects some of its timesteps, returns the (start, stop)
+       time window they select together. Returns None otherwise.
+    """
+    if not isinstance(table._table, TimeSeriesTable):
+        return None
+
+    time_attribute = table._table.time_attribute
+    start, stop = float('-inf'), float('inf')
+    for modifier in modifier_chain:
+        if isinstance(modifier, TimeRangeFilter) \
+            and modifier.attribute == time_attribute:
+            start = max(start, modifier.start)
+            stop = min(stop, modifier.stop)
+        elif isinstance(modifier, ValueFilter) \
+            and modifier.attribute == time_attribute:
+            start = max(start, modifier.value)
+            stop = min(stop, modifier.value)
+        else:
+            return None
+    return start, stop
+
+
+def filterIdentifiers(table, modifier_chain, tags = None):
+    """Returns the identifiers of the rows of the given TableItem's table
+       that pass every modifier (filter) in the chain, in order. The
+       optional tags dict, such as the requesting module and request, is
+       added to the profiling span of each filter.
+    """
+    identifiers = table._table.identifiers()
+    for modifier in modifier_chain:
+        with Profiler.span(type(modifier).__name__ + ".process", "filter",
+            table = table.name, **(tags or dict())):
+            identifiers = modifier.process(table, identifiers)
+    return identifiers
+
+
+def projectionMemo(projection, table, domain_table, ids):
+    """Returns a dict from each of the given ids of the TableItem's table
+       to the list of ids they project to in the domain table, projecting
+       the distinct ids all at once. Returns None for identity
+       projections, which need no dict.
+    """
+    if isinstance(projection, IdentityProjection):
+        return None
+    return projection.make_projection_dict(
+        SubDomain.instantiate(table._table.subdomain(), np.unique(ids)),
+        domain_table._table.subdomain())
+
+
+def aggregateDomain(domain_table, attribute_groups, modifier_chain,
+    attribute_aggregator, tags = None):
+    """Gets the values of the requested attributes, aggregated by the
+       domain of the domain table.
+
+       domain_table
+           TableItem of the domain on which to aggregate. Requested
+           attributes will be projected onto this domain.
+
+       attribute_groups
+           List of (TableItem, list of attribute names) pairs giving the
+           requested attributes of each table.
+
+       modifier_chain
+           List of filters to apply to each table.
+
+       attribute_aggregator
+           Name of the operator for combining all the values landing on
+           each domain id.
+
+       tags
+           Optional dict of tags for the profiling spans of the filters,
+           see filterIdentifiers.
+
+       Returns:
+           ids
+              List of ids from the domain_table.
+
+           values
+               List of values that go with the ids.
+    """
+    # Get mapping of group_by_attributes to their subdomain ID
+    # THIS IS PAINFULLY SLOW
+
+    # This is where we store intermediate values
+    aggregate_values = dict()
+    # and partial aggregates of time series windows
+    aggregate_partials = dict()
+
+    for table, attribute_group in attribute_groups:
+        # Determine if projection exists, if not, skip
+        projection = domain_table.getRun().getProjection(
+            domain_table._table.subdomain(),
+            table._table.subdomain())
+        if projection is None:
+            continue
+
+        # Time series filtered only by time are aggregated from their per
+        # timestep partial sums rather than from their rows
+        window = timeWindow(table, modifier_chain)
+        if window is not None and attribute_aggregator in partial_operator:
+            keys, sums, counts, maxima, minima \
+                = table._table.window_partials(attribute_group, *window)
+            projection_memo = projectionMemo(projection, table,
+                domain_table, keys)
+            for partial in zip(keys, sums, counts, maxima, minima):
+                if projection_memo is None:
+                    domain_ids = [partial[0]]
+                else:
+                    domain_ids = projection_memo[partial[0]]
+                for domain_id in domain_ids:
+                    if domain_id in aggregate_partials:
+                        aggregate_partials[domain_id] = mergePartials(
+                            aggregate_partials[domain_id], partial[1:])
+                    else:
+                        aggregate_partials[domain_id] = partial[1:]
+            continue
+
+        # Apply filters
+        identifiers = filterIdentifiers(table, modifier_chain, tags)
+
+        # Determine the attributes
+        attributes = list(attribute_group)
+        attributes.insert(0, table._table._key) # add key for projections
+
+        # Get the attributes and ids for these identifiers
+        attribute_values = table._table.attributes_by_identifiers(
+            identifiers, attributes, False) # We don't want unique values
+
+        if isinstance(projection, IdentityProjection):
+            # Since the projection is Identity, we don't need to process it
+            for row_values in zip(*attribute_values):
+                domain_id = row_values[0]
+                if domain_id in aggregate_values:
+                    aggregate_values[domain_id].extend(row_values[1:])
+                else:
+                    aggregate_values[domain_id] = list(row_values[1:])
+        else: # Other type of projection
+            # Find relevant projection per id. Each id may appear in 
+            # in multiple rows, so we build this on the unique set of
+            # ids to minimize calculated projections. Then we use 
+            # the built dict to put the rest of the row values in 
+            # the proper place
+            projection_memo = projectionMemo(projection, table,
+                domain_table, attribute_values[0])
+
+            # Collect attributes onto proper domain IDs
+            for row_values in zip(*attribute_values):
+                domain_ids = projection_memo[row_values[0]]
+                for domain_id in domain_ids:
+                    if domain_id in aggregate_values:
+                        aggregate_values[domain_id].extend(row_values[1:])
+                    else:
+                        aggregate_values[domain_id] = list(row_values[1:])
+
+    # Then get the IDs from the group by table that matter
+    # and associate them with these attributes
+    values = list()
+    ids = list()
+    for domain_id, agge_values in aggregate_values.iteritems():
+        if domain_id in aggregate_partials:
+            aggregate_partials[domain_id] = mergePartials(
+                aggregate_partials[domain_id], (sum(agge_values),
+                len(agge_values), max(agge_values), min(agge_values)))
+            continue
+        ids.append(domain_id)
+        values.append(operator[attribute_aggregator](agge_values))
+
+    for domain_id, partial in aggregate_partials.iteritems():
+        ids.append(domain_id)
+        values.append(partial_operator[attribute_aggregator](partial))
+
+    return ids, values
@@ -0,0 +1,228 @@
+import os
+import re
+import sys
+import argparse
+import traceback
+import multiprocessing
+import numpy as np
+from Query import *
+from DataItems import *
+from Filter import *
+import Aggregation
+
+# Headless evaluation of Boxfish requests. Each run is loaded, filtered and
+# aggregated onto its node and link tables exactly as the Torus modules
+# would request it, and the resulting arrays are written to .npz files.
+
+# Run meta file hardware entries naming the domain table of each domain
+domain_tables = {
+    'nodes' : 'coords_table',
+    'links' : 'link_coords_table',
+}
+
+clause_pattern = re.compile(r'^\s*(\w+)\s*(<=|>=|!=|=|<|>)\s*(.+?)\s*$')
+
+
+def parseValue(text):
+    """Converts the text of a clause value to an int or float if it is
+       one, otherwise to a string with any surrounding quotes removed.
+    """
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text.strip('\'"')
+
+
+def parseClause(text):
+    """Parses a filter clause of the form 'attribute relation value', for
+       example 'time = 5' or "name != 'ycomm'", into a Clause object.
+    """
+    match = clause_pattern.match(text)
+    if match is None:
+        raise ValueError("Cannot parse filter clause: " + text)
+
+    attribute, relation, value = match.groups()
+    return Clause(relation, TableAttribute(attribute), parseValue(value))
+
+
+def buildFilters(clauses):
+    """Returns the modifier chain requiring all given clause strings to
+       hold.
+    """
+    if not clauses:
+        return list()
+
+    conditions = [parseClause(clause) for clause in clauses]
+    if len(conditions) == 1:
+        return [SimpleWhereFilter(conditions[0])]
+    return [SimpleWhereFilter(Clause('and', *conditions))]
+
+
+def runName(filename):
+    """Returns the name output files of the run in the meta file start
+       with.
+    """
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def outputDirectories(filenames, output):
+    """Returns the directory under output into which the outputs of each
+       run meta file go. The directories of the meta files below their
+       common directory are mirrored, so runs of the same name from
+       different directories of a sweep do not overwrite each other.
+       Raises ValueError if two runs would still write the same files.
+    """
+    directories = [os.path.dirname(os.path.abspath(filename))
+        for filename in filenames]
+    common = os.path.dirname(os.path.commonprefix([directory + os.sep
+        for directory in directories]))
+
+    targets = dict()
+    outputs = list()
+    for filename, directory in zip(filenames, directories):
+        target = os.path.normpath(os.path.join(output,
+            os.path.relpath(directory, common)))
+        key = (target, runName(filename))
+        if key in targets:
+            raise ValueError("Runs " + targets[key] + " and " + filename
+                + " would write the same output files")
+        targets[key] = filename
+        outputs.append(target)
+    return outputs
+
+
+def evaluateRun(filename, clauses, domain_attributes, aggregator, output):
+    """Loads the run in the given meta file and aggregates each requested
+       attribute onto its domain. Writes one .npz file per domain into the
+       output directory holding, for each attribute, the sorted domain ids
+       (attribute_ids) and the aggregated values (attribute). Domains for
+       which the run has none of the attributes are skipped and reported.
+       Returns the list of files written.
+
+       domain_attributes
+           List of (domain, list of attribute names) pairs where domain is
+           a key of domain_tables.
+    """
+    run = loadRun(filename)
+    hardware = run["hardware"]
+    modifier_chain = buildFilters(clauses)
+    run_name = runName(filename)
+
+    written = list()
+    for domain, attributes in domain_attributes:
+        if not attributes:
+            continue
+
+        if hardware is None or domain_tables[domain] not in hardware:
+            print run.name, "has no", domain_tables[domain], \
+                "! Skipping", domain, "..."
+            continue
+        domain_table = run.getTable(hardware[domain_tables[domain]])
+
+        arrays = dict()
+        for attribute in attributes:
+            table = run.findAttribute(attribute, domain_table)
+            if table is None:
+                print run.name, "has no attribute", attribute, "! Skipping..."
+                continue
+
+            ids, values = Aggregation.aggregateDomain(domain_table,
+                [(table, [attribute])], modifier_chain, aggregator)
+            order = np.argsort(ids)
+            arrays[attribute + "_ids"] = np.array(ids)[order]
+            arrays[attribute] = np.array(values)[order]
+
+        if not arrays:
+            print run.name, "has none of the", domain, "attributes", \
+                ", ".join(attributes), "! Skipping", domain, "file..."
+            continue
+
+        path = os.path.join(output, run_name + "_" + domain + ".npz")
+        np.savez(path, **arrays)
+        written.append(path)
+
+    return written
+
+
+def evaluateJob(job):
+    """Runs evaluateRun on a tuple of its arguments, catching any error so
+       one bad run does not stop the others. Returns the run filename, the
+       files written and the error text or None.
+    """
+    try:
+        return job[0], evaluateRun(*job), None
+    except Exception:
+        return job[0], list(), traceback.format_exc()
+
+
+def main(argv = None):
+    """Entry point of boxfish-batch. Returns 1 if any run failed."""
+    parser = argparse.ArgumentParser(description = "Aggregates attributes "
+        + "of Boxfish runs onto their nodes and links without the GUI.")
+    parser.add_argument('runs', nargs = '+', metavar = 'META',
+        help = "run meta files")
+    parser.add_argument('-n', '--node-attribute', action = 'append',
+        default = list(), dest = 'node_attributes', metavar = 'ATTRIBUTE',
+        help = "attribute to aggregate onto the nodes (coords_table)")
+    parser.add_argument('-l', '--link-attribute', action = 'append',
+        default = list(), dest = 'link_attributes', metavar = 'ATTRIBUTE',
+        help = "attribute to aggregate onto the links (link_coords_table)")
+    parser.add_argument('-f', '--filter', action = 'append',
+        default = list(), dest = 'filters', metavar = 'CLAUSE',
+        help = "filter clause such as 'time = 5', all clauses must hold")
+    parser.add_argument('-a', '--aggregator', default = 'mean',
+        choices = sorted(Aggregation.operator.keys()),
+        help = "operator combining the values landing on one id")
+    parser.add_argument('-o', '--output', default = '.',
+        help = "directory in which to write the .npz files, in the same "
+        + "sub-directories as the runs")
+    parser.add_argument('-j', '--jobs', type = int,
+        default = multiprocessing.cpu_count(),
+        help = "number of runs to process in parallel")
+    args = parser.parse_args(argv)
+
+    # Check the clauses before starting any work
+    try:
+        buildFilters(args.filters)
+    except ValueError, e:
+        parser.error(str(e))
+
+    try:
+        outputs = outputDirectories(args.runs, args.output)
+    except ValueError, e:
+        parser.error(str(e))
+    # Made here rather than by the jobs, which would race
+    for output in outputs:
+        if not os.path.isdir(output):
+            os.makedirs(output)
+
+    domain_attributes = [('nodes', args.node_attributes),
+        ('links', args.link_attributes)]
+    jobs = [(os.path.abspath(filename), args.filters, domain_attributes,
+        args.aggregator, output) for filename, output
+        in zip(args.runs, outputs)]
+
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        results = pool.imap_unordered(evaluateJob, jobs)
+    else:
+        pool = None
+        results = (evaluateJob(job) for job in jobs)
+
+    failed = 0
+    for filename, written, error in results:
+        if error is None:
+            for path in written:
+                print path
+        else:
+            failed += 1
+            print >> sys.stderr, "Failed on", filename
+            print >> sys.stderr, error
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return 1 if failed else 0
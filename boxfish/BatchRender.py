@@ -0,0 +1,266 @@
+import os
+import re
+import sys
+import argparse
+import itertools
+import traceback
+import multiprocessing
+from PySide.QtCore import *
+from PySide.QtGui import *
+from MainWindow import MainWindow
+from ModuleFrame import ModuleFrame
+from gl.GLWidget import GLWidget
+from ColorMaps import ColorMap, getMapNames
+from Batch import domain_tables, runName, outputDirectories
+from mods.Torus3dModule import Torus3dAgent
+from mods.Torus5dModule import Torus5dAgent
+
+# Offscreen rendering of the torus views. Each run is opened in a hidden
+# MainWindow holding one frame per requested view. The views are painted
+# into framebuffer objects and saved as PNG files for every combination
+# of node attribute, link attribute and color map.
+#
+# The views request the same attributes of the same run, so aggregation
+# happens once per run and attribute: later views and color maps are
+# served from the ModuleRequest result cache.
+
+default_views = ["3D Torus - 3D View", "3D Torus - 2D View", "5D Torus"]
+
+# Each QApplication must be created in the process that uses it
+application = None
+
+name_pattern = re.compile(r'[^\w.-]+')
+
+
+def startApplication():
+    """Creates the QApplication of this process if there is none."""
+    global application
+    application = QApplication.instance()
+    if application is None:
+        application = QApplication([sys.argv[0]])
+
+
+def torusDimension(agent):
+    """Returns the number of coords a run needs for the given agent's
+       view, or None if the view has no such requirement.
+    """
+    if isinstance(agent, Torus3dAgent):
+        return 3
+    elif isinstance(agent, Torus5dAgent):
+        return 5
+    return None
+
+
+def fileName(*parts):
+    """Joins the given name parts into a file name without spaces or
+       path separators.
+    """
+    return "_".join(name_pattern.sub("-", part) for part in parts if part)
+
+
+def attributeIndex(datatree, run, attribute, domain):
+    """Returns the DataTree index of the given attribute as it would be
+       found for the given domain of the run, or None if the run has no
+       such attribute.
+    """
+    domain_table = run.getTable(run["hardware"][domain_tables[domain]])
+    table = run.findAttribute(attribute, domain_table)
+    if table is None:
+        return None
+
+    for item in table._children:
+        if item.name == attribute:
+            return datatree.indexOfItem(item)
+    return None
+
+
+def setColorMap(agent, color_map_name):
+    """Sets the node and link color maps of the agent's scenes as the
+       color tab would.
+    """
+    for tag in ["nodes", "links"]:
+        scene = agent.requestScene(tag)
+        scene.color_map = ColorMap(color_map_name)
+        scene.processed = False
+        scene.announceChange()
+
+
+def renderRun(filename, node_attributes, link_attributes, views,
+    color_maps, size, output):
+    """Opens the run in the given meta file and renders each view for
+       every combination of the given node attributes, link attributes
+       and color maps. Returns the list of image files written.
+    """
+    startApplication()
+    window = MainWindow()
+    window.openRun(filename)
+    datatree = window.datatree
+    run = datatree.getItem(datatree.index(0, 0, QModelIndex()))
+    run_name = runName(filename)
+    hardware = run["hardware"]
+
+    coords = list()
+    if hardware is not None and "coords" in hardware:
+        coords = hardware["coords"]
+
+    frames = list()
+    for view in views:
+        frame = ModuleFrame.instantiate(view, window.filter_box,
+            window.filter_box, view)
+        if frame is None:
+            raise ValueError("No view named " + view)
+
+        dimension = torusDimension(frame.agent)
+        if dimension is not None and dimension != len(coords):
+            print run.name, "is not a", str(dimension) + "D torus!", \
+                "Skipping", view, "..."
+            frame.agent.delete()
+            frame.deleteLater()
+            continue
+
+        frame.agent.refreshSceneInformation()
+        widgets = frame.view.findChildren(GLWidget)
+        if isinstance(frame.view, GLWidget):
+            widgets = [frame.view]
+        frames.append((view, frame, widgets))
+
+    # Look up the attributes, skipping those the run does not have
+    domain_indices = dict()
+    for domain, attributes in [("nodes", node_attributes),
+        ("links", link_attributes)]:
+        domain_indices[domain] = list()
+        for attribute in attributes:
+            index = None
+            if hardware is not None and domain_tables[domain] in hardware:
+                index = attributeIndex(datatree, run, attribute, domain)
+            if index is None:
+                print run.name, "has no", domain, "attribute", attribute, \
+                    "! Skipping..."
+                continue
+            domain_indices[domain].append((attribute, index))
+
+    combinations = itertools.product(domain_indices["nodes"] or [None],
+        domain_indices["links"] or [None])
+
+    written = list()
+    width, height = size
+    for node, link in combinations:
+        names = [run_name]
+        for view, frame, widgets in frames:
+            if node is not None:
+                frame.droppedDataSignal.emit([node[1]], "nodes")
+            if link is not None:
+                frame.droppedDataSignal.emit([link[1]], "links")
+        if node is not None:
+            names.append(node[0])
+        if link is not None:
+            names.append(link[0])
+
+        for color_map_name in color_maps:
+            for view, frame, widgets in frames:
+                setColorMap(frame.agent, color_map_name)
+                for widget in widgets:
+                    suffix = None
+                    if len(widgets) > 1:
+                        suffix = type(widget).__name__
+                    path = os.path.join(output, fileName(*(names
+                        + [color_map_name, view, suffix])) + ".png")
+                    widget.renderImage(width, height).save(path)
+                    written.append(path)
+
+    window.deleteLater()
+    return written
+
+
+def renderJob(job):
+    """Runs renderRun on a tuple of its arguments, catching any error so
+       one bad run does not stop the others. Returns the run filename, the
+       files written and the error text or None.
+    """
+    try:
+        return job[0], renderRun(*job), None
+    except Exception:
+        return job[0], list(), traceback.format_exc()
+
+
+def parseSize(text):
+    """Parses an image size of the form WIDTHxHEIGHT."""
+    try:
+        width, height = [int(value) for value in text.lower().split("x")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Size must look like 800x600")
+    return width, height
+
+
+def main(argv = None):
+    """Entry point of boxfish-render. Returns 1 if any run failed."""
+    parser = argparse.ArgumentParser(description = "Renders the torus "
+        + "views of Boxfish runs to PNG files without showing the GUI.")
+    parser.add_argument('runs', nargs = '+', metavar = 'META',
+        help = "run meta files")
+    parser.add_argument('-n', '--node-attribute', action = 'append',
+        default = list(), dest = 'node_attributes', metavar = 'ATTRIBUTE',
+        help = "attribute with which to color the nodes")
+    parser.add_argument('-l', '--link-attribute', action = 'append',
+        default = list(), dest = 'link_attributes', metavar = 'ATTRIBUTE',
+        help = "attribute with which to color the links")
+    parser.add_argument('-v', '--view', action = 'append', default = list(),
+        dest = 'views', metavar = 'MODULE',
+        help = "display name of a view module, defaults to all torus views")
+    parser.add_argument('-c', '--color-map', action = 'append',
+        default = list(), dest = 'color_maps', choices = getMapNames(),
+        metavar = 'MAP', help = "color map with which to render")
+    parser.add_argument('-s', '--size', type = parseSize,
+        default = (800, 600), help = "image size as WIDTHxHEIGHT")
+    parser.add_argument('-o', '--output', default = '.',
+        help = "directory in which to write the images, in the same "
+        + "sub-directories as the runs")
+    parser.add_argument('-j', '--jobs', type = int,
+        default = multiprocessing.cpu_count(),
+        help = "number of runs to render in parallel")
+    args = parser.parse_args(argv)
+
+    if not args.node_attributes and not args.link_attributes:
+        parser.error("At least one node or link attribute is required")
+
+    # Runs of the same name from different directories of a sweep go
+    # into different directories rather than overwriting each other
+    try:
+        outputs = outputDirectories(args.runs, args.output)
+    except ValueError, e:
+        parser.error(str(e))
+    for output in outputs:
+        if not os.path.isdir(output):
+            os.makedirs(output)
+
+    views = args.views or default_views
+    color_maps = args.color_maps or [ColorMap().color_map_name]
+    jobs = [(os.path.abspath(filename), args.node_attributes,
+        args.link_attributes, views, color_maps, args.size, output)
+        for filename, output in zip(args.runs, outputs)]
+
+    # Workers are forked before any QApplication exists and create their
+    # own in renderRun.
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)),
+            maxtasksperchild = 1)
+        results = pool.imap_unordered(renderJob, jobs)
+    else:
+        pool = None
+        results = (renderJob(job) for job in jobs)
+
+    failed = 0
+    for filename, written, error in results:
+        if error is None:
+            for path in written:
+                print path
+        else:
+            failed += 1
+            print >> sys.stderr, "Failed on", filename
+            print >> sys.stderr, error
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return 1 if failed else 0
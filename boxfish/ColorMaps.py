@@ -1,16 +1,14 @@
 import sys
-import matplotlib.colors
-import matplotlib.cm as cm
+import numpy as np
 
 from PySide.QtCore import Slot,Signal,QObject,Qt
 from PySide.QtGui import QWidget,QLabel,QPixmap,QLineEdit,QHBoxLayout,qRgba,\
     QImage,QVBoxLayout,QComboBox,QCheckBox,QSpacerItem,QIntValidator
 
-from OpenGL.GL import *
-from OpenGL.GL.glget import *
-from boxfish.gl.glutils import *
-from boxfish.gl.GLWidget import TextDraw
-#from OpenGL.GLUT import glutStrokeCharacter, GLUT_STROKE_ROMAN
+# matplotlib is only imported once a color map is first used so that it
+# does not slow down startup. Our own maps are kept as segment data
+# (name given to matplotlib, segment dict) until then.
+boxfish_map_data = dict()
 
 # maybe instead of separate we should use register_cmap()
 boxfish_maps = dict()
@@ -31,8 +29,7 @@ bdict = {'red':   ((0.0, 0.686,    0.686),
     (1.0, 0.75,    0.75)),
     'blue':  ((0.0, 0.765,    0.765),
     (1.0, 0.482,    0.483))}
-BFPuGrmap = matplotlib.colors.LinearSegmentedColormap('BFPuGrmap',bdict,256)
-boxfish_maps['BFPuGr'] = BFPuGrmap
+boxfish_map_data['BFPuGr'] = ('BFPuGrmap', bdict)
 
 # Example 2
 # Goes from blue to red with yellow in the middle
@@ -45,8 +42,7 @@ bdict = {'red':   ((0.0, 145.0/255.0,    145.0/255.0),
     'blue':  ((0.0, 219.0/255.0,  219.0/255.0),
     (0.5, 191.0/255.0, 191.0/255.0),
     (1.0, 89.0/255.0, 89.0/255.0))}
-BFBlYeRdmap = matplotlib.colors.LinearSegmentedColormap('BFBlYeRdmap',bdict,256)
-boxfish_maps['BFBlYeRd'] = BFBlYeRdmap
+boxfish_map_data['BFBlYeRd'] = ('BFBlYeRdmap', bdict)
 
 # Example 3
 # Blue, Red with grey in the middle
@@ -59,8 +55,7 @@ bdict = {'red':   ((0.0, 0.0,    0.0),
     'blue':  ((0.0, 1.0,  1.0),
     (0.5, 0.83, 0.83),
     (1.0, 0.0, 0.0))}
-BFBlGyRdmap = matplotlib.colors.LinearSegmentedColormap('BFBlGyRdmap',bdict,256)
-boxfish_maps['BFBlGyRd'] = BFBlGyRdmap
+boxfish_map_data['BFBlGyRd'] = ('BFBlGyRdmap', bdict)
 
 #   Collin's for VPA
 #   Dark Blue [0.0] = (0, 70, 195), Light Blue [0.4] = (0, 175, 225), Orange [0.6] = (225, 150, 0), Red [1.0] = (255, 60, 0)
@@ -76,8 +71,7 @@ bdict = {'red':   ((0.0, 0.0, 0.0),
     (0.4, 225.0/255.0, 225.0/255.0),
     (0.6, 0.0, 0.0),
     (1.0, 0.0, 0.0))}
-BlGrOrRdmap = matplotlib.colors.LinearSegmentedColormap('BlGrOrRdmap',bdict,256)
-boxfish_maps['BlGrOrRd'] = BlGrOrRdmap
+boxfish_map_data['BlGrOrRd'] = ('BlGrOrRdmap', bdict)
 
 
 # Rubik color map
@@ -189,15 +183,14 @@ bdict = {'red': (
         (0.96875, 1.0, 1.0), # blueberry (other half)
         (1.0, 1.0, 1.0)) # blueberry (other half)
     }
-Rubikmap = matplotlib.colors.LinearSegmentedColormap('Rubik',bdict,256)
-boxfish_maps['Rubik'] = Rubikmap
+boxfish_map_data['Rubik'] = ('Rubik', bdict)
 
 
 def hasMap(colormap):
     """Returns True if the given colormap String is found in our list
        of custom colormaps.
     """
-    return colormap in boxfish_maps
+    return colormap in boxfish_map_data
 
 def getMap(colormap):
     """Returns the matplotlib colormap object associated with the given
@@ -205,15 +198,28 @@ def getMap(colormap):
        matplotlib colormaps.
     """
     if hasMap(colormap):
+        if colormap not in boxfish_maps:
+            import matplotlib.colors
+            name, segment_data = boxfish_map_data[colormap]
+            boxfish_maps[colormap] = \
+                matplotlib.colors.LinearSegmentedColormap(name,
+                segment_data, 256)
         return boxfish_maps[colormap]
     else:
+        import matplotlib.cm as cm
         return cm.get_cmap(colormap)
 
 map_names = []
-for mpl_map in cm.datad:
-    map_names.append(mpl_map)
-map_names.extend(boxfish_maps.keys())
-map_names.sort()
+def getMapNames():
+    """Returns the sorted names of all colormaps we can use. The list is
+       built on first call.
+    """
+    if not map_names:
+        import matplotlib.cm as cm
+        map_names.extend(cm.datad)
+        map_names.extend(boxfish_map_data.keys())
+        map_names.sort()
+    return map_names
 
 class ColorMap(object):
     """This class wraps colormaps for extended options on how colors are
@@ -238,7 +244,7 @@ class ColorMap(object):
                color cycled.
         """
         super(ColorMap, self).__init__()
-        self.color_map = getMap(base_color_map)
+        self._color_map = None
         self.color_map_name = base_color_map
 
         # If color_step is not 0, we sample the color bar at each
@@ -247,6 +253,15 @@ class ColorMap(object):
         self.color_step = color_step
         self._step_size = step_size
 
+    @property
+    def color_map(self):
+        """The matplotlib colormap this object is based around. It is
+           looked up on first use.
+        """
+        if self._color_map is None:
+            self._color_map = getMap(self.color_map_name)
+        return self._color_map
+
     @property
     def step_size(self):
         """The value separating two neighboring elements when color cycling
@@ -296,6 +311,28 @@ class ColorMap(object):
             stepped_value = round(value / self.step_size) % self.color_step
             return self.color_map(1.0 / self.color_step * stepped_value)
 
+    def getColors(self, values, preempt_range = 0):
+        """Vectorized getColor. Takes an array of values and returns an
+           array of RGBA colors with one more dimension (of length 4).
+        """
+        values = np.asarray(values, dtype=float)
+        if self.color_step == 0:
+            return self.color_map(values)
+        elif preempt_range != 0:
+            stepped_values = round_half_up(values * preempt_range) \
+                % self.color_step
+        else:
+            stepped_values = round_half_up(values / self.step_size) \
+                % self.color_step
+        return self.color_map(1.0 / self.color_step * stepped_values)
+
+
+def round_half_up(values):
+    """Rounds like the built-in round (halves away from zero) rather than
+       numpy's round (halves to even) so getColors matches getColor.
+    """
+    return np.sign(values) * np.floor(np.abs(values) + 0.5)
+
 class ColorBarImage(QImage):
     """QImage representing the color bar, will incorporate cycling."""
 
@@ -386,8 +423,9 @@ class ColorMapWidget(QWidget):
             self.color_map, 180, 15)))
 
         self.mapCombo = QComboBox(self)
-        self.mapCombo.addItems(map_names)
-        self.mapCombo.setCurrentIndex(map_names.index(self.color_map_name))
+        self.mapCombo.addItems(getMapNames())
+        self.mapCombo.setCurrentIndex(
+            getMapNames().index(self.color_map_name))
         self.mapCombo.currentIndexChanged.connect(self.colorbarChange)
 
         layout.addWidget(label)
@@ -407,7 +445,7 @@ class ColorMapWidget(QWidget):
                Index of the selected colormap.
         """
         indx = self.mapCombo.currentIndex()
-        self.color_map_name = map_names[indx]
+        self.color_map_name = getMapNames()[indx]
         self.color_map = getMap(self.color_map_name)
         self.colorbar.setPixmap(QPixmap.fromImage(ColorBarImage(
             self.color_map, 180, 12)))
@@ -471,63 +509,3 @@ def rgbStylesheetString(color):
     """Creates a stylesheet style string out of an rgb color."""
     return "rgb(" + str(color[0]) + "," +  str(color[1]) + ","\
         + str(color[2]) + ")"
-
-
-def drawGLColorBar(colors, bar_x, bar_y, bar_width, bar_height, label = "", total_height = 0):
-    """Draws a single colorbar at bar_x, bar_y with width bar_width
-       and height bar_height.
-
-       colors
-           A list of sampled 11 sampled colors spanning the colormap.
-    """
-    setup_overlay2D(bar_x, bar_y, bar_width, bar_height + 12)
-
-    with glMatrix():
-        glLoadIdentity()
-        glTranslatef(bar_x, bar_y, 0)
-
-        segment_size = int(float(bar_height) / 10.0)
-
-        for i in range(10):
-
-            with glMatrix():
-                glTranslatef(0, i*segment_size, 0)
-                with glSection(GL_QUADS):
-                    glColor3f(colors[i][0], colors[i][1], colors[i][2])
-                    glVertex3f(0, 0, 0)
-                    glVertex3f(bar_width, 0, 0)
-                    glColor3f(colors[i+1][0], colors[i+1][1],
-                        colors[i+1][2])
-                    glVertex3f(bar_width, segment_size, 0)
-                    glVertex3f(0, segment_size, 0)
-
-
-        # black box around gradient
-        prev_lineWidth = glGetFloatv(GL_LINE_WIDTH)
-        glLineWidth(1.0)
-        glColor3f(0.0, 0.0, 0.0)
-        with glMatrix():
-            with glSection(GL_LINES):
-                glVertex3f(0.01, 0.01, 0.01)
-                glVertex3f(bar_width, 0.01, 0.01)
-                glVertex3f(bar_width, 0.01, 0.01)
-                glVertex3f(bar_width, bar_height, 0.01)
-                glVertex3f(bar_width, bar_height, 0.01)
-                glVertex3f(0.01, bar_height, 0.01)
-                glVertex3f(0.01, bar_height, 0.01)
-                glVertex3f(0.01, 0.01, 0.01)
-
-        # TODO: Make this whole section much less magical
-        #default_text_height = 152.38
-        #scale_factor = 1.0 / default_text_height * segment_size
-        #scale_factor = 0.08
-        #if len(label) > 0:
-        #    with glMatrix():
-        #        glTranslatef(7, bar_height + 3, 0.2)
-        #        glScalef(scale_factor, scale_factor, scale_factor)
-        #        for c in label:
-        #            glutStrokeCharacter(GLUT_STROKE_ROMAN, ord(c))
-        #glLineWidth(prev_lineWidth)
-
-        if len(label) > 0:
-            return TextDraw(label, bar_x + 6, total_height - (bar_y + bar_height + 3))
@@ -0,0 +1,274 @@
+import numpy as np
+from Table import *
+from SubDomain import *
+from Projection import *
+from DataItems import *
+
+# Derived runs compare two runs of the same application, for example before
+# and after a mapping change. Each table of the first run is joined with the
+# table of the same name in the second run on its key and any match
+# attributes, and every measured attribute gets columns for the values in
+# both runs, their difference, ratio and normalized difference. The result
+# is a RunItem like any other, with its own projections, so views can color
+# by the comparison columns directly. Rows found in only one run have 0 for
+# the other run's values; the count_a and count_b columns tell these apart
+# from measured zeros.
+
+
+def difference(first, second):
+    """Second minus first."""
+    return second - first
+
+def ratio(first, second):
+    """Second over first, 0 where first is 0."""
+    result = np.zeros(len(first))
+    nonzero = first != 0
+    result[nonzero] = second[nonzero] / first[nonzero]
+    return result
+
+def normalized(first, second):
+    """Difference over the sum of magnitudes, between -1 and 1. This is 0
+       where both are 0.
+    """
+    result = np.zeros(len(first))
+    scale = np.abs(first) + np.abs(second)
+    nonzero = scale != 0
+    result[nonzero] = (second - first)[nonzero] / scale[nonzero]
+    return result
+
+# (column suffix, function of the first and second values), in column order
+comparisons = [
+    ('diff', difference),
+    ('ratio', ratio),
+    ('norm', normalized),
+]
+
+# Columns counting the rows joined from the first and second table
+counts = ['count_a', 'count_b']
+
+
+def joinGroups(first, second, attributes):
+    """Numbers the distinct combinations of the given attributes over the
+       rows of both record arrays. Returns the group number of each row of
+       first, of each row of second, and the number of groups.
+    """
+    columns = [np.concatenate((first[attribute], second[attribute]))
+        for attribute in attributes]
+    # lexsort sorts by the last key first
+    order = np.lexsort(columns[::-1])
+
+    starts = np.zeros(len(order), dtype = bool)
+    starts[:1] = True
+    for column in columns:
+        column = column[order]
+        starts[1:] |= column[1:] != column[:-1]
+
+    groups = np.empty(len(order), dtype = int)
+    groups[order] = np.cumsum(starts) - 1
+    return groups[:len(first)], groups[len(first):], int(starts.sum())
+
+def groupAggregate(values, groups, count, aggregator = 'mean'):
+    """Aggregates the values by group number with 'sum' or 'mean'. Groups
+       without values are 0.
+    """
+    sums = np.bincount(groups, weights = values.astype(float),
+        minlength = count)
+    if aggregator == 'sum':
+        return sums
+    elif aggregator != 'mean':
+        raise ValueError("Derived runs aggregate by sum or mean, not "
+            + aggregator)
+
+    rows = np.bincount(groups, minlength = count)
+    means = np.zeros(count)
+    means[rows > 0] = sums[rows > 0] / rows[rows > 0]
+    return means
+
+
+def compareTables(first, second, match = None, carry = None,
+    aggregator = 'mean'):
+    """Joins two Tables of the same subdomain on the key of the first and
+       the match attributes, and compares them. Returns the record array of
+       the derived table, with one row per distinct key and match values
+       found in either table and these columns:
+
+           the key and match attributes
+
+           the carry attributes, like coordinates, which identify rather
+           than measure and are taken from the first row found
+
+           count_a, count_b
+               the number of rows joined from the first and second table,
+               0 where the row is missing from that table
+
+           attribute_a, attribute_b
+               the aggregated values of every other numeric attribute in
+               the first and second table, 0 if the row is missing
+
+           attribute_diff, attribute_ratio, attribute_norm
+               their comparisons, see the comparisons list
+    """
+    key = first._key
+    shared = [attribute for attribute in first.attributes()
+        if attribute in second.attributes()]
+    if key not in shared:
+        raise ValueError("Cannot join tables that do not share the key "
+            + key)
+
+    join = [key] + [attribute for attribute in (match or list())
+        if attribute in shared and attribute != key]
+    first_groups, second_groups, count = joinGroups(first._data,
+        second._data, join)
+
+    # Index of the first row of each group over both tables. The sort is
+    # stable so rows of the first table are preferred.
+    order = np.argsort(np.concatenate((first_groups, second_groups)),
+        kind = 'mergesort')
+    starts = order[np.searchsorted(np.concatenate((first_groups,
+        second_groups))[order], np.arange(count))]
+
+    names = list()
+    columns = list()
+    compared = list()
+    for attribute in shared:
+        if attribute in counts:
+            # Counts of an earlier comparison, replaced by this one's
+            continue
+        elif attribute in join or attribute in (carry or list()):
+            names.append(attribute)
+            columns.append(np.concatenate((first._data[attribute],
+                second._data[attribute]))[starts])
+        elif np.issubdtype(first._data[attribute].dtype, np.number):
+            compared.append(attribute)
+
+    names.extend(counts)
+    columns.extend([np.bincount(first_groups, minlength = count),
+        np.bincount(second_groups, minlength = count)])
+
+    for attribute in compared:
+        first_values = groupAggregate(first._data[attribute], first_groups,
+            count, aggregator)
+        second_values = groupAggregate(second._data[attribute],
+            second_groups, count, aggregator)
+        names.extend([attribute + '_a', attribute + '_b'])
+        columns.extend([first_values, second_values])
+        for suffix, function in comparisons:
+            names.append(attribute + '_' + suffix)
+            columns.append(function(first_values, second_values))
+
+    return np.rec.fromarrays(columns, names = names)
+
+
+def hardwareAttributes(run):
+    """Returns the attributes naming hardware coordinates in the run's
+       meta data. These are carried into derived tables rather than
+       compared so that node link projections still work.
+    """
+    hardware = run["hardware"]
+    if not hardware:
+        return list()
+
+    attributes = list(hardware.get("coords", list()))
+    for key in ["source_coords", "destination_coords"]:
+        attributes.extend(hardware.get(key, dict()).values())
+    return attributes
+
+def groupItem(run, name):
+    """Returns the child GroupItem of the run with the given name."""
+    for child in run._children:
+        if child.name == name:
+            return child
+    return None
+
+
+def deriveRun(first, second, match = None, aggregator = 'mean', name = None):
+    """Returns a new RunItem comparing the second run against the first.
+       Tables of the first run with a table of the same name and subdomain
+       in the second are compared with compareTables. Projections are
+       those of the first run, made anew on the derived tables where they
+       depend on the run.
+    """
+    metadata = dict(first._metadata or dict())
+    metadata['derived'] = { 'first' : first.name, 'second' : second.name,
+        'match' : list(match or list()), 'aggregator' : aggregator }
+    if name is None:
+        name = second.name + " - " + first.name
+
+    runItem = RunItem(name, metadata)
+    tablesItem = GroupItem("tables", parent = runItem)
+    projectionsItem = GroupItem("projections", parent = runItem)
+
+    carry = hardwareAttributes(first)
+    for tableItem in groupItem(first, "tables")._children:
+        other = second.getTable(tableItem.name)
+        if other is None \
+            or other._table.subdomain() != tableItem._table.subdomain():
+            continue
+
+        data = compareTables(tableItem._table, other._table, match, carry,
+            aggregator)
+        atable = Table()
+        atable.fromRecArray(tableItem._table._domainType,
+            tableItem._table._key, data)
+        createTableItem(tableItem.name, atable,
+            dict(tableItem._metadata or dict()), tablesItem)
+
+    for projectionItem in groupItem(first, "projections")._children:
+        # Table projections don't depend on the run and can be shared
+        aprojection = projectionItem._projection
+        if not isinstance(aprojection, TableProjection):
+            meta = projectionItem._metadata
+            aprojection = Projection.instantiate(meta['type'],
+                SubDomain.instantiate(aprojection.source),
+                SubDomain.instantiate(aprojection.destination),
+                run = runItem, **meta)
+        ProjectionItem(projectionItem.name, aprojection,
+            projectionItem._metadata, projectionsItem)
+
+    runItem.refreshSubdomains()
+    createSubDomainTables(runItem, projectionsItem, tablesItem)
+    return runItem
+
+
+class DerivedRuns(object):
+    """Cache of derived runs. A derived run is made again when either of
+       its source runs has changed since, see RunItem.changed().
+    """
+
+    def __init__(self):
+        # (first, second, match, aggregator) -> (versions, derived run)
+        self.runs = dict()
+
+    def key(self, first, second, match, aggregator):
+        return (id(first), id(second), tuple(match or list()), aggregator)
+
+    def get(self, first, second, match = None, aggregator = 'mean'):
+        """Returns the derived run comparing second against first and
+           whether it was made by this call rather than found in the cache.
+        """
+        key = self.key(first, second, match, aggregator)
+        versions = (first.version, second.version)
+        if key in self.runs:
+            cached_versions, derived = self.runs[key]
+            if cached_versions == versions:
+                return derived, False
+
+        derived = deriveRun(first, second, match, aggregator)
+        derived.sources = (first, second)
+        self.runs[key] = (versions, derived)
+        return derived, True
+
+    def dependents(self, run):
+        """Returns the list of (key, derived run) cached from the given
+           source run.
+        """
+        return [(key, derived) for key, (versions, derived)
+            in self.runs.items() if run in derived.sources]
+
+    def discard(self, run):
+        """Drops the derived runs made from the given source run and the
+           run itself if it is derived.
+        """
+        for key, (versions, derived) in self.runs.items():
+            if run is derived or run in derived.sources:
+                del self.runs[key]
@@ -1,9 +1,8 @@
-from PySide.QtCore import *
-from PySide.QtGui import *
-from FilterCoupler import *
+import numpy as np
 from Query import *
+from TimeSeries import TimeSeriesTable
 
-class Filter(QObject):
+class Filter(object):
     """This class represents a filter on a data stream/query."""
 
     def __init__(self):
@@ -17,6 +16,13 @@ class Filter(QObject):
         """
         raise NotImplementedError("Filter has no process method")
 
+    def cacheKey(self):
+        """Returns a hashable key identifying the rows this filter keeps,
+           so results computed through it can be cached, or None if the
+           filter cannot be identified this way.
+        """
+        return None
+
 
 class SimpleWhereFilter(Filter):
     """A filter constructed out of a Clause object."""
@@ -34,3 +40,73 @@ class SimpleWhereFilter(Filter):
            identifiers.
         """
         return table.evaluate(self.conditions, identifiers)
+
+
+class ValueFilter(SimpleWhereFilter):
+    """A SimpleWhereFilter keeping only the rows where an attribute equals
+       a value. When the table has that attribute, the rows are found
+       through the table's precomputed value partition rather than by
+       evaluating the clause over every row.
+    """
+
+    def __init__(self, attribute, value):
+        """Construct a ValueFilter for attribute = value."""
+        super(ValueFilter, self).__init__(
+            Clause('=', TableAttribute(attribute), value))
+
+        self.attribute = attribute
+        self.value = value
+
+    def process(self, table, identifiers):
+        """Given a TableItem from the DataTree and a list of identifiers
+           to consider from that TableItem's table, returns the filtered
+           list of identifiers with the attribute equal to the value.
+        """
+        if table.hasAttribute(self.attribute):
+            return table._table.subset_by_value(identifiers, self.attribute,
+                self.value)
+        return super(ValueFilter, self).process(table, identifiers)
+
+    def cacheKey(self):
+        """Returns the key identifying rows where attribute = value."""
+        return ('=', self.attribute, self.value)
+
+
+class TimeRangeFilter(SimpleWhereFilter):
+    """A SimpleWhereFilter keeping only the rows where an attribute, usually
+       a time, is between start and stop inclusive. When the table is a
+       time series of that attribute, the rows are found through its time
+       index.
+    """
+
+    def __init__(self, attribute, start, stop):
+        """Construct a TimeRangeFilter for start <= attribute <= stop."""
+        super(TimeRangeFilter, self).__init__(Clause('and',
+            Clause('>=', TableAttribute(attribute), start),
+            Clause('<=', TableAttribute(attribute), stop)))
+
+        self.attribute = attribute
+        self.start = start
+        self.stop = stop
+
+    def process(self, table, identifiers):
+        """Given a TableItem from the DataTree and a list of identifiers
+           to consider from that TableItem's table, returns the filtered
+           list of identifiers with the attribute in the range.
+        """
+        if isinstance(table._table, TimeSeriesTable) \
+            and table._table.time_attribute == self.attribute:
+            rows = table._table.time_rows(self.start, self.stop)
+            if len(identifiers) == len(table._table._data):
+                return rows.tolist()
+
+            valid = np.zeros(len(table._table._data), dtype = bool)
+            valid[identifiers] = True
+            return rows[valid[rows]].tolist()
+        return super(TimeRangeFilter, self).process(table, identifiers)
+
+    def cacheKey(self):
+        """Returns the key identifying rows where start <= attribute <=
+           stop.
+        """
+        return ('range', self.attribute, self.start, self.stop)
@@ -1,6 +1,7 @@
-from PySide.QtCore import Qt, Signal, Slot
+import time
+from PySide.QtCore import Qt, Signal, Slot, QTimer
 from PySide.QtGui import QWidget, QHBoxLayout, QLabel, QSpinBox,\
-    QSpacerItem
+    QSpacerItem, QPushButton
 from ModuleFrame import *
 from ModuleAgent import *
 from GUIUtils import *
@@ -20,6 +21,14 @@ class FilterSpinAgent(ModuleAgent):
 
        The Filter Spin respects the filters above it when coming up with the
        spin range.
+
+       While a value is selected, the results of the modules below for the
+       next prefetch_count values are computed whenever the event loop is
+       idle and kept in the ModuleRequest result cache, so stepping or
+       playing through the values does not wait on re-querying. This is
+       cooperative rather than in the background: prefetching runs on the
+       GUI thread in slices of about prefetch_slice seconds, each at least
+       one request evaluation, between which events are handled.
     """
 
     spinUpdateSignal = Signal(str, list) # field name, values
@@ -34,6 +43,14 @@ class FilterSpinAgent(ModuleAgent):
         self.spin_field = ""
         self.spin_selected = -1
 
+        self.prefetch_count = 4
+        self.prefetch_slice = 0.02
+        self.prefetch_queue = list()
+        self.prefetch_work = None
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setInterval(0)
+        self.prefetch_timer.timeout.connect(self.prefetchNext)
+
 
     def addDataIndices(self, indexList):
         """This function handles an added list of DataTree indices by
@@ -59,6 +76,14 @@ class FilterSpinAgent(ModuleAgent):
             return
         self.spin_values = sorted(list(set(data_lists[0][0])))
         self.spin_field = headers[0][0]
+
+        # Partition the spin field's tables by value now so that stepping
+        # through the values is just a lookup.
+        spin_request = self.requests["spinfield"]
+        for table, attribute_group in spin_request.sortIndicesByTable(
+            spin_request.indices):
+            table._table.partition(self.spin_field)
+
         self.spinUpdateSignal.emit(self.spin_field, self.spin_values)
 
 
@@ -77,14 +102,62 @@ class FilterSpinAgent(ModuleAgent):
             for coupler in self.child_requests:
                 coupler.modifier = None
         else:
-            self.filters.append(SimpleWhereFilter(
-                Clause('=', TableAttribute(self.spin_field),
-                    self.spin_values[self.spin_selected])))
+            self.filters.append(ValueFilter(self.spin_field,
+                self.spin_values[self.spin_selected]))
             for coupler in self.requests.values():
                 coupler.modifier = self.filters[0]
             for coupler in self.child_requests:
                 coupler.modifier = self.filters[0]
 
+        self.schedulePrefetch()
+
+    def schedulePrefetch(self):
+        """Queues the spin values following the selected one, wrapping
+           around at the end, to be prefetched while the event loop is idle.
+        """
+        self.prefetch_queue = list()
+        self.prefetch_work = None
+        if self.spin_selected in range(len(self.spin_values)):
+            count = min(self.prefetch_count, len(self.spin_values) - 1)
+            self.prefetch_queue = [self.spin_values[(self.spin_selected + i)
+                % len(self.spin_values)] for i in range(1, count + 1)]
+
+        if self.prefetch_queue:
+            self.prefetch_timer.start()
+        else:
+            self.prefetch_timer.stop()
+
+    def prefetchEvaluations(self):
+        """Generator evaluating the requests of all modules below this
+           one for each queued spin value in turn, yielding after each
+           evaluation.
+        """
+        while self.prefetch_queue and self.filters:
+            value_filter = ValueFilter(self.spin_field,
+                self.prefetch_queue.pop(0))
+            for child in self.children:
+                for request in child.subtreeRequests():
+                    for evaluation in request.prefetch(self.filters[0],
+                        value_filter):
+                        yield
+
+    @Slot()
+    def prefetchNext(self):
+        """Runs prefetch evaluations for about prefetch_slice seconds, so
+           that drawing the current value and handling input are not held
+           up for long.
+        """
+        if self.prefetch_work is None:
+            self.prefetch_work = self.prefetchEvaluations()
+
+        start = time.time()
+        try:
+            while time.time() - start < self.prefetch_slice:
+                next(self.prefetch_work)
+        except StopIteration:
+            self.prefetch_work = None
+            self.prefetch_timer.stop()
+
 
 @Module("Filter Spin", FilterSpinAgent)
 class FilterSpinFrame(ModuleFrame):
@@ -115,6 +188,23 @@ class FilterSpinFrame(ModuleFrame):
         self.spinner.valueChanged.connect(self.spinnerValueChanged)
         layout.addWidget(self.spinner)
 
+        # Playback steps through the spin values on a timer
+        self.play_timer = QTimer(self)
+        self.play_timer.timeout.connect(self.advanceSpinner)
+
+        self.play_button = QPushButton("Play")
+        self.play_button.setCheckable(True)
+        self.play_button.toggled.connect(self.playToggled)
+        layout.addWidget(self.play_button)
+
+        self.interval_spinner = QSpinBox()
+        self.interval_spinner.setRange(10, 10000)
+        self.interval_spinner.setSingleStep(50)
+        self.interval_spinner.setSuffix(" ms")
+        self.interval_spinner.setValue(200)
+        self.interval_spinner.valueChanged.connect(self.play_timer.setInterval)
+        layout.addWidget(self.interval_spinner)
+
         view.setLayout(layout)
         view.resize(200, 20)
         return view
@@ -151,6 +241,30 @@ class FilterSpinFrame(ModuleFrame):
         """
         self.agent.createSimpleFilter(index)
 
+    @Slot(bool)
+    def playToggled(self, playing):
+        """Slot for starting and stopping playback.
+
+           playing
+               True if playback should run
+        """
+        if playing:
+            self.play_button.setText("Pause")
+            self.play_timer.start(self.interval_spinner.value())
+        else:
+            self.play_button.setText("Play")
+            self.play_timer.stop()
+
+    @Slot()
+    def advanceSpinner(self):
+        """Steps the spin control to the next value, looping back to the
+           first value after the last.
+        """
+        count = len(self.agent.spin_values)
+        if count == 0:
+            return
+        self.spinner.setValue((self.spinner.value() + 1) % count)
+
 
 class FilterSpinBox(QSpinBox):
     """Special spin box shows the value of the given field rather than
@@ -8,6 +8,9 @@ from FilterBox import *
 from FilterSpin import *
 from DataModel import *
 from ModuleAgent import *
+from ProfileDock import ProfileDock
+from Memory import MemoryBudget, formatBytes
+import Profiler
 
 class MainWindow(QMainWindow):
     """This is the actual main Window of boxfish, containing all other
@@ -22,6 +25,8 @@ class MainWindow(QMainWindow):
 
         self.datatree = DataTree()
         self.agent = TopAgent(self, self.datatree)
+        self.datatree.runChangedSignal.connect(self.agent.runChanged)
+        self.datatree.runRemovedSignal.connect(ModuleRequest.forgetRun)
         self.centralWidget = QSplitter(Qt.Horizontal)
 
         # Control Frame
@@ -38,6 +43,20 @@ class MainWindow(QMainWindow):
 
         self.setCentralWidget(self.centralWidget)
 
+        # Profiling statistics, shown at start if profiling is on
+        self.profile_dock = ProfileDock(self)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.profile_dock)
+        self.profile_dock.setVisible(Profiler.enabled)
+
+        # Memory used by the runs, kept under budget every few seconds
+        self.memory = MemoryBudget()
+        self.memory_label = QLabel(self)
+        self.statusBar().addPermanentWidget(self.memory_label)
+        self.memory_timer = QTimer(self)
+        self.memory_timer.setInterval(5000)
+        self.memory_timer.timeout.connect(self.sweepMemory)
+        self.memory_timer.start()
+
         self.createMenus()
         self.setWindowTitle("Boxfish")
         self.resize(1008, 704)
@@ -99,9 +118,30 @@ class MainWindow(QMainWindow):
         self.fileMenu = self.menuBar().addMenu("&File")
         self.fileMenu.addAction(QAction("&Open Run", self,
             shortcut = QKeySequence.Open, triggered=self.runOpen))
+        self.fileMenu.addAction(QAction("&Compare Runs...", self,
+            triggered = self.runCompare))
+        self.fileMenu.addAction(QAction("&Refresh Runs", self,
+            shortcut = QKeySequence.Refresh, triggered = self.runRefresh))
+        self.fileMenu.addAction(QAction("C&lose Selected", self,
+            shortcut = QKeySequence.Close, triggered = self.runClose))
+        self.fileMenu.addAction(QAction("Memory &Budget...", self,
+            triggered = self.memoryBudget))
         self.fileMenu.addAction(QAction("&Quit", self,
             shortcut = "Ctrl+Q", triggered = self.close))
 
+        self.profileMenu = self.menuBar().addMenu("&Profile")
+        self.profileAction = QAction("&Enable Profiling", self,
+            checkable = True, checked = Profiler.enabled,
+            toggled = self.profile_dock.setProfiling)
+        self.profile_dock.enable_box.toggled.connect(
+            self.profileAction.setChecked)
+        self.profileMenu.addAction(self.profileAction)
+        statsAction = self.profile_dock.toggleViewAction()
+        statsAction.setText("Show &Statistics")
+        self.profileMenu.addAction(statsAction)
+        self.profileMenu.addAction(QAction("E&xport Trace...", self,
+            triggered = self.profile_dock.exportTrace))
+
     def runOpen(self):
         """This launches a File dialog for opening Runs."""
         filename, filtr = QFileDialog.getOpenFileName(self)
@@ -116,17 +156,105 @@ class MainWindow(QMainWindow):
             self.datatree.insertRun(run)
         self.data_view.expandAll() #For now
 
+    def runRefresh(self):
+        """Reads any new snapshots of the time series runs."""
+        for row in range(self.datatree.rowCount(QModelIndex())):
+            self.datatree.refreshRun(self.datatree.getItem(
+                self.datatree.index(row, 0, QModelIndex())))
+
+    def runClose(self):
+        """Removes the runs and tables selected in the data tree."""
+        items = list()
+        for index in self.data_view.selectionModel().selectedIndexes():
+            item = self.datatree.getItem(index)
+            if item.typeInfo() in ["RUN", "TABLE"] and item not in items:
+                items.append(item)
+
+        # Tables of runs being removed go with them. Higher rows first so
+        # the rows of the others stay the same.
+        runs = [item for item in items if item.typeInfo() == "RUN"]
+        tables = [item for item in items if item.typeInfo() == "TABLE"
+            and item.getRun() not in runs]
+        for table in sorted(tables, key = lambda table: table.row(),
+            reverse = True):
+            group = table.parent()
+            self.datatree.removeTable(table.row(), 1,
+                self.datatree.createIndex(group.row(), 0, group))
+        for run in sorted(runs, key = lambda run: run.row(), reverse = True):
+            self.datatree.removeRun(run.row())
+        self.sweepMemory()
+
+    def memoryBudget(self):
+        """Asks for the memory budget of the runs in MB."""
+        budget, ok = QInputDialog.getInt(self, "Memory Budget", "Memory "
+            + "the open runs may use before idle tables are evicted (MB):",
+            self.memory.budget / (1024 * 1024), 64, 1024 * 1024)
+        if not ok:
+            return
+
+        self.memory.budget = budget * 1024 * 1024
+        self.sweepMemory()
+
+    @Slot()
+    def sweepMemory(self):
+        """Keeps the runs under the memory budget and shows the memory
+           they use in the status bar, the largest runs first.
+        """
+        usages = self.memory.sweep(self.datatree.runs())
+        usages.sort(key = lambda usage: usage[1] + usage[2], reverse = True)
+        total = sum(data + index for run, data, index in usages)
+
+        text = "Memory: " + formatBytes(total) + " of " \
+            + formatBytes(self.memory.budget)
+        if usages:
+            text += " (" + ", ".join(run.name + " " + formatBytes(data
+                + index) for run, data, index in usages[:3])
+            if len(usages) > 3:
+                text += ", ..."
+            text += ")"
+        self.memory_label.setText(text)
+        self.memory_label.setToolTip("\n".join(run.name + ": "
+            + formatBytes(data) + " data, " + formatBytes(index)
+            + " indexes" for run, data, index in usages))
+
+    def runCompare(self):
+        """Adds a derived run comparing the two runs selected in the data
+           tree. The lower run is compared against the upper one.
+        """
+        runs = list()
+        for index in self.data_view.selectionModel().selectedIndexes():
+            item = self.datatree.getItem(index)
+            if item.typeInfo() == "RUN" and item not in runs:
+                runs.append(item)
+
+        if len(runs) != 2:
+            QMessageBox.information(self, "Compare Runs", "Select the two "
+                + "runs to compare in the data tree.")
+            return
+
+        text, ok = QInputDialog.getText(self, "Compare Runs", "Besides "
+            + "their keys, match rows on the attributes (comma separated):")
+        if not ok:
+            return
+
+        match = [attribute.strip() for attribute in text.split(',')
+            if attribute.strip()]
+        runs.sort(key = lambda run: run.row())
+        self.datatree.insertDerivedRun(runs[0], runs[1], match)
+        self.data_view.expandAll()
+
     #TODO: Read other directories to add from config file and add them
     def findModules(self):
-        """This imports the Python module defined by the mods directory.
-           This allows Boxfish to load whatever Boxfish module and related
-           functionality is found there.
+        """This lists the Boxfish modules already imported and those
+           found in the mods directory. The latter are only imported
+           when first created, see ModuleFrame.instantiate.
         """
-        modules = list()
-
         import mods
 
         modules = ModuleFrame.subclassList()
+        for name in sorted(mods.findModules()):
+            if name not in modules:
+                modules.append(name)
         return modules
 
 class TopAgent(ModuleAgent):
@@ -156,6 +284,15 @@ class TopAgent(ModuleAgent):
         # emit on new child column to start the chain
         self.child_requests[-1].changeSignal.emit(self.child_requests[-1])
 
+    @Slot(object)
+    def runChanged(self, run):
+        """Called when the data of a run has changed, for instance when new
+           snapshots of a time series were read. Every coupler chain is
+           signalled so that the modules request their data again.
+        """
+        for coupler in self.child_requests:
+            coupler.changeSignal.emit(coupler)
+
 
 class ModuleListModel(QStringListModel):
     """Simple datatree for interactions with list of available modules.
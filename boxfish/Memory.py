@@ -0,0 +1,104 @@
+import os
+import weakref
+
+# Boxfish keeps every run it opens in memory, which does not scale to the
+# dozens of runs of a parameter study. The memory budget is checked every
+# so often. While the tables and projections of the open runs use more than
+# the budget, those not used for a while are shrunk, least recently used
+# first: first their derived indexes are dropped, which are made again when
+# needed, and then their records if they can be read again from file.
+# Memory-mapped binary tables count as nothing, the system pages them.
+#
+# The budget in MB defaults to the BOXFISH_MEMORY_BUDGET environment
+# variable and can be changed from the File menu.
+
+default_budget = int(os.environ.get("BOXFISH_MEMORY_BUDGET", 4096)) \
+    * 1024 * 1024
+
+
+def runResources(run):
+    """Returns the list of Tables and Projections of the run."""
+    resources = list()
+    for group in run._children:
+        for child in group._children:
+            if hasattr(child, '_table'):
+                resources.append(child._table)
+            elif hasattr(child, '_projection'):
+                resources.append(child._projection)
+    return resources
+
+
+def formatBytes(count):
+    """Returns the byte count as a short human readable string."""
+    for unit in ['B', 'KB', 'MB']:
+        if count < 1024:
+            return "%.0f %s" % (count, unit)
+        count /= 1024.0
+    return "%.1f GB" % count
+
+
+class MemoryBudget(object):
+    """Tracks the memory used by the open runs and shrinks idle tables and
+       projections when over budget. A resource is idle once it has not
+       been used over idle_sweeps sweeps.
+    """
+
+    def __init__(self, budget = default_budget, idle_sweeps = 2):
+        """Construct a MemoryBudget of the given bytes."""
+        self.budget = budget
+        self.idle_sweeps = idle_sweeps
+        self.sweeps = 0
+
+        # resource -> sweep in which it was last used. Weak so closed runs
+        # are not kept alive.
+        self.last_used = weakref.WeakKeyDictionary()
+
+    def usage(self, runs):
+        """Returns a list of (run, data bytes, index bytes) and the list of
+           distinct resources of the given runs. Resources shared between
+           runs are counted for the first one.
+        """
+        seen = set()
+        usages = list()
+        resources = list()
+        for run in runs:
+            data_bytes, index_bytes = 0, 0
+            for resource in runResources(run):
+                if id(resource) in seen:
+                    continue
+                seen.add(id(resource))
+                resources.append(resource)
+                data, index = resource.memory_usage()
+                data_bytes += data
+                index_bytes += index
+            usages.append((run, data_bytes, index_bytes))
+        return usages, resources
+
+    def sweep(self, runs):
+        """Ages the resources of the given runs and shrinks the idle ones
+           if over budget. Returns the list of (run, data bytes, index
+           bytes) after shrinking.
+        """
+        self.sweeps += 1
+        usages, resources = self.usage(runs)
+        for resource in resources:
+            if resource.take_used() or resource not in self.last_used:
+                self.last_used[resource] = self.sweeps
+
+        total = sum(data + index for run, data, index in usages)
+        if total <= self.budget:
+            return usages
+
+        idle = [resource for resource in resources
+            if self.sweeps - self.last_used[resource] >= self.idle_sweeps]
+        idle.sort(key = lambda resource: self.last_used[resource])
+        for shrink in ['release_indexes', 'evict']:
+            for resource in idle:
+                if total <= self.budget:
+                    break
+                total -= getattr(resource, shrink)()
+
+        # Shrinking uses nothing, only requests do
+        for resource in idle:
+            resource.take_used()
+        return self.usage(runs)[0]
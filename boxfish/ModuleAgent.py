@@ -1,12 +1,16 @@
 from PySide.QtCore import Slot,Signal,QObject,QMimeData,Qt
 from PySide.QtGui import QWidget,QMainWindow,QDockWidget,QToolBar,\
     QLabel,QDrag,QPixmap
+import numpy as np
 from SubDomain import *
 from Table import *
 from Projection import *
 from DataModel import *
 from FilterCoupler import *
 from SceneInfo import *
+from util.LRUCache import LRUCache
+import Aggregation
+import Profiler
 
 class ModuleAgent(QObject):
     """ModuleAgent is the base class for all nodes that form the Boxfish
@@ -165,6 +169,16 @@ class ModuleAgent(QObject):
             row_aggregator, attribute_aggregator)
 
 
+    def subtreeRequests(self):
+        """Returns a list of the ModuleRequests of this Agent and all of
+           its descendants.
+        """
+        requests = self.requests.values()
+        for child in self.children:
+            requests.extend(child.subtreeRequests())
+        return requests
+
+
     def requestGetRows(self, name):
         """Gets all rows of all tables for the attributes associated with
            the indices of the named request. Returns the list of tables,
@@ -178,6 +192,23 @@ class ModuleAgent(QObject):
             raise ValueError("No request named " + name)
         return self.requests[name].getRows()
 
+    def requestGetRowsWindow(self, name, offset, limit, sort_keys = ()):
+        """Gets a window of the rows of all tables for the attributes
+           associated with the indices of the named request. See
+           ModuleRequest.getRowsWindow.
+        """
+        if name not in self.requests:
+            raise ValueError("No request named " + name)
+        return self.requests[name].getRowsWindow(offset, limit, sort_keys)
+
+    def requestGetRowIDs(self, name, sort_keys = ()):
+        """Gets the identifiers of all rows of all tables of the named
+           request in sorted order. See ModuleRequest.getRowIDs.
+        """
+        if name not in self.requests:
+            raise ValueError("No request named " + name)
+        return self.requests[name].getRowIDs(sort_keys)
+
 
     # Signal decorator attached after the class.
     # @Slot(FilterCoupler, ModuleAgent)
@@ -342,6 +373,16 @@ class ModuleAgent(QObject):
            Note, at this time, assumes identity projections between
            runs. This may change.
         """
+        highlights = self.getHighlightArray(table, run)
+        if highlights is None:
+            return
+        return highlights.tolist()
+
+    def getHighlightArray(self, table, run):
+        """As getHighlightIDs, but returns the IDs as an ArraySubDomain.
+           Highlights are kept as arrays, so they are projected and joined
+           without going through lists.
+        """
         if not isinstance(run, RunItem):
             runItem = self.datatree.getRun(run)
             if runItem is None:
@@ -357,22 +398,21 @@ class ModuleAgent(QObject):
             tableItem = table
 
         tableDomain = tableItem._table.subdomain()
-        highlights = SubDomain.instantiate(tableDomain)
-        for hs in self._highlights.highlight_sets:
-            if hs.highlights.subdomain() == tableDomain:
-                highlights.extend(hs.highlights)
-
-        if len(highlights) > 0: # We found a SubDomain match
-            return highlights
+        highlights = [subDomainArray(hs.highlights) for hs
+            in self._highlights.highlight_sets
+            if hs.highlights.subdomain() == tableDomain]
 
         # Since there was no direct way, we need to find and apply projections
-        for hs in self._highlights.highlight_sets:
-            projection = runItem.getProjection(tableDomain,
-                hs.highlights.subdomain())
-            if projection is not None:
-                highlights.extend(projection.project(hs.highlights, tableDomain))
+        if sum(len(ids) for ids in highlights) == 0:
+            for hs in self._highlights.highlight_sets:
+                projection = runItem.getProjection(tableDomain,
+                    hs.highlights.subdomain())
+                if projection is not None:
+                    highlights.append(subDomainArray(projection.project(
+                        hs.highlights, tableDomain)))
 
-        return highlights
+        return SubDomain.instantiate(tableDomain,
+            np.concatenate(highlights + [np.zeros(0, dtype = np.int64)]))
 
     def setHighlights(self, tables, runs, ids):
         """Sets the highlight of this particular agent and announces the change.
@@ -399,8 +439,9 @@ class ModuleAgent(QObject):
                 tableItem = runItem.getTable(table)
             domain = tableItem._table.subdomain()
 
+            # Kept as arrays so projecting them is vectorized
             highlight_sets.append(HighlightSet(
-                SubDomain.instantiate(domain, ids),
+                SubDomain.instantiate(domain, subDomainArray(ids)),
                 runItem))
         self._highlights.highlight_sets = highlight_sets
         self._highlights.announceChange()
@@ -628,18 +669,39 @@ ModuleAgent.sendAllScenes = Slot(ModuleAgent)(ModuleAgent.sendAllScenes)
 
 
 
+def resultCopy(result):
+    """Returns a copy of a cached result for a caller: its lists and
+       tuples are copied and its arrays are read-only views. The values
+       in them are shared.
+    """
+    if isinstance(result, np.ndarray):
+        view = result.view()
+        view.flags.writeable = False
+        return view
+    elif isinstance(result, (list, tuple)):
+        # Results hold lists of values or of more lists, not both
+        if result and isinstance(result[0], (list, tuple, np.ndarray)):
+            copied = [resultCopy(value) for value in result]
+        else:
+            copied = list(result)
+        if isinstance(result, tuple):
+            return tuple(copied)
+        return copied
+    return result
+
+
 class ModuleRequest(QObject):
     """Holds all of the requested information including the desired
        attributes and the operation to perform on them. This is identified
        by the name member of the class. Please keep names unique within a
        single module as they are used to differentiate requests.
     """
-    operator = {
-        'sum' : sum,
-        'mean' : lambda x: sum(x) / float(len(x)),
-        'max' : max,
-        'min' : min,
-    }
+    operator = Aggregation.operator
+
+    # Results of aggregateDomain and getRows shared by all requests. They
+    # are keyed by request, call and the filters applied so that returning
+    # to a filter state that has been seen before is a lookup.
+    result_cache = LRUCache(64)
 
     indicesChangedSignal = Signal(str)
     attributesChangedSignal = Signal(frozenset, QObject)
@@ -659,6 +721,16 @@ class ModuleRequest(QObject):
         self.subdomain = subdomain
         self._indices = indices
 
+        # The modifier chain override is used when evaluating for some
+        # other filter state than the current one.
+        self._modifier_chain = None
+        self._recent_calls = dict()
+
+        # Sorted rows passing the filters, see rowOrder. Kept here rather
+        # than in the result_cache so paging through a big table neither
+        # sorts it again nor pushes other results out.
+        self._row_orders = LRUCache(8)
+
         if self._indices is None:
             self.scene = AttributeScene(frozenset())
         else:
@@ -673,6 +745,8 @@ class ModuleRequest(QObject):
     @indices.setter
     def indices(self, indices):
         self._indices = indices
+        self._recent_calls = dict()
+        self._row_orders.clear()
         if self._indices is None or len(self._indices) == 0:
             self.scene.attributes = set()
         else:
@@ -723,6 +797,94 @@ class ModuleRequest(QObject):
         """Propagate signal that this request's attribute scene has changed."""
         self.attributeSceneChangedSignal.emit(scene)
 
+    @property
+    def modifier_chain(self):
+        """The chain of modifiers applied to the data of this request."""
+        if self._modifier_chain is not None:
+            return self._modifier_chain
+        return self.coupler.modifier_chain
+
+    def cacheKey(self, method, args, chain):
+        """Returns the result_cache key for calling the named method with
+           args through the given modifier chain, or None if some modifier
+           in the chain cannot be cached. Results depend only on the
+           DataTree items requested, so requests of different agents for
+           the same attributes share their cached results.
+        """
+        chain_key = list()
+        for modifier in chain:
+            modifier_key = modifier.cacheKey()
+            if modifier_key is None:
+                return None
+            chain_key.append(modifier_key)
+        # The run version tells results from before its data changed apart
+        items = tuple((item, item.getRun().version) for item
+            in (self.datatree.getItem(index) for index in self._indices or ()))
+        return (items, method, args, tuple(chain_key))
+
+    @classmethod
+    def forgetRun(cls, run):
+        """Drops the cached results computed from items of the given run,
+           so a removed run's data is not kept alive by the cache.
+        """
+        for key in cls.result_cache.keys():
+            if any(item.getRun() is run for item, version in key[0]):
+                del cls.result_cache[key]
+
+    def cachedCall(self, method, *args):
+        """Returns the result of the named evaluation method called with
+           args, looking for it in the result_cache first and storing it
+           there otherwise. The call is remembered for prefetching.
+        """
+        self._recent_calls[method] = args
+        key = self.cacheKey(method, args, self.modifier_chain)
+        if key is None:
+            return self.evaluate(method, *args)
+        if key not in self.result_cache:
+            self.result_cache[key] = self.evaluate(method, *args)
+        # Callers get their own lists so they cannot change the cache
+        return resultCopy(self.result_cache[key])
+
+    def evaluate(self, method, *args):
+        """Calls the named evaluation method with args. When profiling,
+           the call is timed under the requesting module and this
+           request's name.
+        """
+        if not Profiler.enabled:
+            return getattr(self, method)(*args)
+
+        tags = self.profileTags()
+        with Profiler.span(tags['module'] + "." + self.name + ": " + method,
+            "request", prefetch = self._modifier_chain is not None, **tags):
+            return getattr(self, method)(*args)
+
+    def profileTags(self):
+        """Returns the profiling tags naming the requesting module and this
+           request, for the spans of the work done on its behalf.
+        """
+        return { 'module' : type(self.coupler.parent).__name__,
+            'request' : self.name }
+
+    def prefetch(self, old_modifier, new_modifier):
+        """Evaluates the most recent calls made on this request as though
+           new_modifier replaced old_modifier in the modifier chain and
+           stores the results in the result_cache. This is a generator
+           yielding after each evaluation, so the caller can spread the
+           work over several turns of the event loop.
+        """
+        chain = [new_modifier if modifier is old_modifier else modifier
+            for modifier in self.coupler.modifier_chain]
+        for method, args in list(self._recent_calls.items()):
+            key = self.cacheKey(method, args, chain)
+            if key is None or key in self.result_cache:
+                continue
+            self._modifier_chain = chain
+            try:
+                self.result_cache[key] = self.evaluate(method, *args)
+            finally:
+                self._modifier_chain = None
+            yield
+
     def sortIndicesByTable(self, indexList):
         """Creates an iterator of passed indices grouped by the tableItems
            that they come from.
@@ -763,79 +925,22 @@ class ModuleRequest(QObject):
                values
                    List of values that go with the ids.
         """
+        return self.cachedCall("evaluateAggregateDomain", domain_table,
+            row_aggregator, attribute_aggregator)
+
+    def evaluateAggregateDomain(self, domain_table, row_aggregator,
+        attribute_aggregator):
+        """Evaluates aggregateDomain without consulting the result_cache."""
         if not self.preprocess():
             return  list(), list()
 
-        # Get mapping of group_by_attributes to their subdomain ID
-        # THIS IS PAINFULLY SLOW
-
-        # This is where we store intermediate values
-        aggregate_values = dict()
-
         self.attribute_groups = self.sortIndicesByTable(self._indices)
+        attribute_groups = [(table, [self.datatree.getItem(x).name
+            for x in attribute_group])
+            for table, attribute_group in self.attribute_groups]
 
-        for table, attribute_group in self.attribute_groups:
-            # Determine if projection exists, if not, skip
-            projection = domain_table.getRun().getProjection(
-                domain_table._table.subdomain(),
-                table._table.subdomain())
-            if projection is None:
-                continue
-
-            # Apply filters
-            identifiers = table._table.identifiers()
-            for modifier in self.coupler.modifier_chain:
-                identifiers = modifier.process(table, identifiers)
-
-            # Determine the attributes
-            attributes = [self.datatree.getItem(x).name
-                for x in attribute_group]
-            attributes.insert(0, table._table._key) # add key for projections
-
-            # Get the attributes and ids for these identifiers
-            attribute_values = table._table.attributes_by_identifiers(
-                identifiers, attributes, False) # We don't want unique values
-
-            if isinstance(projection, IdentityProjection):
-                # Since the projection is Identity, we don't need to process it
-                for row_values in zip(*attribute_values):
-                    domain_id = row_values[0]
-                    if domain_id in aggregate_values:
-                        aggregate_values[domain_id].extend(row_values[1:])
-                    else:
-                        aggregate_values[domain_id] = list(row_values[1:])
-            else: # Other type of projection
-                # Find relevant projection per id. Each id may appear in 
-                # in multiple rows, so we build this on the unique set of
-                # ids to minimize calculated projections. Then we use 
-                # the built dict to put the rest of the row values in 
-                # the proper place
-                projection_memo = dict() # store projections
-                for table_id in set(attribute_values[0]): # unique ids
-                    domain_ids = projection.project(
-                        SubDomain.instantiate(table._table.subdomain(),
-                            [table_id]),
-                        domain_table._table.subdomain())
-                    projection_memo[table_id] = domain_ids
-
-                # Collect attributes onto proper domain IDs
-                for row_values in zip(*attribute_values):
-                    domain_ids = projection_memo[row_values[0]]
-                    for domain_id in domain_ids:
-                        if domain_id in aggregate_values:
-                            aggregate_values[domain_id].extend(row_values[1:])
-                        else:
-                            aggregate_values[domain_id] = list(row_values[1:])
-
-        # Then get the IDs from the group by table that matter
-        # and associate them with these attributes
-        values = list()
-        ids = list()
-        for domain_id, agge_values in aggregate_values.iteritems():
-            ids.append(domain_id)
-            values.append(self.operator[attribute_aggregator](agge_values))
-
-        return ids, values
+        return Aggregation.aggregateDomain(domain_table, attribute_groups,
+            self.modifier_chain, attribute_aggregator, self.profileTags())
 
 
     def getRows(self):
@@ -867,6 +972,10 @@ class ModuleRequest(QObject):
                values (rows data) for those attributes.
 
         """
+        return self.cachedCall("evaluateGetRows")
+
+    def evaluateGetRows(self):
+        """Evaluates getRows without consulting the result_cache."""
         if not self.preprocess():
             return None, None, None, None, None # Ewww, FIXME
 
@@ -883,9 +992,8 @@ class ModuleRequest(QObject):
                 for x in attribute_group]
             headers.append(attributes[:])
             attributes.insert(0, table['field'])
-            identifiers = table._table.identifiers()
-            for modifier in self.coupler.modifier_chain:
-                identifiers = modifier.process(table, identifiers)
+            identifiers = Aggregation.filterIdentifiers(table,
+                self.modifier_chain, self.profileTags())
             attribute_list = table._table.attributes_by_identifiers(
                 identifiers, attributes, False)
             data_list.append(attribute_list[1:])
@@ -893,6 +1001,112 @@ class ModuleRequest(QObject):
 
         return table_list, run_list, id_list, headers, data_list
 
+    def getRowsWindow(self, offset, limit, sort_keys = ()):
+        """Like getRows, but only returns the rows offset through
+           offset + limit (or the end if limit is None) of each table after
+           sorting. The values are returned as numpy arrays.
+
+           sort_keys
+               A list of (attribute name, ascending) pairs, the most
+               significant first. Each table is sorted by those of the
+               keys it has. Rows with equal keys keep their table order.
+
+           This returns six lists:
+
+           table_list
+               A list of names of all tables represented by the indicies
+               associated with this ModuleRequest
+
+           run_list
+               A list of the names of the runs associated with the tables
+
+           total_list
+               The number of rows of each table passing the filters.
+
+           id_list
+               A list of arrays, one per table, of the identifiers of the
+               rows in the window.
+
+           headers
+               A list of lists, one per table, of the headers (attribute
+               names) of all the columns requested from the table.
+
+           data_list
+               A list of lists, one per table. Each table's list contains
+               an array for each attribute in headers with the values of
+               the rows in the window.
+        """
+        if not self.preprocess():
+            return None, None, None, None, None, None
+
+        data_list = list()
+        headers = list()
+        table_list = list()
+        run_list = list()
+        total_list = list()
+        id_list = list()
+        for table, attribute_group in self.sortIndicesByTable(self._indices):
+            table_list.append(table.name)
+            run_list.append(table.getRun().name)
+            attributes = [self.datatree.getItem(x).name
+                for x in attribute_group]
+            headers.append(attributes[:])
+            attributes.insert(0, table['field'])
+
+            rows = self.rowOrder(table, tuple(sort_keys))
+            total_list.append(len(rows))
+            if limit is None:
+                rows = rows[offset:]
+            else:
+                rows = rows[offset:offset + limit]
+
+            attribute_list = table._table.columns_by_identifiers(rows,
+                attributes)
+            data_list.append(attribute_list[1:])
+            id_list.append(attribute_list[0])
+
+        return table_list, run_list, total_list, id_list, headers, data_list
+
+    def getRowIDs(self, sort_keys = ()):
+        """Returns a list with an array for each table, as ordered by
+           getRows, of the identifiers of all its rows passing the filters,
+           sorted as getRowsWindow would sort them.
+        """
+        if not self.preprocess():
+            return None
+
+        id_list = list()
+        for table, attribute_group in self.sortIndicesByTable(self._indices):
+            rows = self.rowOrder(table, tuple(sort_keys))
+            id_list.append(table._table.columns_by_identifiers(rows,
+                [table['field']])[0])
+
+        return id_list
+
+    def rowOrder(self, table, sort_keys):
+        """Returns evaluateRowOrder for the table and sort_keys, computed
+           once per filter state. Filters are replaced rather than changed
+           when the filter state changes, so the modifiers themselves key
+           the state, whether or not they have a cacheKey.
+        """
+        key = (table, table.getRun().version, sort_keys,
+            tuple(self.modifier_chain))
+        if key not in self._row_orders:
+            self._row_orders[key] = self.evaluateRowOrder(table, sort_keys)
+        return self._row_orders[key]
+
+    def evaluateRowOrder(self, table, sort_keys):
+        """Returns an array of the rows of the given TableItem's table that
+           pass the filters, sorted by those sort_keys the table has.
+        """
+        identifiers = Aggregation.filterIdentifiers(table,
+            self.modifier_chain, self.profileTags())
+
+        sort_keys = [(attribute, ascending)
+            for attribute, ascending in sort_keys
+            if table.hasAttribute(attribute)]
+        return table._table.sort_identifiers(identifiers, sort_keys)
+
     def generalizedGroupBy(self, desired_indices, desired_operator,
         group_operator):
         """Groups some function of desired_indices by some function of
@@ -1085,9 +1299,8 @@ class ModuleRequest(QObject):
             attributes.insert(0, table['field'])
 
             # Apply filters
-            identifiers = table._table.identifiers()
-            for modifier in self.coupler.modifier_chain:
-                identifiers = modifier.process(table, identifiers)
+            identifiers = Aggregation.filterIdentifiers(table,
+                self.modifier_chain, self.profileTags())
 
             # Get values
             attribute_values = table._table.attributes_by_identifiers(
@@ -1132,12 +1345,8 @@ class ModuleRequest(QObject):
                     # ids to minimize calculated projections. Then we use 
                     # the built dict to put the rest of the row values in 
                     # the proper place
-                    projection_memo = dict() # store projections
-                    for table_id in set(*attribute_values[0]):
-                        domain_ids = projection.project(
-                            Subdomain.instantiate(table._table.subdomain(),
-                                [table_id]), domain_table._table.subdomain())
-                        projection_memo[table_id] = domain_ids
+                    projection_memo = Aggregation.projectionMemo(projection,
+                        table, domain_table, attribute_values[0])
 
                     for row_values in zip(*attribute_values):
                         domain_ids = projection_memo[row_values[0]]
@@ -144,6 +144,11 @@ class ModuleFrame(QMainWindow):
                The ModuleFrame that is the logical parent to the one we
                are creating.
         """
+        # Modules in the mods package are imported when first created
+        if cls is ModuleFrame:
+            import mods
+            mods.loadModule(module_name)
+
         if hasattr(cls, 'display_name') and cls.display_name == module_name:
             return cls(parent, parent_frame, title)
         else:
@@ -0,0 +1,97 @@
+from PySide.QtCore import Qt, QTimer, Slot
+from PySide.QtGui import QDockWidget, QWidget, QVBoxLayout, QHBoxLayout, \
+    QTableWidget, QTableWidgetItem, QPushButton, QCheckBox, QFileDialog, \
+    QHeaderView, QAbstractItemView
+import Profiler
+
+class ProfileDock(QDockWidget):
+    """Shows the Profiler statistics while Boxfish runs: the calls and
+       times of each instrumented request, filter, projection, display
+       list and paint. The table is refreshed every second while shown.
+    """
+
+    headers = ["Name", "Category", "Calls", "Total ms", "Mean ms", "Max ms"]
+
+    def __init__(self, parent = None):
+        """Construct the ProfileDock."""
+        super(ProfileDock, self).__init__("Profile", parent)
+
+        widget = QWidget(self)
+        layout = QVBoxLayout(widget)
+
+        self.table = QTableWidget(0, len(self.headers), widget)
+        self.table.setHorizontalHeaderLabels(self.headers)
+        self.table.horizontalHeader().setResizeMode(0, QHeaderView.Stretch)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        buttons = QHBoxLayout()
+        self.enable_box = QCheckBox("Profiling", widget)
+        self.enable_box.setChecked(Profiler.enabled)
+        self.enable_box.toggled.connect(self.setProfiling)
+        buttons.addWidget(self.enable_box)
+        buttons.addStretch(1)
+        reset_button = QPushButton("Reset", widget)
+        reset_button.clicked.connect(self.reset)
+        buttons.addWidget(reset_button)
+        export_button = QPushButton("Export Trace...", widget)
+        export_button.clicked.connect(self.exportTrace)
+        buttons.addWidget(export_button)
+        layout.addLayout(buttons)
+
+        widget.setLayout(layout)
+        self.setWidget(widget)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.visibilityChange)
+
+    @Slot(bool)
+    def setProfiling(self, on):
+        """Turns profiling on or off."""
+        Profiler.enable(on)
+        if self.enable_box.isChecked() != on:
+            self.enable_box.setChecked(on)
+        self.refresh()
+
+    @Slot(bool)
+    def visibilityChange(self, visible):
+        """Only refreshes while the dock can be seen."""
+        if visible:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    @Slot()
+    def refresh(self):
+        """Fills the table with the current statistics."""
+        rows = Profiler.statistics()
+        self.table.setRowCount(len(rows))
+        for row, (name, category, count, total, mean, longest) \
+            in enumerate(rows):
+            cells = [name, category, str(count), "%.2f" % (1000 * total),
+                "%.2f" % (1000 * mean), "%.2f" % (1000 * longest)]
+            for column, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if column > 1:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+    @Slot()
+    def reset(self):
+        """Discards the statistics and trace recorded so far."""
+        Profiler.reset()
+        self.refresh()
+
+    @Slot()
+    def exportTrace(self):
+        """Saves the recorded events as a Chrome trace JSON file."""
+        filename, filtr = QFileDialog.getSaveFileName(self, "Export Trace",
+            "boxfish_trace.json", "Chrome trace (*.json)")
+        if filename == u'':
+            return
+
+        Profiler.exportChromeTrace(filename)
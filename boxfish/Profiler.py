@@ -0,0 +1,150 @@
+import os
+import time
+import json
+import atexit
+import threading
+from functools import wraps
+from collections import deque
+
+# Opt-in timing of the data pipeline and the views. Instrumented code opens
+# a span around the work it does; every span is kept as a trace event and
+# summed into per-name statistics. Profiling is off unless the
+# BOXFISH_PROFILE environment variable is set or it is turned on from the
+# Profile menu. When off, opening a span returns a shared object that does
+# nothing, so instrumentation costs one function call.
+#
+# If BOXFISH_PROFILE names a .json file, the Chrome trace is written there
+# when Boxfish exits. Load it in chrome://tracing or Perfetto.
+
+enabled = bool(os.environ.get("BOXFISH_PROFILE"))
+
+# Only the most recent events are kept for the trace
+max_events = 200000
+events = deque(maxlen = max_events)
+
+# name -> [category, count, total seconds, max seconds]
+stats = dict()
+
+# Trace timestamps are relative to this
+origin = time.time()
+
+
+def enable(on = True):
+    """Turns profiling on or off."""
+    global enabled
+    enabled = on
+
+
+def reset():
+    """Discards all events and statistics recorded so far."""
+    events.clear()
+    stats.clear()
+
+
+def record(name, category, start, duration, tags = None):
+    """Records a span of the given duration in seconds that started at the
+       given time.time().
+    """
+    events.append((name, category, start, duration,
+        threading.current_thread().ident, tags))
+    entry = stats.get(name)
+    if entry is None:
+        stats[name] = [category, 1, duration, duration]
+    else:
+        entry[1] += 1
+        entry[2] += duration
+        entry[3] = max(entry[3], duration)
+
+
+class Span(object):
+    """Times the block of a with statement and records it."""
+
+    def __init__(self, name, category, tags = None):
+        self.name = name
+        self.category = category
+        self.tags = tags
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.name, self.category, self.start,
+            time.time() - self.start, self.tags)
+        return False
+
+
+class NullSpan(object):
+    """Stands in for Span when profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+null_span = NullSpan()
+
+
+def span(name, category, **tags):
+    """Returns a context manager timing its block under the given name
+       and category, with the keyword arguments as tags shown in the
+       trace. Does nothing when profiling is off.
+    """
+    if not enabled:
+        return null_span
+    return Span(name, category, tags or None)
+
+
+def traced(category):
+    """Decorator timing each call of a method in the given category. The
+       span is named after the class of the object and the method, so
+       subclasses are told apart.
+    """
+    def traced_inner(method):
+        @wraps(method)
+        def traced_method(self, *args, **kwargs):
+            if not enabled:
+                return method(self, *args, **kwargs)
+            with Span(type(self).__name__ + "." + method.__name__, category):
+                return method(self, *args, **kwargs)
+        return traced_method
+    return traced_inner
+
+
+def statistics():
+    """Returns a list of (name, category, count, total, mean, max) tuples
+       with times in seconds, the largest total first.
+    """
+    rows = [(name, category, count, total, total / count, longest)
+        for name, (category, count, total, longest) in stats.items()]
+    return sorted(rows, key = lambda row: row[3], reverse = True)
+
+
+def chromeTrace():
+    """Returns the recorded events in the Chrome trace event format."""
+    pid = os.getpid()
+    trace_events = list()
+    for name, category, start, duration, thread, tags in list(events):
+        event = { 'name' : name, 'cat' : category, 'ph' : 'X',
+            'ts' : (start - origin) * 1e6, 'dur' : duration * 1e6,
+            'pid' : pid, 'tid' : thread }
+        if tags:
+            event['args'] = tags
+        trace_events.append(event)
+    return { 'traceEvents' : trace_events, 'displayTimeUnit' : 'ms' }
+
+
+def exportChromeTrace(filename):
+    """Writes the recorded events to filename as a Chrome trace."""
+    with open(filename, 'w') as trace_file:
+        json.dump(chromeTrace(), trace_file)
+
+
+def exportAtExit():
+    """Writes the trace to the file named by BOXFISH_PROFILE, if any."""
+    filename = os.environ.get("BOXFISH_PROFILE", "")
+    if filename.endswith(".json") and events:
+        exportChromeTrace(filename)
+
+atexit.register(exportAtExit)
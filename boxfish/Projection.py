@@ -1,5 +1,9 @@
+import sys
+import itertools
+import numpy as np
 from SubDomain import *
 from Query import *
+import Profiler
 
 def InputFileKey(input_file_key, enabled = True):
     """Decorator associates the key from a Boxfish meta file with a type
@@ -14,6 +18,55 @@ def InputFileKey(input_file_key, enabled = True):
     return input_file_key_inner
 
 
+def dictBytes(index):
+    """Estimates the bytes used by a dict of lists or tuples."""
+    total = sys.getsizeof(index)
+    for key, value in index.iteritems():
+        total += sys.getsizeof(key) + sys.getsizeof(value)
+    return total
+
+
+def csrIndex(index):
+    """Packs a dict of lists of IDs into arrays (keys, bounds, values):
+       the sorted keys, and values[bounds[i]:bounds[i + 1]] the list of
+       keys[i].
+    """
+    keys = sorted(index)
+    bounds = np.zeros(len(keys) + 1, dtype = np.int64)
+    np.cumsum([len(index[key]) for key in keys], out = bounds[1:])
+    values = np.fromiter(itertools.chain.from_iterable(index[key]
+        for key in keys), dtype = np.int64, count = bounds[-1])
+    return np.array(keys, dtype = np.int64), bounds, values
+
+def gatherRanges(keys, bounds, ids):
+    """Returns the concatenated ranges bounds[i] to bounds[i + 1] of the
+       i with keys[i] in ids, where keys is sorted. IDs not in keys are
+       skipped.
+    """
+    if len(keys) == 0:
+        return np.zeros(0, dtype = np.int64)
+    index = np.searchsorted(keys, ids).clip(0, len(keys) - 1)
+    index = index[keys[index] == ids]
+
+    starts = bounds[index]
+    lengths = bounds[index + 1] - starts
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1]
+        if len(ends) else 0)
+
+def pairDict(ids, sources, targets):
+    """Returns a dict from each of ids to the sorted list of distinct
+       targets paired with it, where sources and targets are arrays of the
+       pairs.
+    """
+    projection_dict = dict((domain_id, list()) for domain_id in ids)
+    if len(sources):
+        pairs = np.unique(np.column_stack((sources, targets)), axis = 0)
+        for source, target in pairs.tolist():
+            projection_dict[source].append(target)
+    return projection_dict
+
+
 class Projection(object):
     """Projections relate IDs of one domain to IDs of another."""
 
@@ -25,7 +78,7 @@ class Projection(object):
 
         if isinstance(source,str):
             self.source = source
-        elif isinstance(source,SubDomain):
+        elif isinstance(source,(SubDomain, ArraySubDomain)):
             self.source = source.subdomain()
         else:
             raise ValueError("A projection can only be initialized with "
@@ -33,7 +86,7 @@ class Projection(object):
 
         if isinstance(destination,str):
             self.destination = destination
-        elif isinstance(destination,SubDomain):
+        elif isinstance(destination,(SubDomain, ArraySubDomain)):
             self.destination = destination.subdomain()
         else:
             raise ValueError("A projection can only be initialized with "
@@ -55,18 +108,18 @@ class Projection(object):
         """
         raise NotImplementedError("Cannot perform projection.")
 
-#  def make_projection_dict(self, subdomain, destination):
-#    """Makes a dict from each domain_id in the subdomain.
-#       Override to make this less slow.
-#    """
-#
-#    projection_dict = dict()
-#    for domain_id in subdomain:
-#      projection_dict[domain_id] = self.project(
-#          SubDomain.instantiate(subdomain.subdomain(), [domain_id]),
-#          destination)
-#
-#    return projection_dict
+    def make_projection_dict(self, subdomain, destination):
+        """Makes a dict from each domain_id in the subdomain to the IDs it
+           projects to in the given destination. Override to make this
+           less slow.
+        """
+        projection_dict = dict()
+        for domain_id in subdomain:
+            projection_dict[domain_id] = self.project(
+                SubDomain.instantiate(subdomain.subdomain(), [domain_id]),
+                destination)
+
+        return projection_dict
 
     def source_ids(self):
         """Returns all of the ids associated with the source subdomain.
@@ -76,6 +129,29 @@ class Projection(object):
         """
         return None
 
+    def memory_usage(self):
+        """Returns the bytes used by the data and by the derived indexes
+           of this projection.
+        """
+        return 0, 0
+
+    def take_used(self):
+        """Returns whether the projection has been used since the last
+           call.
+        """
+        return False
+
+    def release_indexes(self):
+        """Drops the derived indexes, which are made again when needed.
+           Returns the bytes released.
+        """
+        return 0
+
+    def evict(self):
+        """Drops data that can be read again. Returns the bytes released.
+        """
+        return 0
+
     def destination_ids(self):
         """Returns all of the ids associated with the destination subdomain.
            If unable to calculate these ids, return None.
@@ -112,14 +188,21 @@ class IdentityProjection(Projection):
         """Construct an IdentityProjection."""
         super(IdentityProjection, self).__init__(source,destination,**kwargs)
 
+    @Profiler.traced("projection")
     def project(self,subdomain,destination):
         """Projects the subdomain onto the destination by returning the list
            of IDs found in subdomain packaged in a SubDomain of type
            destination.
         """
+        if isinstance(subdomain, ArraySubDomain):
+            return SubDomain.instantiate(destination, subdomain.ids)
         result = SubDomain.instantiate(destination,subdomain)
         return result
 
+    def make_projection_dict(self, subdomain, destination):
+        """Makes a dict from each domain_id in the subdomain to itself."""
+        return dict((domain_id, [domain_id]) for domain_id in subdomain)
+
 
 @InputFileKey("composition")
 class CompositionProjection(Projection):
@@ -149,6 +232,7 @@ class CompositionProjection(Projection):
             self._projection_list = kwargs["projection_list"]
 
 
+    @Profiler.traced("projection")
     def project(self, subdomain, destination):
         """Convert the IDs in subdomain into a SubDomain of type destination.
         """
@@ -203,22 +287,35 @@ class TableProjection(Projection):
             self._source_key = kwargs["source_key"]
             self._destination_key = kwargs["destination_key"]
 
-            self._source_dict = dict()
-            self._destination_dict = dict()
-            key_lists = self._table.attributes_by_identifiers(
-                self._table.identifiers(),
-                [self._source_key, self._destination_key],
-                unique = False)
-            for source, destination in zip(*key_lists):
-                if source in self._source_dict:
-                    self._source_dict[source].append(destination)
-                else:
-                    self._source_dict[source] = [destination]
+            # The dicts are made when first needed, see make_dicts
+            self._source_dict = None
+            self._destination_dict = None
+            self._index_bytes = 0
+            self._used = False
 
-                if destination in self._destination_dict:
-                    self._destination_dict[destination].append(source)
-                else:
-                    self._destination_dict[destination] = [source]
+    def make_dicts(self):
+        """Creates the dicts mapping each source ID to its list of
+           destination IDs and back, from the table.
+        """
+        self._source_dict = dict()
+        self._destination_dict = dict()
+        key_lists = self._table.attributes_by_identifiers(
+            self._table.identifiers(),
+            [self._source_key, self._destination_key],
+            unique = False)
+        for source, destination in zip(*key_lists):
+            if source in self._source_dict:
+                self._source_dict[source].append(destination)
+            else:
+                self._source_dict[source] = [destination]
+
+            if destination in self._destination_dict:
+                self._destination_dict[destination].append(source)
+            else:
+                self._destination_dict[destination] = [source]
+
+        self._index_bytes = dictBytes(self._source_dict) \
+            + dictBytes(self._destination_dict)
 
 
   #def make_projection_dict(self, subdomain, destination):
@@ -232,9 +329,16 @@ class TableProjection(Projection):
   #            if key in subdomain }
 
 
+    @Profiler.traced("projection")
     def project(self, subdomain, destination):
         """Convert the IDs in subdomain into a SubDomain of type destination.
         """
+        self._used = True
+        if isinstance(subdomain, ArraySubDomain):
+            return self.project_array(subdomain, destination)
+        if self._source_dict is None:
+            self.make_dicts()
+
         keys = list()
         if destination == self.destination:
             for domain_id in subdomain:
@@ -245,14 +349,79 @@ class TableProjection(Projection):
 
         return SubDomain.instantiate(destination, list(set(keys)))
 
+    def project_array(self, subdomain, destination):
+        """As project for an ArraySubDomain. The rows of its IDs are
+           found in the table's partition of the key, without the dicts.
+        """
+        if destination == self.destination:
+            from_key, to_key = self._source_key, self._destination_key
+        else:
+            from_key, to_key = self._destination_key, self._source_key
+
+        values, order, bounds = self._table.partition(from_key)
+        rows = order[gatherRanges(values, bounds, subdomain.ids)]
+        return SubDomain.instantiate(destination,
+            np.unique(self._table._data[to_key][rows]).astype(np.int64))
+
+    def make_projection_dict(self, subdomain, destination):
+        """Makes a dict from each domain_id in the subdomain to the IDs it
+           projects to, finding the rows of all of them in the table's
+           partition of the key at once.
+        """
+        self._used = True
+        if destination == self.destination:
+            from_key, to_key = self._source_key, self._destination_key
+        else:
+            from_key, to_key = self._destination_key, self._source_key
+
+        ids = subDomainArray(subdomain)
+        values, order, bounds = self._table.partition(from_key)
+        rows = order[gatherRanges(values, bounds, ids)]
+        return pairDict(ids.tolist(), self._table._data[from_key][rows],
+            self._table._data[to_key][rows])
+
     def source_ids(self):
         """Return a list of all known IDs from the source SubDomain."""
+        if self._source_dict is None:
+            self.make_dicts()
         return [x for x in self._source_dict]
 
     def destination_ids(self):
         """Return a list of all known IDs from the destination Subdomain."""
+        if self._destination_dict is None:
+            self.make_dicts()
         return [x for x in self._destination_dict]
 
+    def memory_usage(self):
+        """Returns the bytes used by the table and by the table indexes and
+           dicts.
+        """
+        data_bytes, index_bytes = self._table.memory_usage()
+        if self._source_dict is not None:
+            index_bytes += self._index_bytes
+        return data_bytes, index_bytes
+
+    def take_used(self):
+        """Returns whether the projection or its table has been used since
+           the last call.
+        """
+        used = self._used
+        self._used = False
+        return self._table.take_used() or used
+
+    def release_indexes(self):
+        """Drops the dicts and the table indexes."""
+        released = self._table.release_indexes()
+        if self._source_dict is not None:
+            released += self._index_bytes
+        self._source_dict = None
+        self._destination_dict = None
+        return released
+
+    def evict(self):
+        """Drops the table records if they can be read again."""
+        return self._table.evict()
+
 
 
 @InputFileKey("node link")
@@ -334,61 +503,76 @@ class NodeLinkProjection(Projection):
                 for coord in self.coords]
 
 
-            # Nodes and Links are a join on coordinates. We're going to
-            # make coordinate dictionaries so we can use them later
-            # to build node-link dictionaries based on coords and policies
-            self.node_coord_dict = dict()
-            self.coord_node_dict = dict()
-            self.link_coord_dict_source = dict()
-            self.link_coord_dict_destination = dict()
-            self.coord_link_dict_source = dict()
-            self.coord_link_dict_destination = dict()
-            # We can use a group by here because we know there is one
-            # node per coordinate
-            node_coords, node_ids \
-                = self.source_table._table.group_attributes_by_attributes(
-                self.source_table._table.identifiers(), self.coords,
-                [self.source_table['field']], 'mean')
-            for node_coord, node_id in zip(node_coords, node_ids[0]):
-                self.node_coord_dict[int(node_id)] = node_coord
-                self.coord_node_dict[node_coord] = int(node_id)
-
-            # For links, we also do a group-by, but on both the source
-            # and destination coordinates
-            coord_len = len(self.coords)
-            source_index = coord_len
-            destination_index = source_index + coord_len
-            #link_coord_names = [self.destination_table['field']]
-            link_coord_names = list()
-            link_coord_names.extend(self.source_coords)
-            link_coord_names.extend(self.destination_coords)
-            link_coords, link_ids \
-                = self.destination_table._table.group_attributes_by_attributes(
-                self.destination_table._table.identifiers(),
-                link_coord_names, [self.destination_table['field']], 'mean')
-            for link_id, link_tuple in zip(link_ids[0], link_coords):
-                link_id = int(link_id)
-                source = link_tuple[0:source_index]
-                destination = link_tuple[source_index:destination_index]
-                if link_id not in self.link_coord_dict_source:
-                    self.link_coord_dict_source[link_id] = source
-                if link_id not in self.link_coord_dict_destination:
-                    self.link_coord_dict_destination[link_id] = destination
-
-                if source not in self.coord_link_dict_source:
-                    self.coord_link_dict_source[source] = [link_id]
-                elif link_id not in self.coord_link_dict_source[source]:
-                    self.coord_link_dict_source[source].append(link_id)
-                if destination not in self.coord_link_dict_destination:
-                    self.coord_link_dict_destination[destination] = [link_id]
-                elif link_id \
-                    not in self.coord_link_dict_destination[destination]:
-                    self.coord_link_dict_destination[destination].append(
-                        link_id)
+            # The dicts are made when first needed, see build, and packed
+            # into arrays for ArraySubDomains
+            self.node_dict = None
+            self.link_dict = None
+            self.node_arrays = None
+            self.link_arrays = None
+            self._index_bytes = 0
+            self._used = False
 
 
-            self.make_dicts()
+    def build(self):
+        """Creates the coordinate dicts and then the projection dicts."""
+        self.make_coord_dicts()
+        self.make_dicts()
 
+    def make_coord_dicts(self):
+        """Creates the dicts from node and link IDs to coordinates and
+           back from the coordinate tables.
+        """
+        # Nodes and Links are a join on coordinates. We're going to
+        # make coordinate dictionaries so we can use them later
+        # to build node-link dictionaries based on coords and policies
+        self.node_coord_dict = dict()
+        self.coord_node_dict = dict()
+        self.link_coord_dict_source = dict()
+        self.link_coord_dict_destination = dict()
+        self.coord_link_dict_source = dict()
+        self.coord_link_dict_destination = dict()
+        # We can use a group by here because we know there is one
+        # node per coordinate
+        node_coords, node_ids \
+            = self.source_table._table.group_attributes_by_attributes(
+            self.source_table._table.identifiers(), self.coords,
+            [self.source_table['field']], 'mean')
+        for node_coord, node_id in zip(node_coords, node_ids[0]):
+            self.node_coord_dict[int(node_id)] = node_coord
+            self.coord_node_dict[node_coord] = int(node_id)
+
+        # For links, we also do a group-by, but on both the source
+        # and destination coordinates
+        coord_len = len(self.coords)
+        source_index = coord_len
+        destination_index = source_index + coord_len
+        #link_coord_names = [self.destination_table['field']]
+        link_coord_names = list()
+        link_coord_names.extend(self.source_coords)
+        link_coord_names.extend(self.destination_coords)
+        link_coords, link_ids \
+            = self.destination_table._table.group_attributes_by_attributes(
+            self.destination_table._table.identifiers(),
+            link_coord_names, [self.destination_table['field']], 'mean')
+        for link_id, link_tuple in zip(link_ids[0], link_coords):
+            link_id = int(link_id)
+            source = link_tuple[0:source_index]
+            destination = link_tuple[source_index:destination_index]
+            if link_id not in self.link_coord_dict_source:
+                self.link_coord_dict_source[link_id] = source
+            if link_id not in self.link_coord_dict_destination:
+                self.link_coord_dict_destination[link_id] = destination
+
+            if source not in self.coord_link_dict_source:
+                self.coord_link_dict_source[source] = [link_id]
+            elif link_id not in self.coord_link_dict_source[source]:
+                self.coord_link_dict_source[source].append(link_id)
+            if destination not in self.coord_link_dict_destination:
+                self.coord_link_dict_destination[destination] = [link_id]
+            elif link_id \
+                not in self.coord_link_dict_destination[destination]:
+                self.coord_link_dict_destination[destination].append(
+                    link_id)
 
     def make_dicts(self):
         """Creates dicts that map node IDs to lists of link IDs and vice
@@ -397,6 +581,8 @@ class NodeLinkProjection(Projection):
         """
         self.node_dict = dict()
         self.link_dict = dict()
+        self.node_arrays = None
+        self.link_arrays = None
         for node_id in self.node_coord_dict:
             link_list = list()
             if self.node_policy == 'Source' or self.node_policy == 'Both':
@@ -414,6 +600,12 @@ class NodeLinkProjection(Projection):
 
             self.node_dict[node_id] = link_list
 
+        self._index_bytes = sum(dictBytes(index) for index in
+            [self.node_coord_dict, self.coord_node_dict,
+            self.link_coord_dict_source, self.link_coord_dict_destination,
+            self.coord_link_dict_source, self.coord_link_dict_destination,
+            self.node_dict, self.link_dict])
+
 
 #    def make_projection_dict(self, subdomain, destination):
 #        if destination == self.destination:
@@ -424,9 +616,16 @@ class NodeLinkProjection(Projection):
 #                if key in subdomain }
 
 
+    @Profiler.traced("projection")
     def project(self, subdomain, destination):
         """Convert the IDs in subdomain into a SubDomain of type destination.
         """
+        self._used = True
+        if self.node_dict is None:
+            self.build()
+        if isinstance(subdomain, ArraySubDomain):
+            return self.project_array(subdomain, destination)
+
         keys = list()
         if destination == self.destination: # Nodes -> Links
             for node_id in subdomain:
@@ -438,6 +637,45 @@ class NodeLinkProjection(Projection):
         return SubDomain.instantiate(destination, list(set(keys)))
 
 
+    def index_arrays(self, destination):
+        """Returns the dict projecting onto the given destination packed
+           into arrays, see csrIndex.
+        """
+        if self.node_arrays is None:
+            self.node_arrays = csrIndex(self.node_dict)
+            self.link_arrays = csrIndex(self.link_dict)
+            self._index_bytes += sum(array.nbytes for array
+                in self.node_arrays + self.link_arrays)
+
+        if destination == self.destination: # Nodes -> Links
+            return self.node_arrays
+        return self.link_arrays
+
+    def project_array(self, subdomain, destination):
+        """As project for an ArraySubDomain, using the dicts packed into
+           arrays.
+        """
+        keys, bounds, values = self.index_arrays(destination)
+        return SubDomain.instantiate(destination, np.unique(
+            values[gatherRanges(keys, bounds, subdomain.ids)]))
+
+    def make_projection_dict(self, subdomain, destination):
+        """Makes a dict from each domain_id in the subdomain to the IDs it
+           projects to, gathering all of them from the packed arrays at
+           once.
+        """
+        self._used = True
+        if self.node_dict is None:
+            self.build()
+
+        ids = subDomainArray(subdomain)
+        keys, bounds, values = self.index_arrays(destination)
+        positions = gatherRanges(keys, bounds, ids)
+        # The key whose range holds each position
+        owners = np.searchsorted(bounds, positions, side = 'right') - 1
+        return pairDict(ids.tolist(), keys[owners], values[positions])
+
+
     def update_policies(self, node_policy, link_policy):
         """Changes the node and link policies to the ones given and re-makes
            the projection dicts accordingly.
@@ -445,12 +683,46 @@ class NodeLinkProjection(Projection):
         self.node_policy = node_policy
         self.link_policy = link_policy
 
-        self.makedicts()
+        if self.node_dict is not None:
+            self.make_dicts()
 
     def source_ids(self):
         """Return a list of all known IDs from the source SubDomain."""
+        if self.node_dict is None:
+            self.build()
         return [x for x in self.node_dict]
 
     def destination_ids(self):
         """Return a list of all known IDs from the destination Subdomain."""
+        if self.link_dict is None:
+            self.build()
         return [x for x in self.link_dict]
+
+    def memory_usage(self):
+        """Returns the bytes used by the dicts. The coordinate tables are
+           accounted for with their own table items.
+        """
+        if self.node_dict is None:
+            return 0, 0
+        return 0, self._index_bytes
+
+    def take_used(self):
+        """Returns whether the projection has been used since the last
+           call.
+        """
+        used = self._used
+        self._used = False
+        return used
+
+    def release_indexes(self):
+        """Drops all the dicts, which are made again when needed."""
+        released = self.memory_usage()[1]
+        self.node_dict = None
+        self.link_dict = None
+        self.node_arrays = None
+        self.link_arrays = None
+        for name in ['node_coord_dict', 'coord_node_dict',
+            'link_coord_dict_source', 'link_coord_dict_destination',
+            'coord_link_dict_source', 'coord_link_dict_destination']:
+            setattr(self, name, None)
+        return released
@@ -1,8 +1,15 @@
+import numpy as np
+
 class SubDomain(list):
     """A SubDomain is a list of identifiers of representatives of some
        domain.
     """
 
+    # Upper case subdomain name -> SubDomain class without subclasses.
+    # Built when first needed and again when a name is not found, in case
+    # SubDomains were defined since.
+    registry = dict()
+
     def __init__(self,copy = list()):
        super(SubDomain, self).__init__(copy)
 
@@ -38,19 +45,44 @@ class SubDomain(list):
         return ret
 
     @classmethod
-    def instantiate(cls,subdomain,data=list()):
-
-        if len(cls.__subclasses__()) == 0:
-            if cls.subdomain().upper() == subdomain.upper():
-                return cls(data)
+    def registerSubclasses(cls):
+        """Fills the registry with every SubDomain class without
+           subclasses.
+        """
+        stack = SubDomain.__subclasses__()
+        while stack:
+            domain_type = stack.pop()
+            subclasses = domain_type.__subclasses__()
+            if subclasses:
+                stack.extend(subclasses)
             else:
-                return None
-        else:
-            for s in cls.__subclasses__():
-                result = s.instantiate(subdomain,data)
-                if result != None:
-                    return result
+                SubDomain.registry[domain_type.subdomain().upper()] \
+                    = domain_type
+
+    @classmethod
+    def findSubdomain(cls, subdomain):
+        """Returns the SubDomain class of the given name in any case, or
+           None if there is none.
+        """
+        key = subdomain.upper()
+        if key not in SubDomain.registry:
+            SubDomain.registerSubclasses()
+        return SubDomain.registry.get(key)
+
+    @classmethod
+    def instantiate(cls,subdomain,data=list()):
+        """Returns a SubDomain of the type named subdomain (in any case)
+           holding data, or None if there is no such type below cls. If
+           data is a numpy array, the result is an ArraySubDomain wrapping
+           it rather than a list.
+        """
+        domain_type = SubDomain.findSubdomain(subdomain)
+        if domain_type is None or not issubclass(domain_type, cls):
             return None
+        if isinstance(data, np.ndarray):
+            return ArraySubDomain(domain_type, data)
+        return domain_type(data)
+
 
 class HWSubDomain(SubDomain):
 
@@ -138,6 +170,75 @@ class Patches(AppSubDomain):
         return "patch"
 
 
+class ArraySubDomain(object):
+    """A SubDomain backed by a numpy integer array rather than a list.
+
+       It stands in for a SubDomain of the given type: it iterates, indexes
+       and tests membership like the list would, and subdomain(), domain()
+       and typename() are those of the type. Projections and highlights
+       given one work on the array directly and return ArraySubDomains.
+       The array is a read-only view, so wrapping does not copy and the
+       ids cannot be changed from here.
+    """
+
+    def __init__(self, domain_type, ids = ()):
+        """Construct an ArraySubDomain of the given SubDomain class."""
+        super(ArraySubDomain, self).__init__()
+        self.domain_type = domain_type
+        self.ids = np.asarray(ids).view()
+        if len(self.ids) == 0:
+            self.ids = self.ids.astype(np.int64)
+        self.ids.flags.writeable = False
+
+    def subdomain(self):
+        return self.domain_type.subdomain()
+
+    def typename(self):
+        return self.domain_type.typename()
+
+    def domain(self):
+        return self.domain_type.domain()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        # Python ints, as a SubDomain list would hold
+        return iter(self.ids.tolist())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ArraySubDomain(self.domain_type, self.ids[index])
+        return self.ids[index].item()
+
+    def __getslice__(self, i, j):
+        return self[slice(i, j)]
+
+    def __contains__(self, domain_id):
+        return bool(np.any(self.ids == domain_id))
+
+    def __array__(self, dtype = None):
+        if dtype is None:
+            return self.ids
+        return self.ids.astype(dtype)
+
+    def __repr__(self):
+        return self.domain_type.__name__ + "(" + repr(self.ids) + ")"
+
+    def tolist(self):
+        """Returns the list-backed SubDomain of the same type and ids."""
+        return self.domain_type(self.ids.tolist())
+
+
+def subDomainArray(subdomain):
+    """Returns the ids of the SubDomain or ArraySubDomain as a numpy
+       array, without copying in the latter case.
+    """
+    if isinstance(subdomain, ArraySubDomain):
+        return subdomain.ids
+    return np.array(subdomain, dtype = np.int64)
+
+
 if __name__ == '__main__':
 
     print "Alive"
@@ -37,6 +37,35 @@ class Table(object):
 
     super(Table, self).__init__()
 
+    # attribute -> (values, order, bounds), see partition()
+    self._partitions = dict()
+
+    # The records, see _data. Set when the records are used, for the
+    # memory budget to tell which tables are idle.
+    self._records = None
+    self._loader = None
+    self._used = False
+
+  @property
+  def _data(self):
+    """The numpy records of this table. If they were evicted to save
+       memory they are read again by the loader.
+    """
+    self._used = True
+    if self._records is None and self._loader is not None:
+      self._records = self._loader()
+    return self._records
+
+  @_data.setter
+  def _data(self, data):
+    self._records = data
+
+  def set_loader(self, loader):
+    """Set the function, taking no arguments, that reads the records of
+       this table again. Only tables with a loader can be evicted.
+    """
+    self._loader = loader
+
 
   def fromYAML(self,domain_type,primary_key, filename):
     """Load a table from a yaml file. The domain type provides the context for
@@ -129,9 +158,7 @@ class Table(object):
     """Return a list of attributes of this table.
     """
 
-    try:
-      self._data
-    except:
+    if self._data is None:
       return list()
 
     return self._data.dtype.names
@@ -168,12 +195,10 @@ class Table(object):
 
     result = [0] * len(query.subdomain)
 
-    try:
-      self._data
-    except:
+    if self._data is None:
       return result,False
 
-    if not isinstance(query.subdomain,self._domainType):
+    if query.subdomain.subdomain() != self._domainType.subdomain():
       print "Type mismatch. Could not evaluate query."
       return result, False
 
@@ -272,6 +297,33 @@ class Table(object):
     return attr_list
 
 
+  def columns_by_identifiers(self, identifiers, attributes):
+    """Get the values of the given attributes for the given identifiers, in
+       order and with repeats, as one numpy array per attribute.
+    """
+    return [self._data[attr][identifiers] for attr in attributes]
+
+
+  def sort_identifiers(self, identifiers, sort_keys):
+    """Return the identifiers as an array ordered by the sort keys, a list
+       of (attribute, ascending) pairs with the most significant first.
+       The sort is stable so rows with equal keys keep their given order.
+    """
+    identifiers = np.asarray(identifiers, dtype = int)
+    if not sort_keys:
+      return identifiers
+
+    # lexsort sorts by the last key first
+    keys = list()
+    for attribute, ascending in reversed(sort_keys):
+      values = self._data[attribute][identifiers]
+      if not ascending:
+        # Negated ranks order any dtype from largest to smallest
+        values = -np.unique(values, return_inverse = True)[1]
+      keys.append(values)
+    return identifiers[np.lexsort(keys)]
+
+
   def attributes_by_conditions(self, identifiers, desired_attrs, conditions,
     unique = True):
     """Get all rows of the desired attributes where the conditions
@@ -318,6 +370,90 @@ class Table(object):
     return [identifiers[x] for x in indices[0]]
 
 
+  def partition(self, attribute):
+    """Partition the rows of the table by the values of the given attribute.
+       This is computed once per attribute and cached. Returns the tuple
+
+         values   the sorted distinct values of the attribute
+         order    the row indices sorted by value (stable, so rows with the
+                  same value stay in table order)
+         bounds   rows order[bounds[i]:bounds[i+1]] have value values[i]
+    """
+    if attribute not in self._partitions:
+      column = self._data[attribute]
+      order = np.argsort(column, kind = 'mergesort')
+      values, starts = np.unique(column[order], return_index = True)
+      self._partitions[attribute] = (values, order,
+        np.append(starts, len(order)))
+
+    return self._partitions[attribute]
+
+  def subset_by_value(self, identifiers, attribute, value):
+    """Determine the subset of valid identifiers whose attribute equals the
+       given value. This gives the same result as subset_by_conditions with
+       Clause('=', TableAttribute(attribute), value) but looks the rows up in
+       the partition for that attribute rather than comparing every row.
+
+       identifiers = initial set of identifiers of rows, in table order.
+    """
+    values, order, bounds = self.partition(attribute)
+    value = self.numpy_cast(value, self._data[attribute].dtype, attribute)
+
+    index = np.searchsorted(values, value)
+    if index >= len(values) or values[index] != value:
+      return []
+    rows = order[bounds[index]:bounds[index + 1]]
+
+    # Identifiers are kept in table order, so all of them means every row.
+    if len(identifiers) == len(self._data):
+      return rows.tolist()
+
+    valid = np.zeros(len(self._data), dtype = bool)
+    valid[identifiers] = True
+    return rows[valid[rows]].tolist()
+
+
+  def memory_usage(self):
+    """Return the bytes used by the records and by the derived indexes of
+       this table. Memory-mapped records are paged in and out by the
+       system and count as nothing.
+    """
+    data_bytes = 0
+    if self._records is not None and not isinstance(self._records,
+      np.memmap):
+      data_bytes = self._records.nbytes
+
+    index_bytes = 0
+    for partition in self._partitions.values():
+      index_bytes += sum(array.nbytes for array in partition)
+
+    return data_bytes, index_bytes
+
+  def take_used(self):
+    """Return whether the table has been used since the last call."""
+    used = self._used
+    self._used = False
+    return used
+
+  def release_indexes(self):
+    """Drop the derived indexes, which are made again when needed. Return
+       the bytes released.
+    """
+    released = self.memory_usage()[1]
+    self._partitions = dict()
+    return released
+
+  def evict(self):
+    """Drop the records if the loader can read them again. Return the
+       bytes released.
+    """
+    if self._loader is None or self._records is None:
+      return 0
+    released = self.memory_usage()[0]
+    self._records = None
+    return released
+
+
   def subset_by_conditions(self, identifiers, conditions):
     """Determine the subset of valid identifiers based on some conditions
        within this table and an initial set of identifiers.
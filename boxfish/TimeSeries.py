@@ -0,0 +1,392 @@
+import os
+import re
+import glob
+import time
+import numpy as np
+from Table import *
+import YamlLoader as yl
+
+# Time series runs hold counter snapshots taken every so often. Rather than
+# one run per snapshot, or one giant table, a time series table is read from
+# a series of snapshot files, each an ordinary Boxfish table, and keeps one
+# chunk of rows per timestep. In the meta file:
+#
+#   ---
+#   filetype: timeseries
+#   filename: links_*.yaml
+#   time: timestep
+#   domain: HW
+#   type: LINK
+#   field: linkid
+#
+# The time of a snapshot is the value of the time key in its header meta
+# information if it has one, and otherwise the last number in its file name.
+# The time attribute is added to the rows if the snapshots do not have it.
+# Snapshots written later are appended by refresh() without reading the
+# earlier ones again.
+
+number_pattern = re.compile(r'(\d+(?:\.\d+)?)')
+
+# Snapshots modified more recently than this many seconds ago may still be
+# being written and are left for a later refresh, unless their size and
+# time have not changed since the last refresh. They are read all the same
+# when the table is first loaded, so a run written just now can be opened.
+settle_seconds = 2.0
+
+
+def snapshotTime(filename, meta, time_attribute):
+    """Returns the time of the snapshot file with the given header meta
+       information, or None if it has none.
+    """
+    if meta is not None and time_attribute in meta:
+        return meta[time_attribute]
+
+    numbers = number_pattern.findall(os.path.basename(filename))
+    if not numbers:
+        return None
+    if '.' in numbers[-1]:
+        return float(numbers[-1])
+    return int(numbers[-1])
+
+
+def addTimeColumn(data, time_attribute, time):
+    """Returns the records with the time attribute set to the given time,
+       adding it as the last column if there is no such column.
+    """
+    if time_attribute in data.dtype.names:
+        data = data.copy()
+        data[time_attribute] = time
+        return data
+
+    time_type = np.float64 if isinstance(time, float) else np.int64
+    dtype = np.dtype(data.dtype.descr + [(time_attribute, time_type)])
+    timed = np.empty(len(data), dtype = dtype)
+    for name in data.dtype.names:
+        timed[name] = data[name]
+    timed[time_attribute] = time
+    return timed
+
+
+class TimeSeriesTable(Table):
+    """A Table whose rows come in chunks, one per timestep, in increasing
+       time order. Rows of timestep times[i] are rows bounds[i] to
+       bounds[i + 1]. The chunk boundaries are the table's time index, and
+       per chunk partial sums, counts, maxima and minima of attributes by
+       key are kept so that aggregates over a time window need not touch
+       the rows.
+    """
+
+    def __init__(self, time_attribute = 'time'):
+        """Construct an empty TimeSeriesTable whose timesteps are the given
+           attribute.
+        """
+        super(TimeSeriesTable, self).__init__()
+
+        self.time_attribute = time_attribute
+        self.pattern = None
+        self.metadata = None
+
+        self.times = list()
+        self.bounds = [0]
+        # The snapshot file of each chunk, from which it can be read again
+        self.chunk_files = list()
+        # Snapshot files already considered, loaded or not
+        self.filenames = set()
+        # Snapshot files left for a later refresh: filename -> (size,
+        # modification time) when last seen, and those that failed to
+        # load, which are tried again only once they change.
+        self.pending = dict()
+        self.failed = dict()
+
+        # Sorted distinct keys over all chunks, and per attribute the
+        # cumulative sums and counts ((chunks + 1) x keys, starting with a
+        # row of zeros) and the maxima and minima (chunks x keys) by key.
+        self._keys = None
+        self._chunks_keyed = 0
+        self._chunk_partials = dict()
+
+
+    def fromSnapshots(self, domain_type, primary_key, pattern):
+        """Load a table from the snapshot files matching the given glob
+           pattern. Snapshots added later are appended by refresh().
+           Parameters:
+
+             domain_type   a SubDomain type corresponding to the primary key
+                           of this table
+             primary_key   the string key used in the files for the primary
+                           domain
+             pattern       glob pattern of the snapshot file names
+        """
+        self._domainType = domain_type
+        self._key = primary_key
+        self.pattern = pattern
+        self.set_loader(self.reloadChunks)
+        self.refresh(settle = False)
+
+    def refresh(self, settle = True):
+        """Appends the snapshots matching the pattern that have not been
+           considered yet, in time order. Returns the number appended.
+           Unless settle is False, snapshots that may still be being
+           written are left pending, see settled().
+        """
+        snapshots = list()
+        for filename in sorted(glob.glob(self.pattern)):
+            if filename in self.filenames \
+                or (settle and not self.settled(filename)):
+                continue
+
+            try:
+                meta, dtype = yl.read_header(filename)
+            except Exception, e:
+                self.loadFailed(filename, e)
+                continue
+            time = snapshotTime(filename, meta, self.time_attribute)
+            if time is None:
+                print "No time found for snapshot", filename, \
+                    "! Skipping snapshot..."
+                self.filenames.add(filename)
+                continue
+            snapshots.append((time, filename))
+
+        appended = 0
+        for time, filename in sorted(snapshots):
+            if self.times and time <= self.times[-1]:
+                print "Snapshot", filename, "is not after the last", \
+                    "timestep", self.times[-1], "! Skipping snapshot..."
+                self.filenames.add(filename)
+                continue
+
+            try:
+                meta, data = yl.load_table(filename)
+            except Exception, e:
+                self.loadFailed(filename, e)
+                continue
+            if self.metadata is None:
+                self.metadata = meta
+            self.appendChunk(time, data, filename)
+            self.filenames.add(filename)
+            self.failed.pop(filename, None)
+            appended += 1
+
+        return appended
+
+    def settled(self, filename):
+        """Returns True if the snapshot file seems completely written:
+           it was last modified over settle_seconds ago, or its size and
+           modification time are those seen by the last refresh. Otherwise
+           it is left pending. Files that failed to load are not settled
+           until they change, and stay pending only while they may still
+           be being written.
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError: # Removed since globbed
+            self.pending.pop(filename, None)
+            return False
+        seen = (stat.st_size, stat.st_mtime)
+
+        if self.failed.get(filename) == seen:
+            if time.time() - stat.st_mtime > settle_seconds:
+                self.pending.pop(filename, None)
+            return False
+        if time.time() - stat.st_mtime > settle_seconds \
+            or self.pending.get(filename) == seen:
+            self.pending.pop(filename, None)
+            return True
+
+        self.pending[filename] = seen
+        return False
+
+    def loadFailed(self, filename, error):
+        """Reports a snapshot that could not be read. It is tried again
+           once it changes. If it was modified just now it may still be
+           being written, so it is left pending as well.
+        """
+        print "Could not read snapshot", filename, ":", error, \
+            "! Skipping snapshot for now..."
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return
+        self.failed[filename] = (stat.st_size, stat.st_mtime)
+        if time.time() - stat.st_mtime <= settle_seconds:
+            self.pending[filename] = self.failed[filename]
+
+    def appendChunk(self, time, data, filename = None):
+        """Appends the records of the timestep at the given time, which must
+           be after the last one. If the records were not read from the
+           given snapshot file, the table cannot be evicted.
+        """
+        if self._key not in data.dtype.names:
+            raise ValueError("This table does not contain the given key.")
+        if self.times and time <= self.times[-1]:
+            raise ValueError("Timesteps must be appended in time order.")
+
+        chunk = addTimeColumn(data, self.time_attribute, time)
+        if len(self.times) == 0:
+            self._data = chunk
+        else:
+            self._data = np.concatenate((self._data,
+                chunk.astype(self._data.dtype)))
+
+        self.times.append(time)
+        self.bounds.append(len(self._data))
+        self.chunk_files.append(filename)
+        if filename is None:
+            self.set_loader(None)
+
+        # Value partitions cover all rows and are made again when needed.
+        # The partial sums of the earlier chunks stay valid.
+        self._partitions = dict()
+
+    def chunkCount(self):
+        """Returns the number of timesteps loaded."""
+        return len(self.times)
+
+    def reloadChunks(self):
+        """Reads the records of all chunks again from their snapshots."""
+        chunks = [addTimeColumn(yl.load_records(filename), self.time_attribute,
+            time) for time, filename in zip(self.times, self.chunk_files)]
+        return np.concatenate([chunk.astype(chunks[0].dtype)
+            for chunk in chunks])
+
+    def memory_usage(self):
+        """As Table.memory_usage, counting the partial sums as indexes."""
+        data_bytes, index_bytes = super(TimeSeriesTable, self).memory_usage()
+        if self._keys is not None:
+            index_bytes += self._keys.nbytes
+        for partials in self._chunk_partials.values():
+            index_bytes += sum(array.nbytes for array in partials)
+        return data_bytes, index_bytes
+
+    def release_indexes(self):
+        """As Table.release_indexes, also dropping the partial sums."""
+        released = super(TimeSeriesTable, self).release_indexes()
+        released += self.memory_usage()[1]
+        self._keys = None
+        self._chunks_keyed = 0
+        self._chunk_partials = dict()
+        return released
+
+
+    def partition(self, attribute):
+        """As Table.partition, but the partition of the time attribute is
+           the time index itself.
+        """
+        if attribute == self.time_attribute:
+            return (np.asarray(self.times), np.arange(len(self._data)),
+                np.asarray(self.bounds))
+        return super(TimeSeriesTable, self).partition(attribute)
+
+    def time_window(self, start, stop):
+        """Returns the (first, last) chunks such that chunks first to
+           last - 1 are the timesteps from start to stop inclusive.
+        """
+        times = np.asarray(self.times)
+        return (int(np.searchsorted(times, start, 'left')),
+            int(np.searchsorted(times, stop, 'right')))
+
+    def time_rows(self, start, stop):
+        """Returns the array of rows of the timesteps from start to stop
+           inclusive.
+        """
+        first, last = self.time_window(start, stop)
+        if first >= last:
+            return np.arange(0)
+        return np.arange(self.bounds[first], self.bounds[last])
+
+
+    def knownKeys(self, keys):
+        """Returns True if all the given keys are among those indexed by
+           the partial sums.
+        """
+        if self._keys is None:
+            return False
+        if len(self._keys) == 0:
+            return len(keys) == 0
+        index = np.searchsorted(self._keys, keys).clip(0, len(self._keys) - 1)
+        return bool(np.all(self._keys[index] == keys))
+
+    def chunk_partials(self, attribute):
+        """Returns the per chunk aggregates of the attribute by key as a
+           tuple (keys, sums, counts, maxima, minima). Keys are the sorted
+           distinct keys. Sums and counts are cumulative over chunks with a
+           leading row of zeros, so the sums of chunks i to j - 1 are
+           sums[j] - sums[i]. Maxima and minima have one row per chunk.
+           Only chunks appended since the last call are computed.
+        """
+        keys = self._data[self._key]
+        if not self.knownKeys(keys[self.bounds[self._chunks_keyed]:]):
+            # New keys: everything is indexed again
+            self._keys = np.unique(keys)
+            self._chunk_partials = dict()
+        self._chunks_keyed = len(self.times)
+
+        num_keys = len(self._keys)
+        if attribute not in self._chunk_partials:
+            self._chunk_partials[attribute] = (np.zeros((1, num_keys)),
+                np.zeros((1, num_keys)), np.zeros((0, num_keys)),
+                np.zeros((0, num_keys)))
+        sums, counts, maxima, minima = self._chunk_partials[attribute]
+
+        done = len(maxima)
+        if done < len(self.times):
+            new_sums = list()
+            new_counts = list()
+            new_maxima = list()
+            new_minima = list()
+            for chunk in range(done, len(self.times)):
+                rows = slice(self.bounds[chunk], self.bounds[chunk + 1])
+                index = np.searchsorted(self._keys, keys[rows])
+                values = self._data[attribute][rows].astype(float)
+
+                new_sums.append(np.bincount(index, weights = values,
+                    minlength = num_keys))
+                new_counts.append(np.bincount(index, minlength = num_keys))
+                chunk_maxima = np.empty(num_keys)
+                chunk_maxima.fill(-np.inf)
+                np.maximum.at(chunk_maxima, index, values)
+                new_maxima.append(chunk_maxima)
+                chunk_minima = np.empty(num_keys)
+                chunk_minima.fill(np.inf)
+                np.minimum.at(chunk_minima, index, values)
+                new_minima.append(chunk_minima)
+
+            sums = np.vstack((sums, sums[-1] + np.cumsum(new_sums, axis = 0)))
+            counts = np.vstack((counts, counts[-1]
+                + np.cumsum(new_counts, axis = 0)))
+            maxima = np.vstack((maxima, new_maxima))
+            minima = np.vstack((minima, new_minima))
+            self._chunk_partials[attribute] = (sums, counts, maxima, minima)
+
+        return self._keys, sums, counts, maxima, minima
+
+    def window_partials(self, attributes, start, stop):
+        """Returns the aggregates by key of the given attributes together
+           over the timesteps from start to stop inclusive, as arrays
+           (keys, sums, counts, maxima, minima). Only keys with rows in the
+           window are included.
+        """
+        first, last = self.time_window(start, stop)
+        keys = self.chunk_partials(attributes[0])[0]
+        sums = np.zeros(len(keys))
+        counts = np.zeros(len(keys))
+        maxima = np.empty(len(keys))
+        maxima.fill(-np.inf)
+        minima = np.empty(len(keys))
+        minima.fill(np.inf)
+
+        if first < last:
+            for attribute in attributes:
+                keys, chunk_sums, chunk_counts, chunk_maxima, chunk_minima \
+                    = self.chunk_partials(attribute)
+                sums += chunk_sums[last] - chunk_sums[first]
+                counts += chunk_counts[last] - chunk_counts[first]
+                maxima = np.maximum(maxima,
+                    chunk_maxima[first:last].max(axis = 0))
+                minima = np.minimum(minima,
+                    chunk_minima[first:last].min(axis = 0))
+
+        present = counts > 0
+        return (keys[present], sums[present], counts[present],
+            maxima[present], minima[present])
@@ -10,10 +10,25 @@ def read_header(filename):
        meta information. If this document exists, it must come before
        the dtype information for the table.
     """
-    import yaml
-    input = open(filename,'r')
+    input = open(filename,'rb')
+    return parse_header(read_header_text(input))
 
-    loader = yaml.SafeLoader(input) # No python-specific yaml
+def read_header_text(input):
+    """Reads the YAML header of an open data table file, up to and
+       including the '...' line that ends it, and returns it as a
+       string. The file is left at the start of the table data.
+    """
+    lines = [input.readline()]
+    while lines[-1] and lines[-1].split()[:1] != ["..."]:
+        lines.append(input.readline())
+    return "".join(lines)
+
+def parse_header(text):
+    """Parses the text of a table header into its meta information (or
+       None) and its dtype.
+    """
+    import yaml
+    loader = yaml.SafeLoader(text) # No python-specific yaml
 
     # Where we're storing the meta data
     meta = loader.get_data()
@@ -61,33 +76,43 @@ def load_meta(filename):
     return meta, filelist
 
 
-def load_table(filename):
+def load_table(filename, mmap = False):
     """Reads the given file and returns a numpy recarray of the data.
 
        Assumes a YAML header with dtype information for the table. This
        header may also have one (1) document of meta information which
        will be read and passed back, but this is optional.
+
+       If the meta information has 'encoding: binary', the data following
+       the header is the raw records of the dtype in native byte order
+       rather than whitespace separated text. Binary data is memory-mapped
+       (copy on write) rather than read if mmap is set.
     """
+    import os
     import numpy as np
 
-    meta, dtype = read_header(filename)
+    input = open(filename,'rb')
+    meta, dtype = parse_header(read_header_text(input))
 
-    # Reopen to actually get data
-    input = open(filename,'r')
-    line = input.readline()
-
-    while input.readline().split()[0] != "...":
-        continue
-
-    #print meta
-    #if 'encoding' in meta and meta['encoding'] == 'binary':
-    #    print "Trying ", dtype 
-    #    data = np.loads(input.read())
-    #else:
-    data = np.loadtxt(input, dtype=np.dtype(dtype))
+    if meta is not None and meta.get('encoding') == 'binary':
+        # An empty table cannot be mapped
+        if mmap and os.path.getsize(filename) > input.tell():
+            data = np.memmap(filename, dtype=np.dtype(dtype), mode='c',
+                offset=input.tell())
+        else:
+            data = np.frombuffer(input.read(), dtype=np.dtype(dtype)).copy()
+    else:
+        data = np.loadtxt(input, dtype=np.dtype(dtype))
 
+    input.close()
     return meta, data
 
+def load_records(filename, mmap = False):
+    """Reads the given table file as load_table does and returns only the
+       numpy recarray of the data.
+    """
+    return load_table(filename, mmap)[1]
+
 if __name__ == '__main__':
     from sys import argv
 
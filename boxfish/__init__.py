@@ -1,11 +1,33 @@
 
 import sys
+import time
 #from OpenGL.GLUT import glutInit
-from MainWindow import *
+
+# The GUI is only imported when it is run so that the Qt-free parts of the
+# package (DataItems, Aggregation, Batch) can be used without a display.
+
+# Seconds allowed from run() until the main window is up. Going over it is
+# reported so that heavy imports creeping back into startup get noticed.
+startup_budget = 2.0
+
+
+def reportStartup(start):
+    """Prints the time to window if it was over the startup budget."""
+    elapsed = time.time() - start
+    if elapsed > startup_budget:
+        print >> sys.stderr, "Boxfish took %.2f s to start, over the" \
+            % elapsed, "%.2f s budget." % startup_budget
+    return elapsed
 
 
 def run():
     """This method runs the boxfish application."""
+    start = time.time()
+    import signal
+    from PySide.QtCore import QTimer
+    from PySide.QtGui import QApplication
+    from MainWindow import MainWindow
+
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
     # May be called on some systems, not on others and the latter
@@ -22,4 +44,7 @@ def run():
 
     bf.show()
     bf.raise_()
+
+    # Fires once the event loop has shown the window
+    QTimer.singleShot(0, lambda: reportStartup(start))
     sys.exit(app.exec_())
@@ -10,6 +10,7 @@ and Josh Levine.
 """
 
 import math
+import time
 import numpy as np
 from exceptions import *
 
@@ -19,13 +20,15 @@ from PySide.QtOpenGL import *
 from OpenGL.GL import *
 
 from glutils import *
+import boxfish.Profiler as Profiler
 
 boxfish_glut_initialized = False
 
 @contextmanager
 def setupPaintEvent(self):
+    start = time.time()
     painter = QPainter()
-    painter.begin(self)
+    painter.begin(self.paint_target or self)
     painter.setRenderHint(QPainter.Antialiasing)
 
     glPushAttrib(GL_ALL_ATTRIB_BITS)
@@ -40,6 +43,8 @@ def setupPaintEvent(self):
 
     painter.end()
 
+    self.recordFrameTime(time.time() - start)
+
 
 class GLWidget(QGLWidget):
     """ This class implements basic support for interactive OpenGL application
@@ -94,6 +99,12 @@ class GLWidget(QGLWidget):
 
         self.textdraws = []
 
+        # Paint device used instead of the widget, see renderImage()
+        self.paint_target = None
+
+        # Frame timing, see frameStats()
+        self.resetFrameStats()
+
     def set_translation(self, t):
         """Ensure that translation is always a numpy array."""
         if type(t) == np.ndarray and t.dtype == float:
@@ -124,6 +135,51 @@ class GLWidget(QGLWidget):
 
     rotation = property(get_rotation, set_rotation)
 
+    def recordFrameTime(self, seconds):
+        """Adds the time taken by one paint to the frame counter."""
+        self.frame_count += 1
+        self.frame_time_total += seconds
+        self.frame_time_last = seconds
+        self.frame_time_max = max(self.frame_time_max, seconds)
+
+    def resetFrameStats(self):
+        """Zeroes the frame counter."""
+        self.frame_count = 0
+        self.frame_time_total = 0.0
+        self.frame_time_last = 0.0
+        self.frame_time_max = 0.0
+
+    def frameStats(self):
+        """Returns the number of frames painted since the last reset and
+           the mean, last and maximum time per frame in milliseconds.
+        """
+        mean = 0.0
+        if self.frame_count > 0:
+            mean = self.frame_time_total / self.frame_count
+        return (self.frame_count, 1000.0 * mean,
+            1000.0 * self.frame_time_last, 1000.0 * self.frame_time_max)
+
+
+    def renderImage(self, width, height):
+        """Paints the view at the given size into an offscreen framebuffer
+           rather than the screen and returns the result as a QImage. The
+           widget need not be shown, so views can be exported in batch.
+        """
+        self.resize(width, height)
+        self.makeCurrent()
+        framebuffer = QGLFramebufferObject(width, height,
+            QGLFramebufferObject.CombinedDepthStencil)
+
+        self.paint_target = framebuffer
+        try:
+            self.resizeGL(width, height)
+            with Profiler.span(type(self).__name__ + ".paintEvent", "paint"):
+                self.paintEvent(None)
+        finally:
+            self.paint_target = None
+
+        return framebuffer.toImage()
+
 
     def map_to_sphere(self, x, y):
         """This takes local x and y window coordinates and maps them to an
@@ -211,6 +267,13 @@ class GLWidget(QGLWidget):
     #    glFlush()
 
 
+    def event(self, event):
+        """Times the paintEvent of every view when profiling."""
+        if Profiler.enabled and event.type() == QEvent.Paint:
+            with Profiler.span(type(self).__name__ + ".paintEvent", "paint"):
+                return super(GLWidget, self).event(event)
+        return super(GLWidget, self).event(event)
+
     def paintEvent(self, event):
         glFlush()
 
@@ -322,6 +385,51 @@ class GLWidget(QGLWidget):
         glMultMatrixd(self.rotation)
 
 
+    def frustum_extents(self):
+        """Half width and half height of the near plane of the perspective
+           set by resizeGL().
+        """
+        half_height = math.tan(self.fov / 360.0 * math.pi) * self.near_plane
+        aspect = self.width() / float(max(self.height(), 1))
+        return half_height * aspect, half_height
+
+    def unproject_ray(self, x, y):
+        """Returns the origin and direction, in scene coordinates, of the
+           ray under the window position x, y. Scene coordinates are those
+           after orient_scene(). Assumes the perspective set by resizeGL().
+        """
+        half_width, half_height = self.frustum_extents()
+        ndc_x = (2.0 * x - self.width()) / self.width()
+        ndc_y = (self.height() - 2.0 * y) / float(max(self.height(), 1))
+
+        # self.rotation is column major, so the modelview applied to a row
+        # vector v is v . rotation, and its inverse is v . inv(rotation)
+        inverse = np.linalg.inv(self.rotation)
+        origin = np.dot(np.append(-self.translation, 1.0), inverse)
+        direction = np.dot([ndc_x * half_width, ndc_y * half_height,
+            -self.near_plane, 0.0], inverse)
+        return origin[:3], direction[:3]
+
+    def project_points(self, points):
+        """Maps an array of scene coordinates to window positions. Returns
+           an (n, 2) array of window x, y and a mask of the points that are
+           in front of the near plane.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        homogeneous = np.hstack((points, np.ones((len(points), 1))))
+        eye = np.dot(homogeneous, self.rotation)[:, :3] + self.translation
+
+        visible = -eye[:, 2] > self.near_plane
+        depth = np.where(visible, -eye[:, 2], 1.0)
+        half_width, half_height = self.frustum_extents()
+        ndc_x = eye[:, 0] * self.near_plane / depth / half_width
+        ndc_y = eye[:, 1] * self.near_plane / depth / half_height
+
+        window = np.empty((len(points), 2))
+        window[:, 0] = (ndc_x + 1.0) * self.width() / 2.0
+        window[:, 1] = (1.0 - ndc_y) * self.height() / 2.0
+        return window, visible
+
     def set_transform(self, rotation, translation):
         """Allows forcing the rotation and translation to the given values.
         """
@@ -364,3 +472,63 @@ class TextDraw(object):
         self.text = text
         self.x = x
         self.y = y
+
+
+def drawGLColorBar(colors, bar_x, bar_y, bar_width, bar_height, label = "", total_height = 0):
+    """Draws a single colorbar at bar_x, bar_y with width bar_width
+       and height bar_height.
+
+       colors
+           A list of sampled 11 sampled colors spanning the colormap.
+    """
+    setup_overlay2D(bar_x, bar_y, bar_width, bar_height + 12)
+
+    with glMatrix():
+        glLoadIdentity()
+        glTranslatef(bar_x, bar_y, 0)
+
+        segment_size = int(float(bar_height) / 10.0)
+
+        for i in range(10):
+
+            with glMatrix():
+                glTranslatef(0, i*segment_size, 0)
+                with glSection(GL_QUADS):
+                    glColor3f(colors[i][0], colors[i][1], colors[i][2])
+                    glVertex3f(0, 0, 0)
+                    glVertex3f(bar_width, 0, 0)
+                    glColor3f(colors[i+1][0], colors[i+1][1],
+                        colors[i+1][2])
+                    glVertex3f(bar_width, segment_size, 0)
+                    glVertex3f(0, segment_size, 0)
+
+
+        # black box around gradient
+        prev_lineWidth = glGetFloatv(GL_LINE_WIDTH)
+        glLineWidth(1.0)
+        glColor3f(0.0, 0.0, 0.0)
+        with glMatrix():
+            with glSection(GL_LINES):
+                glVertex3f(0.01, 0.01, 0.01)
+                glVertex3f(bar_width, 0.01, 0.01)
+                glVertex3f(bar_width, 0.01, 0.01)
+                glVertex3f(bar_width, bar_height, 0.01)
+                glVertex3f(bar_width, bar_height, 0.01)
+                glVertex3f(0.01, bar_height, 0.01)
+                glVertex3f(0.01, bar_height, 0.01)
+                glVertex3f(0.01, 0.01, 0.01)
+
+        # TODO: Make this whole section much less magical
+        #default_text_height = 152.38
+        #scale_factor = 1.0 / default_text_height * segment_size
+        #scale_factor = 0.08
+        #if len(label) > 0:
+        #    with glMatrix():
+        #        glTranslatef(7, bar_height + 3, 0.2)
+        #        glScalef(scale_factor, scale_factor, scale_factor)
+        #        for c in label:
+        #            glutStrokeCharacter(GLUT_STROKE_ROMAN, ord(c))
+        #glLineWidth(prev_lineWidth)
+
+        if len(label) > 0:
+            return TextDraw(label, bar_x + 6, total_height - (bar_y + bar_height + 3))
@@ -6,8 +6,10 @@ Author:
     Todd Gamblin, tgamblin@llnl.gov
 """
 from contextlib import contextmanager
+import numpy as np
 from OpenGL.GL import *
 #from glefix import *
+import boxfish.Profiler as Profiler
 
 @contextmanager
 def glSection(type):
@@ -53,6 +55,14 @@ def disabled(*glBits):
     for bit in glBits:
         glEnable(bit)
 
+@contextmanager
+def clientStates(*glArrays):
+    for array in glArrays:
+        glEnableClientState(array)
+    yield
+    for array in glArrays:
+        glDisableClientState(array)
+
 @contextmanager
 def overlays2D(width, height, background_color):
     """The before and after gl calls necessary to setup 2D overlays to the
@@ -287,6 +297,12 @@ class DisplayList(object):
         self.needsUpdate = True
         self.listId = None
 
+        # Rebuilds are profiled under the owner and name of the function
+        owner = getattr(renderFunction, '__self__', None)
+        self.name = getattr(renderFunction, '__name__', 'render')
+        if owner is not None:
+            self.name = type(owner).__name__ + "." + self.name
+
     def update(self):
         self.needsUpdate = True
 
@@ -296,9 +312,143 @@ class DisplayList(object):
                 glDeleteLists(self.listId, 1)
             self.listId = glGenLists(1)
 
-            glNewList(self.listId, GL_COMPILE_AND_EXECUTE)
-            self.renderFunction(*args)
-            glEndList()
+            with Profiler.span(self.name, "display list"):
+                glNewList(self.listId, GL_COMPILE_AND_EXECUTE)
+                self.renderFunction(*args)
+                glEndList()
             self.needsUpdate = False
         else:
             glCallList(self.listId)
+
+
+# Vertex and normal arrays matching notGlutSolidCube for a unit cube, drawn
+# as GL_QUADS. Scale by the cube size before use.
+cube_vertices = 0.5 * np.array([
+    [-1,  1, -1], [-1, -1, -1], [ 1, -1, -1], [ 1,  1, -1], # front
+    [-1,  1,  1], [-1,  1, -1], [ 1,  1, -1], [ 1,  1,  1], # top
+    [ 1,  1, -1], [ 1, -1, -1], [ 1, -1,  1], [ 1,  1,  1], # right
+    [ 1,  1,  1], [ 1, -1,  1], [-1, -1,  1], [-1,  1,  1], # back
+    [ 1, -1,  1], [ 1, -1, -1], [-1, -1, -1], [-1, -1,  1], # bottom
+    [-1,  1,  1], [-1, -1,  1], [-1, -1, -1], [-1,  1, -1]  # left
+    ], dtype=float)
+cube_normals = np.repeat(np.array([
+    [0, 0, 1.], [0, 1., 0], [1., 0, 0],
+    [0, 0, -1.], [0, -1., 0], [-1., 0, 0]]), 4, axis=0)
+
+def cylinderArrays(axis, start, end, radius):
+    """Vertex and normal arrays for the same 10 sided cylinder drawn by
+       notGlePolyCylinder, running along the given axis from start to end.
+       The cylinder is returned as GL_QUADS, four vertices per face.
+    """
+    # Ring positions in the plane perpendicular to the axis, in the order
+    # notGlePolyCylinder walks them.
+    angles = np.radians(np.arange(11) * 36.0)
+    ring = np.zeros((11, 3))
+    across = [d for d in range(3) if d != axis]
+    ring[:, across[0]] = np.sin(angles)
+    ring[:, across[1]] = np.cos(angles)
+
+    near = radius * ring
+    far = radius * ring
+    near[:, axis] = start
+    far[:, axis] = end
+
+    vertices = np.empty((10, 4, 3))
+    vertices[:, 0] = near[:-1]
+    vertices[:, 1] = far[:-1]
+    vertices[:, 2] = far[1:]
+    vertices[:, 3] = near[1:]
+
+    normals = np.empty((10, 4, 3))
+    normals[:, 0] = normals[:, 1] = ring[:-1]
+    normals[:, 2] = normals[:, 3] = ring[1:]
+
+    return vertices.reshape(40, 3), normals.reshape(40, 3)
+
+
+class ColoredGeometry(object):
+    """Like a DisplayList, but keeps the geometry and the colors of what
+       it draws as separate resources. Use this for things like cubes and
+       links whose positions rarely change but whose colors change with
+       every data, range or highlight update.
+
+       The geometry function takes no arguments and returns a pair of
+       arrays (vertices, normals), both shaped (elements, vertices per
+       element, 3). The color function returns an array of RGBA colors
+       with one color per element, in the same order:
+           cubes = ColoredGeometry(GL_QUADS, self.cubeGeometry,
+               lambda : self.node_colors)
+
+       To draw, call the object like a DisplayList:
+           cubes()
+
+       When only the colors have changed, call updateColors(). This
+       expands the color buffer from the color function and recompiles a
+       single glDrawArrays call, without touching the geometry. When the
+       shape or layout changes, call updateGeometry(). Both are lazy; the
+       work happens on the next draw. update() is the same as
+       updateColors().
+    """
+    def __init__(self, primitive, geometryFunction, colorFunction):
+        self.primitive = primitive
+        self.geometryFunction = geometryFunction
+        self.colorFunction = colorFunction
+        self.needsGeometry = True
+        self.needsColors = True
+
+        self.vertices = None
+        self.normals = None
+        self.colors = None
+        self.vertices_per_element = 0
+
+        self.displayList = DisplayList(self.drawArrays)
+
+    def update(self):
+        """Same as updateColors, so that a ColoredGeometry can be used
+           anywhere a DisplayList is updated on color changes.
+        """
+        self.updateColors()
+
+    def updateGeometry(self):
+        self.needsGeometry = True
+        self.needsColors = True
+        self.displayList.update()
+
+    def updateColors(self):
+        self.needsColors = True
+        self.displayList.update()
+
+    def buildGeometry(self):
+        vertices, normals = self.geometryFunction()
+        vertices = np.asarray(vertices)
+        self.vertices_per_element = vertices.shape[1] \
+            if vertices.ndim == 3 else 0
+        self.vertices = np.ascontiguousarray(vertices.reshape(-1, 3),
+            dtype=np.float32)
+        self.normals = np.ascontiguousarray(np.asarray(normals).reshape(-1, 3),
+            dtype=np.float32)
+        self.needsGeometry = False
+
+    def buildColors(self):
+        colors = np.asarray(self.colorFunction(), dtype=np.float32)
+        self.colors = np.ascontiguousarray(np.repeat(colors.reshape(-1, 4),
+            self.vertices_per_element, axis=0))
+        self.needsColors = False
+
+    def drawArrays(self):
+        if self.vertices is None or len(self.vertices) == 0 \
+            or len(self.colors) != len(self.vertices):
+            return
+
+        with clientStates(GL_VERTEX_ARRAY, GL_NORMAL_ARRAY, GL_COLOR_ARRAY):
+            glVertexPointer(3, GL_FLOAT, 0, self.vertices)
+            glNormalPointer(GL_FLOAT, 0, self.normals)
+            glColorPointer(4, GL_FLOAT, 0, self.colors)
+            glDrawArrays(self.primitive, 0, len(self.vertices))
+
+    def __call__(self):
+        if self.needsGeometry:
+            self.buildGeometry()
+        if self.needsColors:
+            self.buildColors()
+        self.displayList()
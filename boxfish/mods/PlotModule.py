@@ -5,6 +5,8 @@ matplotlib.use('Qt4Agg')
 matplotlib.rcParams['backend.qt4']='PySide'
 
 from matplotlib.figure import Figure
+from matplotlib.colors import LogNorm
+from matplotlib.path import Path
 from matplotlib.backends.backend_qt4agg import \
     FigureCanvasQTAgg as FigureCanvas
 
@@ -13,6 +15,7 @@ from PySide.QtGui import *
 
 from boxfish.ModuleAgent import *
 from boxfish.ModuleFrame import *
+from boxfish.util.GridIndex import GridIndex
 
 
 class PlotterAgent(ModuleAgent):
@@ -52,15 +55,17 @@ class PlotterAgent(ModuleAgent):
 
         self.table, self.ids, xs, ys = self.requests['x'].generalizedGroupBy(
             self.requests['y'].indices, "sum", "sum")
+        self.id_array = np.array(self.ids)
         self.plotUpdateSignal.emit(self.ids, xs, ys)
 
     @Slot(list)
     def selectionChanged(self, ids):
         """Should be called when a view using this agent has changed
-           highlights.
+           highlights. The ids are indices into the plotted points.
         """
         if self.table:
-            self.setHighlights([self.table], [self.table.getRun()], [[self.ids[x] for x in ids]])
+            self.setHighlights([self.table], [self.table.getRun()],
+                [self.id_array[np.array(ids, dtype = int)].tolist()])
 
     @Slot()
     def processHighlights(self):
@@ -71,11 +76,9 @@ class PlotterAgent(ModuleAgent):
             return
 
         domain_indices = self.getHighlightIDs(self.table, self.table.getRun())
-        highlight_indices = []
-        for i, indx in enumerate(self.ids):
-            if indx in domain_indices:
-                highlight_indices.append(i)
-        self.highlightUpdateSignal.emit(highlight_indices)
+        highlight_indices = np.flatnonzero(np.in1d(self.id_array,
+            list(domain_indices)))
+        self.highlightUpdateSignal.emit(highlight_indices.tolist())
 
 @Module("Plotter", PlotterAgent)
 class PlotterFrame(ModuleFrame):
@@ -179,10 +182,24 @@ class PlotterFrame(ModuleFrame):
 
 
 class PlotterWidget(QWidget):
-    """Widget surrounding matplotlib plotter."""
+    """Widget surrounding matplotlib plotter.
+
+       Above density_threshold points, the points are binned over the
+       visible range and drawn as a density image instead of as markers.
+       Highlights are a single animated line blitted over a saved copy of
+       the axes, so changing them does not redraw the plotted points.
+
+       Clicking picks the nearest point. Dragging with the right button
+       selects the points in a rectangle, or in a lasso if shift is held.
+       Both are answered by a GridIndex built over the plotted points.
+    """
 
     selectionChangedSignal = Signal(list)
 
+    density_threshold = 20000
+    density_bins = 256
+    pick_radius = 3 # pixels
+
     def __init__(self, parent=None):
         """Create PlotterWidget."""
         super(PlotterWidget, self).__init__(parent)
@@ -190,12 +207,18 @@ class PlotterWidget(QWidget):
         self.selected = []
         self.ylabel = ""
         self.xlabel = ""
+        self.xs = np.zeros(0)
+        self.ys = np.zeros(0)
+        self.density_image = None
+        self.background = None
+        self.index = GridIndex(self.xs, self.ys)
+        self.band_points = None
+        self.dragged = False
         self.fig = Figure(figsize=(300,300), dpi=72, facecolor=(1,1,1), \
             edgecolor=(0,0,0))
 
         self.canvas = FigureCanvas(self.fig)
         self.canvas.setParent(self)
-        self.canvas.mpl_connect('pick_event', self.onPick)
 
         # Toolbar Doesn't get along with Kate's MPL at the moment so the
         # mpl_connects will handle that for the moment
@@ -203,8 +226,13 @@ class PlotterWidget(QWidget):
         self.canvas.mpl_connect('motion_notify_event', self.onMouseMotion)
         self.canvas.mpl_connect('scroll_event', self.onScroll)
         self.canvas.mpl_connect('button_press_event', self.onMouseButtonPress)
+        self.canvas.mpl_connect('button_release_event',
+            self.onMouseButtonRelease)
+        self.canvas.mpl_connect('draw_event', self.onDraw)
         self.lastX = 0
         self.lastY = 0
+        self.pressX = 0
+        self.pressY = 0
 
         self.axes = self.fig.add_subplot(111)
 
@@ -218,51 +246,179 @@ class PlotterWidget(QWidget):
         self.axes.set_title("Drag attributes to change graph.")
         self.axes.set_xlabel("Drag here to set x axis.")
         self.axes.set_ylabel("Drag here to set y axis.")
+        self.createHighlights()
         self.canvas.draw() # Why does this take so long on 4726 iMac?
 
     def setXLabel(self, label):
         """Changes the x label of the plot."""
         self.xlabel = label
         self.axes.set_xlabel(label)
-        self.canvas.draw()
+        self.canvas.draw_idle()
 
     def setYLabel(self, label):
         """Changes the y label of the plot."""
         self.ylabel = label
         self.axes.set_ylabel(label)
-        self.canvas.draw()
+        self.canvas.draw_idle()
+
+    def createHighlights(self):
+        """Creates the single animated line holding all highlighted
+           points and the line tracing the selection band. Animated artists
+           are left out of canvas draws and are drawn by onDraw and
+           blitHighlights instead.
+        """
+        self.highlighted = self.axes.plot([], [], 'or', animated = True)[0]
+        self.band = self.axes.plot([], [], '-k', animated = True)[0]
 
     def plotData(self, xs, ys):
-        """Plots the given x and y data."""
+        """Plots the given x and y data, as a density image if there are
+           more than density_threshold points.
+        """
         self.axes.clear()
         self.axes.set_xlabel(self.xlabel)
         self.axes.set_ylabel(self.ylabel)
-        self.xs = np.array(xs)
-        self.ys = np.array(ys)
-        self.axes.plot(xs, ys, 'ob', picker=3)
-        if np.alen(self.selected) > 0:
-            self.highlighted = self.axes.plot(self.xs[self.selected[0]],
-                self.ys[self.selected[0]], 'or')[0]
+        self.xs = np.array(xs, dtype = float)
+        self.ys = np.array(ys, dtype = float)
+        self.density_image = None
+        self.background = None
+
+        if len(self.xs) > self.density_threshold:
+            self.axes.set_autoscale_on(False)
+            self.axes.set_xlim(*self.dataLimits(self.xs))
+            self.axes.set_ylim(*self.dataLimits(self.ys))
+            self.updateDensity()
+        else:
+            self.axes.plot(self.xs, self.ys, 'ob')
+
+        self.index = GridIndex(self.xs, self.ys)
+        self.createHighlights()
+        self.setHighlightData()
         self.canvas.draw()
 
-    def onPick(self, event):
-        """Handles pick event, taking the closest single point.
+    def dataLimits(self, values):
+        """Returns axis limits covering the given values with a small
+           margin.
+        """
+        low, high = values.min(), values.max()
+        margin = 0.05 * (high - low)
+        if margin == 0:
+            margin = 0.5
+        return low - margin, high + margin
+
+    def updateDensity(self):
+        """Bins the points within the current axis limits into the density
+           image. Empty bins are left transparent.
+        """
+        xmin, xmax = self.axes.get_xlim()
+        ymin, ymax = self.axes.get_ylim()
+        counts, xedges, yedges = np.histogram2d(self.xs, self.ys,
+            bins = self.density_bins, range = [sorted((xmin, xmax)),
+                sorted((ymin, ymax))])
+        counts = np.ma.masked_equal(counts.T, 0)
+        extent = (min(xmin, xmax), max(xmin, xmax),
+            min(ymin, ymax), max(ymin, ymax))
+
+        if self.density_image is None:
+            self.density_image = self.axes.imshow(counts, extent = extent,
+                origin = 'lower', aspect = 'auto',
+                interpolation = 'nearest', cmap = 'Blues', norm = LogNorm())
+        else:
+            self.density_image.set_data(counts)
+            self.density_image.set_extent(extent)
+        self.density_image.set_clim(1, max(1, counts.max()))
+
+    def redraw(self):
+        """Redraws after the axis limits change, re-binning the density
+           image if there is one.
+        """
+        if self.density_image is not None:
+            self.updateDensity()
+        self.canvas.draw_idle()
+
+    def onDraw(self, event):
+        """After each full draw, saves the axes for blitting and draws
+           the highlights on top.
+        """
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self.axes.draw_artist(self.highlighted)
+        self.axes.draw_artist(self.band)
+        self.canvas.blit(self.axes.bbox)
+
+    def setHighlightData(self):
+        """Moves the highlight line to the selected points."""
+        selected = np.array(self.selected, dtype = int)
+        selected = selected[selected < len(self.xs)]
+        self.highlighted.set_data(self.xs[selected], self.ys[selected])
+
+    def blitHighlights(self):
+        """Redraws only the highlights and selection band over the saved
+           axes.
+        """
+        if self.background is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self.background)
+        self.axes.draw_artist(self.highlighted)
+        self.axes.draw_artist(self.band)
+        self.canvas.blit(self.axes.bbox)
+
+    def toData(self, event):
+        """Returns the data coordinates of a mouse event, even if it is
+           outside the axes.
+        """
+        return self.axes.transData.inverted().transform((event.x, event.y))
+
+    def pickPoint(self, event):
+        """Selects the point closest to the mouse event within pick_radius
+           pixels, if any.
 
            Note that since the id associated with a given point may be
            associated with many points, the final selection displayed to the
            user may be serveral points.
         """
-        selected = np.array(event.ind)
+        x, y = self.toData(event)
+        xmin, xmax = self.axes.get_xlim()
+        ymin, ymax = self.axes.get_ylim()
+        dx = abs(xmax - xmin) * self.pick_radius / self.axes.bbox.width
+        dy = abs(ymax - ymin) * self.pick_radius / self.axes.bbox.height
+
+        thepoint = self.index.nearest(x, y, dx, dy)
+        if thepoint is not None:
+            self.selectionChangedSignal.emit([int(thepoint)])
+
+    def selectBand(self):
+        """Selects all points within the traced band, treated as a
+           rectangle between its first and last points or as a lasso.
+        """
+        points = np.array(self.band_points)
+        if self.band_lasso:
+            xmin, ymin = points.min(axis = 0)
+            xmax, ymax = points.max(axis = 0)
+        else:
+            (xmin, ymin), (xmax, ymax) = np.sort(points[[0, -1]], axis = 0)
 
-        mouseevent = event.mouseevent
-        xt = self.xs[selected]
-        yt = self.ys[selected]
-        d = np.array((xt - mouseevent.xdata)**2 + (yt-mouseevent.ydata)**2)
-        thepoint = selected[d.argmin()]
-        selected = []
-        selected.append(thepoint)
+        selected = self.index.within(xmin, xmax, ymin, ymax)
+        if self.band_lasso and len(points) > 2 and len(selected):
+            inside = Path(points).contains_points(
+                np.column_stack((self.xs[selected], self.ys[selected])))
+            selected = selected[inside]
 
-        self.selectionChangedSignal.emit(selected)
+        self.selectionChangedSignal.emit(selected.tolist())
+
+    def updateBand(self):
+        """Moves the band line to trace the current selection band."""
+        if self.band_points is None:
+            self.band.set_data([], [])
+            return
+
+        points = np.array(self.band_points)
+        if self.band_lasso:
+            points = np.vstack((points, points[:1]))
+        else:
+            (x0, y0), (x1, y1) = points[0], points[-1]
+            points = np.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1),
+                (x0, y0)])
+        self.band.set_data(points[:,0], points[:,1])
 
     @Slot(list)
     def setHighlights(self, ids):
@@ -277,18 +433,11 @@ class PlotterWidget(QWidget):
         if (old_selection == self.selected and old_selection != [])\
             or self.selected != []:
 
-            if self.selected != [] and old_selection != self.selected: # Color new selection
-                for indx in self.selected:
-                    self.highlighted = self.axes.plot(self.xs[indx],
-                        self.ys[indx], 'or')[0]
             if old_selection == self.selected: # Turn off existing selection
                 self.selected = []
-            if old_selection != []: # Do not color old selection
-                for indx in old_selection:
-                    self.axes.plot(self.xs[indx], self.ys[indx],
-                        'ob', picker = 3)
 
-            self.canvas.draw()
+            self.setHighlightData()
+            self.blitHighlights()
             return True
         return False
 
@@ -298,8 +447,15 @@ class PlotterWidget(QWidget):
 
     # Mouse movement (with or w/o button press) handling
     def onMouseMotion(self, event):
-        """Handles the panning."""
-        if event.button == 1:
+        """Handles the panning and tracing selection bands."""
+        if event.button == 3 and self.band_points is not None:
+            self.band_points.append(self.toData(event))
+            self.updateBand()
+            self.blitHighlights()
+        elif event.button == 1:
+            if abs(event.x - self.pressX) + abs(event.y - self.pressY) \
+                > self.pick_radius:
+                self.dragged = True
             xmotion = self.lastX - event.x
             ymotion = self.lastY - event.y
             self.lastX = event.x
@@ -311,7 +467,7 @@ class PlotterWidget(QWidget):
                 ymotion, figsize)
             self.axes.set_xlim(xmin, xmax)
             self.axes.set_ylim(ymin, ymax)
-            self.canvas.draw()
+            self.redraw()
 
     # Note: the dtuple is in data coordinates, the motion is in pixels,
     # we estimate how much motion there is based on the figsize and then
@@ -343,10 +499,29 @@ class PlotterWidget(QWidget):
     # their drag event, so we set the last-coordinates that are used to
     # calculate drag
     def onMouseButtonPress(self, event):
-        """Records start of drag event."""
+        """Records start of drag event or selection band."""
         if event.button == 1:
             self.lastX = event.x
             self.lastY = event.y
+            self.pressX = event.x
+            self.pressY = event.y
+            self.dragged = False
+        elif event.button == 3:
+            self.band_points = [self.toData(event)]
+            self.band_lasso = event.key == 'shift'
+
+    # Releasing the left button without dragging is a pick, releasing the
+    # right button finishes a selection band
+    def onMouseButtonRelease(self, event):
+        """Picks a point or selects the points in a selection band."""
+        if event.button == 1 and not self.dragged:
+            self.pickPoint(event)
+        elif event.button == 3 and self.band_points is not None:
+            if len(self.band_points) > 1:
+                self.selectBand()
+            self.band_points = None
+            self.updateBand()
+            self.blitHighlights()
 
     # On mouse wheel scrool, we zoom
     def onScroll(self, event):
@@ -356,7 +531,7 @@ class PlotterWidget(QWidget):
         ymin, ymax = self.calcZoom(self.axes.get_ylim(), 1. + zoom*0.05)
         self.axes.set_xlim(xmin, xmax)
         self.axes.set_ylim(ymin, ymax)
-        self.canvas.draw()
+        self.redraw()
 
     # Calculates the zoom required by the wheel scroll for a single dimension
     # dtuple - the current limits in some dimension
@@ -1,18 +1,20 @@
-import sys
-from PySide.QtCore import Signal, Slot
-from PySide.QtGui import QTabWidget, QTableWidget, QAbstractItemView, \
-    QItemSelectionModel
+import functools
+import numpy as np
+from PySide.QtCore import Signal, Slot, Qt, QAbstractTableModel
+from PySide.QtGui import QTabWidget, QTableView, QAbstractItemView, \
+    QItemSelectionModel, QItemSelection
 
 from boxfish.ModuleAgent import *
 from boxfish.ModuleFrame import *
 from boxfish.SceneInfo import *
+from boxfish.util.LRUCache import LRUCache
 
 class TableAgent(ModuleAgent):
     """This is the agent for the Table Module. It is relatively
        simple with a single request.
     """
 
-    tableUpdateSignal = Signal(list, list, list, list, list)
+    tableUpdateSignal = Signal(list, list, list, list)
     highlightUpdateSignal = Signal(list)
 
     def __init__(self, parent, datatree):
@@ -56,14 +58,30 @@ class TableAgent(ModuleAgent):
            appropriate data from the Request and pass it to all those
            listening for its signal. The TableModule presents data 'as is'
            instead of aggregating by some domain like other modules do.
-           Therefore it simply gains the rows associated with the Request
-           and broadcasts them.
+           Only the table names, row counts and headers are broadcast,
+           the views fetch the rows they show through getTableWindow.
         """
-        tables, runs, ids, headers, data_lists \
-            = self.requestGetRows("table columns")
+        tables, runs, totals, ids, headers, data_lists \
+            = self.requestGetRowsWindow("table columns", 0, 0)
         self.tables = tables
         self.runs = runs
-        self.tableUpdateSignal.emit(tables, runs, ids, headers, data_lists)
+        self.tableUpdateSignal.emit(tables, runs, totals, headers)
+
+    def getTableWindow(self, table_index, offset, limit, sort_keys):
+        """Returns the ids and the list of column arrays of rows offset
+           through offset + limit of the given table after sorting by
+           sort_keys.
+        """
+        tables, runs, totals, ids, headers, data_lists \
+            = self.requestGetRowsWindow("table columns", offset, limit,
+                sort_keys)
+        return ids[table_index], data_lists[table_index]
+
+    def getTableIDs(self, table_index, sort_keys):
+        """Returns an array of the ids of all rows of the given table
+           after sorting by sort_keys.
+        """
+        return self.requestGetRowIDs("table columns", sort_keys)[table_index]
 
 
     @Slot()
@@ -141,39 +159,39 @@ class TableFrame(ModuleFrame):
         self.agent.addDataIndices(indexList)
 
 
-    @Slot(list, list, list, list, list)
-    def updateTables(self, tables, runs, ids, headers, values):
+    @Slot(list, list, list, list)
+    def updateTables(self, tables, runs, totals, headers):
         """Creates table views.
 
            tables
                A list of tables for which we have data.
 
-           ids
-               A list of lists of the corresponding SubDomain ids for
-               each row of each table's returned values.
+           runs
+               A list of the runs of those tables.
+
+           totals
+               A list of the number of rows of each table.
 
            headers
                A list of lists of the column names that go with the
                given values for each table.
-
-           values
-              A list of list of lists, one for each column of each table.
         """
 
-        # We need to save tables, id_lists for selection later
+        # We need to save tables for selection later
         self.tables = tables
-        self.id_lists = ids
 
         if tables is None:
             return
 
         self.tabs.clear() # Get rid of old data
 
-        # For each table, create a table view and populate it with the
-        # given values for that table
-        for table, run, ids_list, header_list, value_lists \
-            in zip(tables, runs, ids, headers, values):
-            tableWidget = TableTab(table, run, ids_list, header_list, value_lists)
+        # For each table, create a table view that fetches the rows
+        # it shows from the agent
+        for index, (table, run, total, header_list) \
+            in enumerate(zip(tables, runs, totals, headers)):
+            tableWidget = TableTab(table, run, total, header_list,
+                functools.partial(self.agent.getTableWindow, index),
+                functools.partial(self.agent.getTableIDs, index))
             tableWidget.idsChanged.connect(self.selectionChanged)
             self.tabs.addTab(tableWidget, table)
 
@@ -195,13 +213,115 @@ class TableFrame(ModuleFrame):
         self.agent.changeHighlights(table, run, ids)
 
 
-class TableTab(QTableWidget):
+class TableModel(QAbstractTableModel):
+    """Model for a single table in the Table module. Rows are fetched a
+       page at a time as the view scrolls to them and cells are only
+       formatted when the view asks for them, so the model can present
+       millions of rows.
+    """
+
+    page_size = 512
+
+    def __init__(self, total, headers, fetch_window, fetch_ids,
+        parent = None):
+        """Construct a TableModel.
+
+           total
+               The number of rows in the table.
+
+           headers
+               The column names.
+
+           fetch_window
+               Function taking an offset, limit and sort keys and
+               returning the ids and the column arrays of those rows.
+
+           fetch_ids
+               Function taking sort keys and returning the ids of all
+               rows in that order.
+        """
+        super(TableModel, self).__init__(parent)
+
+        self.total = total
+        self.headers = headers
+        self.fetch_window = fetch_window
+        self.fetch_ids = fetch_ids
+
+        self.sort_keys = tuple()
+        self.pages = LRUCache(32)
+        self.row_ids = None
+
+    def rowCount(self, parent = None):
+        return self.total
+
+    def columnCount(self, parent = None):
+        return len(self.headers)
+
+    def page(self, row):
+        """Returns the column arrays of the page holding the given row and
+           the position of the row within them.
+        """
+        number = row // self.page_size
+        if number not in self.pages:
+            ids, columns = self.fetch_window(number * self.page_size,
+                self.page_size, self.sort_keys)
+            self.pages[number] = columns
+        return self.pages[number], row - number * self.page_size
+
+    def data(self, index, role = Qt.DisplayRole):
+        """Formats the requested cell for display."""
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        columns, row = self.page(index.row())
+        return str(columns[index.column()][row])
+
+    def headerData(self, section, orientation, role = Qt.DisplayRole):
+        """Returns the column names and the row numbers."""
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    def sort(self, column, order = Qt.AscendingOrder):
+        """Sorts the rows by the given column. The sort is stable so equal
+           values keep their original relative order. A negative column
+           restores the original order.
+        """
+        self.layoutAboutToBeChanged.emit()
+        if column < 0:
+            self.sort_keys = tuple()
+        else:
+            self.sort_keys = ((self.headers[column],
+                order == Qt.AscendingOrder),)
+        self.pages.clear()
+        self.row_ids = None
+        self.layoutChanged.emit()
+
+    def allIDs(self):
+        """Returns an array of the ids of all rows in model order."""
+        if self.row_ids is None:
+            self.row_ids = np.asarray(self.fetch_ids(self.sort_keys))
+        return self.row_ids
+
+    def rowIDs(self, rows):
+        """Returns the ids associated with the given model rows."""
+        return self.allIDs()[rows]
+
+    def rowsWithIDs(self, ids):
+        """Returns a boolean array over the model rows marking those
+           whose id is in ids.
+        """
+        return np.in1d(self.allIDs(), list(ids))
+
+
+class TableTab(QTableView):
     """A TableTab is the display for a single Table in the TableWidget."""
 
     idsChanged = Signal(str, str, set)
 
-    def __init__(self, table, run, ids, headers, values):
-        """Represent the given sub-table using a TableWidget.
+    def __init__(self, table, run, total, headers, fetch_window, fetch_ids):
+        """Represent the given sub-table using a TableModel.
 
            table
                The table name from which this data is fetched.
@@ -209,33 +329,33 @@ class TableTab(QTableWidget):
            run
                The run from which the data is fetched
 
-           ids
-               The identifier that goes with each row
+           total
+               The number of rows in the table.
 
            headers
                The column names.
 
-           values
-               List of lists of values for each column
+           fetch_window
+               Function fetching a window of rows, see TableModel.
+
+           fetch_ids
+               Function fetching all ids in order, see TableModel.
         """
-        super(TableTab, self).__init__(min(100, len(values[0])), len(headers))
-        # TODO: Change the number of rows/make configurable
+        super(TableTab, self).__init__()
 
         self.user_selection = True
         self.table = table
         self.run = run
-        self.ids = ids
+
+        self.setModel(TableModel(total, headers, fetch_window, fetch_ids,
+            self))
 
         # Set behavior
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.setHorizontalHeaderLabels(headers)
-        self.itemSelectionChanged.connect(self.handleSelection)
-
-        # Populate table
-        for index, value_list in enumerate(values):
-            for i in range(self.rowCount()):
-                self.setItem(i, index, QTableWidgetItem(str(value_list[i])))
+        self.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.setSortingEnabled(True) # Starts in the given order
+        self.selectionModel().selectionChanged.connect(self.handleSelection)
 
     def handleSelection(self):
         """Called when the selected rows change. If the selection was made
@@ -245,11 +365,14 @@ class TableTab(QTableWidget):
         if not self.user_selection: # only handle if user did this
             return
 
-        id_set = set()
-        selected_items = self.selectedItems()
-        for item in selected_items:
-            id_set.add(self.ids[item.row()])
+        rows = [np.arange(selection_range.top(), selection_range.bottom() + 1)
+            for selection_range in self.selectionModel().selection()]
+        if rows:
+            rows = np.concatenate(rows)
+        else:
+            rows = np.zeros(0, dtype = int)
 
+        id_set = set(self.model().rowIDs(rows).tolist())
         self.idsChanged.emit(self.table, self.run, id_set)
 
 
@@ -257,24 +380,22 @@ class TableTab(QTableWidget):
         """Given a set of ids, selects all the rows that are associated
            with those ids.
         """
-        if self.rowCount() <= 0:
+        model = self.model()
+        if model.rowCount() <= 0:
             return
         self.user_selection = False # We don't want to cause this to emit anything
 
-        selectionModel = self.selectionModel()
-        selectionModel.clearSelection()
-        selection = selectionModel.selection()
-
-        # Check if each row is in the id set and if so add it to the
-        # selection
-        for row in range(self.rowCount()):
-            if self.ids[row] in ids:
-                self.selectRow(row)
-                selection.merge(selectionModel.selection(),
-                    QItemSelectionModel.Select)
-
-        selectionModel.clearSelection()
-        selectionModel.select(selection, QItemSelectionModel.Select)
+        # Find the runs of consecutive rows in the id set and select
+        # each run as a single range
+        selected = np.concatenate(([False], model.rowsWithIDs(ids), [False]))
+        edges = np.flatnonzero(np.diff(selected.astype(np.int8)))
+        last_column = model.columnCount() - 1
+        selection = QItemSelection()
+        for start, end in zip(edges[::2], edges[1::2]):
+            selection.select(model.index(int(start), 0),
+                model.index(int(end) - 1, last_column))
 
+        selectionModel = self.selectionModel()
+        selectionModel.select(selection, QItemSelectionModel.ClearAndSelect)
 
         self.user_selection = True
@@ -1,11 +1,12 @@
 from PySide.QtCore import *
 
 from GLModule import *
-from boxfish.gl.GLWidget import GLWidget, set_perspective, setupPaintEvent
+from boxfish.gl.GLWidget import GLWidget, set_perspective, setupPaintEvent, \
+    drawGLColorBar
 from boxfish.gl.glutils import *
 
 import TorusIcons
-from boxfish.ColorMaps import ColorMap, ColorMapWidget, drawGLColorBar
+from boxfish.ColorMaps import ColorMap, ColorMapWidget
 
 class Torus3dAgent(GLAgent):
     """This is an agent for all 3D Torus based modules."""
@@ -473,8 +474,8 @@ class Torus3dGLWidget(GLWidget):
         self.upperBound = 1
 
         # Display lists for nodes and links
-        self.cubeList = DisplayList(self.drawCubes)
-        self.linkList = DisplayList(self.drawLinks)
+        self.cubeList = self.createCubeList()
+        self.linkList = self.createLinkList()
         self.nodeBarList = DisplayList(self.drawNodeColorBar)
         self.linkBarList = DisplayList(self.drawLinkColorBar)
         self.nodeColorChangeSignal.connect(self.cubeList.update)
@@ -488,6 +489,18 @@ class Torus3dGLWidget(GLWidget):
         self.clearNodes()
         self.clearLinks()
 
+    def createCubeList(self):
+        """Creates the display list for nodes. Subclasses may return
+           anything with the update() and __call__() of a DisplayList.
+        """
+        return DisplayList(self.drawCubes)
+
+    def createLinkList(self):
+        """Creates the display list for links. Subclasses may return
+           anything with the update() and __call__() of a DisplayList.
+        """
+        return DisplayList(self.drawLinks)
+
     def setDataModel(self, dataModel):
         # unregister with any old model
         if self.dataModel:
@@ -543,29 +556,20 @@ class Torus3dGLWidget(GLWidget):
     def updateCubeColors(self):
         """Updates the node colors from the dataModel."""
         self.clearNodes()
-        for node in np.ndindex(*self.dataModel.shape):
-            self.node_colors[node] = self.map_node_color(
-                self.dataModel.node_values[node][0]) \
-                if (self.dataModel.node_values[node][1] \
-                > sys.float_info.epsilon) else self.default_node_color
+        valid = self.dataModel.node_values[..., 1] > sys.float_info.epsilon
+        if valid.any():
+            self.node_colors[valid] = self.map_node_colors(
+                self.dataModel.node_values[..., 0][valid])
         self.nodeColorChangeSignal.emit()
 
     def updateLinkColors(self):
         """Updates the link colors from the dataModel."""
         self.clearLinks()
-        #link_range = self.dataModel.avg_link_range[1] - self.dataModel.avg_link_range[0]
-        #for node in np.ndindex(*self.dataModel.shape):
-        #    for dim in range(3):
-        #        self.link_colors[node][dim] = self.map_link_color(
-        #            self.dataModel.avg_link_values[node][dim][0], link_range) \
-        #            if (self.dataModel.avg_link_values[node][dim][1] \
-        #            > sys.float_info.epsilon) else self.default_link_color
-        for node in np.ndindex(*self.dataModel.shape):
-            for dim in range(3):
-                self.link_colors[node][dim] = self.map_link_color(
-                    self.dataModel.link_values[node][dim][0]) \
-                    if (self.dataModel.link_values[node][dim][1] \
-                    > sys.float_info.epsilon) else self.default_link_color
+        link_values = self.dataModel.link_values[..., :3, :]
+        valid = link_values[..., 1] > sys.float_info.epsilon
+        if valid.any():
+            self.link_colors[valid] = self.map_link_colors(
+                link_values[..., 0][valid])
         self.linkColorChangeSignal.emit()
 
     def doLegend(self, bar_width = 20, bar_height = 160, bar_x = 20,
@@ -620,6 +624,23 @@ class Torus3dGLWidget(GLWidget):
         else:
             return self.link_cmap.getColor(val, preempt_range)
 
+    def map_node_colors(self, vals, preempt_range = 0):
+        """Turns an array of color values in [0,1] into an array of RGBA
+           colors. Used to map nodes.
+        """
+        return self.node_cmap.getColors(vals, preempt_range)
+
+    def map_link_colors(self, vals, preempt_range = 0):
+        """Turns an array of color values in [0,1] into an array of RGBA
+           colors. Used to map links.
+        """
+        vals = np.asarray(vals, dtype=float)
+        colors = self.link_cmap.getColors(vals, preempt_range)
+        out_of_bounds = (vals < self.lowerBound-1e-8) \
+            | (vals > self.upperBound+1e-8)
+        colors[out_of_bounds] = [1,1,1,0]
+        return colors
+
     def set_all_alphas(self, alpha):
         """Set all nodes and links to the same given alpha value."""
         self.node_colors[:,:,:,3] = alpha
@@ -643,13 +664,10 @@ class Torus3dGLWidget(GLWidget):
                     self.dataModel.link_to_coord[link])
                 self.link_colors[x,y,z,axis,3] = 1.0
         else: # Alpha based on data-present value in dataModel
-            for node in np.ndindex(*self.dataModel.shape):
-                self.node_colors[node][3] = 1.0 \
-                    if self.dataModel.node_values[node][1] > 0 else 0.2
-                vals = self.dataModel.link_values[node]
-                for dim in range(3):
-                    self.link_colors[node][dim][3] = 1.0 \
-                        if (vals[dim][1] > 0) else 0.2
+            self.node_colors[..., 3] = np.where(
+                self.dataModel.node_values[..., 1] > 0, 1.0, 0.2)
+            self.link_colors[..., 3] = np.where(
+                self.dataModel.link_values[..., :3, 1] > 0, 1.0, 0.2)
 
         self.updateDrawing()
 
@@ -6,6 +6,7 @@ from OpenGL.GL import *
 from Torus3dModule import *
 from boxfish.gl.GLWidget import GLWidget, setupPaintEvent, TextDraw
 from boxfish.gl.glutils import *
+from boxfish.util.LRUCache import LRUCache
 
 class T3V2ModuleScene(GLModuleScene):
     """Module Scene for 3D Torus - 2D View. This adds the axis parameter
@@ -76,7 +77,7 @@ class Torus3dView2d(Torus3dFrame):
         self.agent.module_scene.announceChange()
 
 
-def cylinder(node, shape, axis):
+def cylinders(nodes, shape, axis):
     """This function is for finding the index of the squared cylinder
        containing particular points in the torus.  Cylinders are
        defined for a shape, along a particular axis.
@@ -96,20 +97,15 @@ def cylinder(node, shape, axis):
        cylinder is really not a cylinder but leftover odd links.
 
        A cylinder is computed for a point by by finding distance
-       from nearest edge in each dimension.
+       from nearest edge in each dimension. nodes is an (N, 3) array
+       of points and an array of their N cylinders is returned.
     """
-    dims = shape[:axis] + shape[axis+1:]
-    num_cylinders = (min(dims) + 1) / 2
-    nonaxis = node[:axis] + node[axis+1:]
-    d_near_edge = [min(abs(d - n - 1), n) for n, d in zip(nonaxis, dims)]
-    return num_cylinders - min(d_near_edge) - 1
-
-
-def shift(point, axis, amount):
-    """Increments the <axis> dimension in the point by <amount>"""
-    p = list(point)
-    p[axis] += amount
-    return tuple(p)
+    nonaxis = [d for d in range(3) if d != axis]
+    dims = np.array([shape[d] for d in nonaxis])
+    num_cylinders = (dims.min() + 1) // 2
+    points = nodes[:, nonaxis]
+    d_near_edge = np.minimum(np.abs(dims - points - 1), points)
+    return num_cylinders - d_near_edge.min(axis = 1) - 1
 
 
 class GLTorus2dView(Torus3dGLWidget):
@@ -127,6 +123,11 @@ class GLTorus2dView(Torus3dGLWidget):
         self.gap = 2            # Spacing between successive cylinders
         self.pack_factor = 3.5  # How close to pack boxes (1.5 is .5 box space)
 
+        # Node positions and visible links per shape, axis and gap. The
+        # minimaps use the same layouts with the axis flattened.
+        self.layouts = LRUCache(8)
+        self.geometry_key = None
+
         # selection interface
         self.right_drag = False
 
@@ -254,6 +255,12 @@ class GLTorus2dView(Torus3dGLWidget):
 
             self.translation = [0, 0, -max(distx, disty)]
 
+        # Nodes only move when the layout does
+        geometry_key = (self.shape, self.axis, self.gap)
+        if geometry_key != self.geometry_key:
+            self.geometry_key = geometry_key
+            self.cubeList.updateGeometry()
+
         self.miniMapList.update()
         self.updateDrawing()
 
@@ -270,64 +277,126 @@ class GLTorus2dView(Torus3dGLWidget):
             super(GLTorus2dView, self).paintEvent(event)
 
 
-    def centerView(self, shape, axis, gap, scale = 1):
+    def centerOffset(self, shape, axis, gap, scale = 1):
+        """Translation that centers the layout of the given shape."""
         half_spans = np.array(self.spans(shape, axis, gap), np.float) / -2
         half_spans[axis] = 0
         if scale != 1:
             half_spans = self.mapxy(axis, half_spans)
         half_spans *= self.axis_directions
         half_spans *= scale
-        glTranslatef(*half_spans)
+        return half_spans
+
+    def centerView(self, shape, axis, gap, scale = 1):
+        glTranslatef(*self.centerOffset(shape, axis, gap, scale))
 
 
-    def map2d(self, node, shape, axis, gap, scale = 1):
+    def map2d(self, nodes, shape, axis, gap, scale = 1):
+        """Positions in the 2D view of the given (N, 3) array of nodes."""
         b = self.box_size * self.pack_factor   # box plus spacing
         h = (shape[axis] * b) + gap  # grid spacing
 
-        def coord(n, d):
+        nodes2d = np.zeros((len(nodes), 3))
+        for d in range(3):
+            if d == axis:
+                continue
+            n = nodes[:, d]
             center = float(shape[d] - 1) / 2
-            inset = node[axis] * b * np.sign(center - n)
+            inset = nodes[:, axis] * b * np.sign(center - n)
             even = (shape[d] % 2 == 0)
-            return h * (n + int(even and n > center)) + inset
-
-        dim = range(3)
-        dim.remove(axis)
-
-        node2d = np.zeros(3)
-        for d in dim:
-            node2d[d] = scale * coord(node[d], d)
-        node2d *= self.axis_directions
+            nodes2d[:, d] = scale * (h * (n + (even & (n > center))) + inset)
+        nodes2d *= self.axis_directions
         if scale != 1:
-            node2d = self.mapxy(axis, node2d)
-        return node2d
+            nodes2d = self.mapxy(axis, nodes2d)
+        return nodes2d
 
 
     def mapxy(self, axis, vec):
-        """Map from axis 2d into xy 2d."""
+        """Map from axis 2d into xy 2d. Works on a vector or on an array
+           of vectors in its last dimension.
+        """
         w, h = self.axis_map[axis]
-        return np.array([vec[w], vec[h], 0.])
-
+        vec = np.asarray(vec)
+        mapped = np.zeros(vec.shape)
+        mapped[..., 0] = vec[..., w]
+        mapped[..., 1] = vec[..., h]
+        return mapped
 
 
-    def drawCubes(self):
-        glPushMatrix()
-        self.centerView(self.shape, self.axis, self.gap)
+    def layout(self, shape, axis, gap):
+        """Returns the layout of a torus of the given shape looking down
+           axis, computing it if it is not cached. The layout is a tuple of:
 
-        for x, y, z in np.ndindex(*self.shape):
-            glPushMatrix()
+           positions
+               (nodes, 3) array of the uncentered node positions, in the
+               order of np.ndindex over the shape.
 
-            # center around the mapped noded
-            node = self.map2d((x, y, z), self.shape, self.axis, self.gap)
-            glTranslatef(*node)
+           link_index
+               Array of the visible links as indices into the link colors
+               reshaped to (-1, 4), i.e. node index * 3 + dimension.
 
-            # Draw cube with node color from the model
-            glColor4f(*self.node_colors[x,y,z])
-            notGlutSolidCube(self.box_size)
-
-            glPopMatrix()
-
-        # Get rid of the grid_span translation
-        glPopMatrix()
+           vertices
+               (2 * links, 3) array of the start and end positions of the
+               visible links, in the order of link_index.
+        """
+        key = (tuple(shape), axis, gap, self.box_size, self.pack_factor)
+        if key not in self.layouts:
+            self.layouts[key] = self.computeLayout(shape, axis, gap)
+        return self.layouts[key]
+
+    def computeLayout(self, shape, axis, gap):
+        """Computes the layout returned by layout()."""
+        nodes = np.indices(shape).reshape(3, int(np.prod(shape))).T
+        positions = self.map2d(nodes, shape, axis, gap)
+        start_cyl = cylinders(nodes, shape, axis)
+
+        link_index = list()
+        vertices = list()
+        for dim in range(3):
+            step = np.zeros(3, int)
+            step[dim] = 1
+            end_nodes = nodes + step
+
+            # Skip torus wraparound links
+            visible = end_nodes[:, dim] < shape[dim]
+
+            # Only render lines that connect points within the same cylinder
+            end_cyl = cylinders(end_nodes, shape, axis)
+            visible &= start_cyl == end_cyl
+
+            # Prevents occluding links on the innermost cylinder by not
+            # rendering links that would make T-junctions
+            transverse = [t for t in range(3) if t != axis and t != dim][0]
+            step = np.zeros(3, int)
+            step[transverse] = 1
+            left_cyl = cylinders(nodes - step, shape, axis)
+            right_cyl = cylinders(nodes + step, shape, axis)
+            visible &= ~((start_cyl == 0) & (end_cyl == left_cyl)
+                & (end_cyl == right_cyl))
+
+            index = np.nonzero(visible)[0]
+            link_index.append(index * 3 + dim)
+            ends = self.map2d(end_nodes[index], shape, axis, gap)
+            vertices.append(np.hstack((positions[index], ends)))
+
+        link_index = np.concatenate(link_index)
+        vertices = np.concatenate(vertices).reshape(-1, 3)
+        return positions, link_index, vertices
+
+
+    def createCubeList(self):
+        """Nodes keep their geometry between color updates."""
+        return ColoredGeometry(GL_QUADS, self.cubeGeometry,
+            lambda : self.node_colors)
+
+    def cubeGeometry(self):
+        """Vertices and normals for a cube at every node."""
+        positions = self.layout(self.shape, self.axis, self.gap)[0] \
+            + self.centerOffset(self.shape, self.axis, self.gap)
+        vertices = positions[:, np.newaxis, :] \
+            + self.box_size * cube_vertices[np.newaxis, :, :]
+        normals = np.tile(cube_normals, (len(positions), 1, 1))
+        return vertices, normals
 
 
     def drawLinkCylinder(self, start, end):
@@ -341,56 +410,31 @@ class GLTorus2dView(Torus3dGLWidget):
         glePolyCylinder(cyl_points, None, self.link_width / 2.0)
 
 
-    def drawLinkQuad(self, start, end):
-        """Surprise! Actually draws a line."""
-        glBegin(GL_LINES)
-        glVertex3fv(start)
-        glVertex3fv(end)
-        glEnd()
-
-
     def drawLinks(self):
         self.layoutLinks(self.shape, self.axis, self.gap, self.link_colors)
 
     def layoutLinks(self, shape, axis, gap, link_colors, scale = 1):
+        """Draws the visible links of the layout as lines with a single
+           vertex and color array.
+        """
+        positions, link_index, vertices = self.layout(shape, axis, gap)
+        if len(link_index) == 0:
+            return
+        if scale != 1:
+            vertices = self.mapxy(axis, scale * vertices)
+
+        colors = np.asarray(link_colors, dtype = np.float32).reshape(-1, 4)
+        colors = np.repeat(colors[link_index], 2, axis = 0)
+
         glMaterialfv(GL_FRONT_AND_BACK,GL_DIFFUSE,[1.0, 1.0, 1.0, 1.0])
         glPushMatrix()
         self.centerView(shape, axis, gap, scale)
 
-        for start_node in np.ndindex(*shape):
-            colors = link_colors[start_node]
-
-            start_cyl = cylinder(start_node, shape, axis)
-            start = np.array(self.map2d(start_node, shape, axis, gap, scale))
-
-            # iterate over dimensions.
-            for dim in range(3):
-                end_node = shift(start_node, dim, 1)
-
-                # Skip torus wraparound links
-                if end_node[dim] >= shape[dim]:
-                    continue
-
-                # Only render lines that connect points within the same cylinder
-                end_cyl = cylinder(end_node, shape, axis)
-                if start_cyl == end_cyl:
-                    # Prevents occluding links on the innermost cylinder by not
-                    # rendering links that would make T-junctions
-                    if start_cyl == 0:
-                        # find transverse dimension
-                        for t in range(3):
-                            if t != axis and t != dim: break
-                        left_cyl = cylinder(shift(start_node, t, -1), shape,
-                            axis)
-                        right_cyl = cylinder(shift(start_node, t, 1), shape,
-                            axis)
-                        if end_cyl == right_cyl and end_cyl == left_cyl:
-                            continue
-
-                    end = np.array(self.map2d(end_node, shape, axis, gap,
-                        scale))
-                    glColor4f(*colors[dim])
-                    self.drawLinkQuad(start, end)
+        with clientStates(GL_VERTEX_ARRAY, GL_COLOR_ARRAY):
+            glVertexPointer(3, GL_FLOAT, 0,
+                np.ascontiguousarray(vertices, dtype = np.float32))
+            glColorPointer(4, GL_FLOAT, 0, np.ascontiguousarray(colors))
+            glDrawArrays(GL_LINES, 0, len(vertices))
 
         glPopMatrix()
 
@@ -426,31 +470,26 @@ class GLTorus2dView(Torus3dGLWidget):
         return -1
 
     def updateMiniMapValues(self):
-        """Determines link colors for the minimaps by averaging."""
+        """Determines link colors for the minimaps by averaging the link
+           values along each axis. Links are colored if they have data all
+           along the axis.
+        """
         self.miniColors = list()
+        link_values = self.dataModel.link_values[..., :3, :]
         for axis in range(3):
-            shape = self.shape[:]
+            shape = list(self.shape)
             if shape[axis] != 0:
-                shape = list(shape)
                 shape[axis] = 1
-                shape = tuple(shape)
-            link_colors = np.tile(self.default_link_color, list(shape) + [3,1])
-            for node in np.ndindex(*shape):
-                for dim in range(3):
-                    val = 0.0
-                    count = 0
-                    subNode = list(node)
-                    for i in range(self.shape[axis]):
-                        subNode[axis] = i
-                        val += self.dataModel.link_values[
-                            tuple(subNode)][dim][0]
-                        count += self.dataModel.link_values[
-                            tuple(subNode)][dim][1]
-                    link_colors[node][dim] = self.map_link_color(
-                        val / float(self.shape[axis]), 1.0) \
-                        if count / float(self.shape[axis]) \
-                        >= 1 else self.default_link_color
-            self.miniColors.append(link_colors.copy())
+            link_colors = np.tile(self.default_link_color, shape + [3, 1])
+
+            if self.shape[axis] != 0:
+                mean_values = np.expand_dims(link_values.mean(axis = axis),
+                    axis)
+                colored = mean_values[..., 1] >= 1
+                if colored.any():
+                    link_colors[colored] = self.map_link_colors(
+                        mean_values[..., 0][colored], 1.0)
+            self.miniColors.append(link_colors)
 
 
     def miniMapSizes(self):
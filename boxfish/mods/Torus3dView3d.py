@@ -1,10 +1,9 @@
 import numpy as np
-import operator
 
 from OpenGL.GL import *
 from OpenGL.GLU import *
 
-from boxfish.gl.GLWidget import GLWidget, set_perspective, setupPaintEvent
+from boxfish.gl.GLWidget import GLWidget, setupPaintEvent
 from boxfish.gl.glutils import *
 
 from Torus3dModule import *
@@ -90,6 +89,12 @@ class GLTorus3dView(Torus3dGLWidget):
         self.seam = [0, 0, 0]  # Offsets for seam of the torus
         self.link_radius = self.box_size * .1   # Radius of link cylinders
         self.draw_links = True
+        self.geometry_shape = self.dataModel.shape
+
+        # Rubber band selection, in window coordinates
+        self.band_start = None
+        self.band_end = None
+        self.band_threshold = 4 # Pixels of drag before we box select
 
         # Display list and settings for the axis
         self.axisLength = 0.3
@@ -114,10 +119,30 @@ class GLTorus3dView(Torus3dGLWidget):
 
     def setNodeSize(self, node_size):
         self.box_size = node_size
-        self.cubeList.update()
+        self.cubeList.updateGeometry()
         #self.updateGL()
         self.paintEvent(None)
 
+    def createCubeList(self):
+        """Nodes keep their geometry between color updates."""
+        return ColoredGeometry(GL_QUADS, self.cubeGeometry,
+            lambda : self.node_colors)
+
+    def createLinkList(self):
+        """Links keep their geometry between color updates."""
+        return ColoredGeometry(GL_QUADS, self.linkGeometry,
+            lambda : self.link_colors)
+
+    def update(self):
+        """Rebuild geometry only if the shape of the torus changed, then
+           update the colors.
+        """
+        if self.geometry_shape != self.dataModel.shape:
+            self.geometry_shape = self.dataModel.shape
+            self.cubeList.updateGeometry()
+            self.linkList.updateGeometry()
+        super(GLTorus3dView, self).update()
+
     def paintEvent(self, event):
         with setupPaintEvent(self):
             glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
@@ -125,9 +150,11 @@ class GLTorus3dView(Torus3dGLWidget):
             self.orient_scene()
             self.cubeList()
             if self.draw_links:
+                glMaterialfv(GL_FRONT_AND_BACK,GL_DIFFUSE,[1.0, 1.0, 1.0, 1.0])
                 self.linkList()
             self.doAxis()
             self.doLegend()
+            self.drawBand()
 
         super(GLTorus3dView, self).paintGL()
 
@@ -154,44 +181,41 @@ class GLTorus3dView(Torus3dGLWidget):
         node *= self.axis_directions
         glTranslatef(*node)
 
-    def drawCubes(self):
-        glPushMatrix()
-        self.centerView()
-
-        for node in np.ndindex(*self.dataModel.shape):
-            # draw a dataed cube with its center at (0,0,0)
-            glPushMatrix()
-            self.centerNode(node)
-            glColor4f(*self.node_colors[node])
-            notGlutSolidCube(self.box_size)
-            glPopMatrix()
-
-        # Get rid of the grid_span translation
-        glPopMatrix()
-
-
-    def drawLinks(self):
-        glMaterialfv(GL_FRONT_AND_BACK,GL_DIFFUSE,[1.0, 1.0, 1.0, 1.0])
-        glPushMatrix()
-        self.centerView()
-
-        # origin-relative poly cylinder points for each dimension
-        poly_cylinders =[[(-1, 0, 0), (0, 0,  0), (1, 0, 0), (2, 0, 0)],
-                         [(0, -2, 0), (0, -1, 0), (0, 0, 0), (0, 1, 0)],
-                         [(0, 0, -2), (0, 0, -1), (0, 0, 0), (0, 0, 1)]]
-
-        for node in np.ndindex(*self.dataModel.shape):
-            glPushMatrix()
-            self.centerNode(node)
-            colors = self.link_colors[node]
-
-            # Draw links for each dim as poly cylinders
-            for dim in range(3):
-                glColor4f(*colors[dim])
-                notGlePolyCylinder(poly_cylinders[dim], None, self.link_radius)
-
-            glPopMatrix()
-        glPopMatrix()
+    def nodePositions(self):
+        """Returns the centered position of every node, in the same order
+           as np.ndindex over the shape of the torus.
+        """
+        shape = np.array(self.dataModel.shape)
+        nodes = np.indices(shape).reshape(3, -1).T
+        return ((nodes + self.seam) % shape) * self.axis_directions \
+            + (shape - 1) / -2.0 * self.axis_directions
+
+    def cubeGeometry(self):
+        """Vertices and normals for a cube at every node."""
+        positions = self.nodePositions()
+        vertices = positions[:, np.newaxis, :] \
+            + self.box_size * cube_vertices[np.newaxis, :, :]
+        normals = np.tile(cube_normals, (len(positions), 1, 1))
+        return vertices, normals
+
+    def linkGeometry(self):
+        """Vertices and normals for a cylinder along each dimension from
+           every node, ordered like link_colors.
+        """
+        # origin-relative cylinder extents for each dimension
+        extents = [(0, 1), (-1, 0), (-1, 0)]
+        cylinders = [cylinderArrays(dim, start, end, self.link_radius)
+            for dim, (start, end) in enumerate(extents)]
+        templates = np.array([vertices for vertices, normals in cylinders])
+        template_normals = np.array([normals for vertices, normals
+            in cylinders])
+
+        positions = self.nodePositions()
+        vertices = positions[:, np.newaxis, np.newaxis, :] \
+            + templates[np.newaxis]
+        normals = np.tile(template_normals, (len(positions), 1, 1, 1))
+        return vertices.reshape(-1, templates.shape[1], 3), \
+            normals.reshape(-1, templates.shape[1], 3)
 
     def drawAxis(self):
         """This function does the actual drawing of the lines in the axis."""
@@ -225,100 +249,150 @@ class GLTorus3dView(Torus3dGLWidget):
         glViewport(0, 0, self.width(), self.height())
 
     def mousePressEvent(self, event):
-        """We capture right clicking for picking here."""
+        """We capture right clicking for picking here. Dragging with the
+           right button down draws a box for selecting many nodes.
+        """
         super(GLTorus3dView, self).mousePressEvent(event)
 
         if event.button() == Qt.RightButton:
-            self.parent.agent.selectionChanged([["nodes", self.doPick(event)]])
+            self.dragging = False # Don't rotate while selecting
+            self.band_start = (event.x(), event.y())
+            self.band_end = self.band_start
+
+    def mouseMoveEvent(self, event):
+        if self.band_start is None:
+            super(GLTorus3dView, self).mouseMoveEvent(event)
+            return
+
+        self.band_end = (event.x(), event.y())
+        self.paintEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        super(GLTorus3dView, self).mouseReleaseEvent(event)
+
+        if event.button() == Qt.RightButton and self.band_start is not None:
+            band = self.band_start + (event.x(), event.y())
+            self.band_start = self.band_end = None
+
+            if abs(band[2] - band[0]) < self.band_threshold \
+                and abs(band[3] - band[1]) < self.band_threshold:
+                selection = self.doPick(event)
+            else:
+                selection = self.doBoxPick(*band)
+                self.paintEvent(event)
+            self.parent.agent.selectionChanged([["nodes", selection]])
+
+    def drawBand(self):
+        """Draws the selection box while the user is dragging it."""
+        if self.band_start is None:
+            return
+
+        x0, x1 = sorted([self.band_start[0], self.band_end[0]])
+        y0, y1 = sorted([self.height() - self.band_start[1],
+            self.height() - self.band_end[1]])
+        with overlays2D(self.width(), self.height(), self.bg_color):
+            setup_overlay2D(0, 0, self.width(), self.height())
+            with disabled(GL_DEPTH_TEST):
+                glLineWidth(1.0)
+                glColor4f(0.3, 0.3, 0.3, 1.0)
+                with glSection(GL_LINE_LOOP):
+                    glVertex2f(x0, y0)
+                    glVertex2f(x1, y0)
+                    glVertex2f(x1, y1)
+                    glVertex2f(x0, y1)
+
+    def toGrid(self, point, direction):
+        """Takes a ray in scene coordinates to grid coordinates, where the
+           node drawn at display position (i, j, k) is centered at (i, j, k).
+        """
+        shape = np.array(self.dataModel.shape, float)
+        offset = (shape - 1) / -2 * self.axis_directions
+        return (point - offset) * self.axis_directions, \
+            direction * self.axis_directions
 
     def doPick(self, event):
-        """Allow the user to pick nodes."""
-        # Adapted from Josh Levine's version in Boxfish 0.1
-        #steps:
-        #render the scene with labeled nodes
-        #find the color of the pixel @self.x, self.y
-        #map color back to id and return
-
-        #disable unneded
-        glDisable(GL_LIGHTING)
-        glDisable(GL_LIGHT0)
-        glDisable(GL_BLEND)
-
-        #set up the selection buffer
-        select_buf_size = reduce(operator.mul, self.dataModel.shape) + 10
-        glSelectBuffer(select_buf_size)
-
-        #switch to select mode
-        glRenderMode(GL_SELECT)
-
-        #initialize name stack
-        glInitNames()
-        glPushName(0)
-
-        #set up the pick matrix to draw a narrow view
-        viewport = glGetIntegerv(GL_VIEWPORT)
-        glMatrixMode(GL_PROJECTION)
-        glPushMatrix()
-        glLoadIdentity()
-        #this sets the size and location of the pick window
-        #changing the 1,1 will change sensitivity of the pick
-        gluPickMatrix(event.x(),(viewport[3]-event.y()),
-            1,1,viewport)
-        set_perspective(self.fov, self.width()/float(self.height()),
-            self.near_plane, self.far_plane)
-        #switch back to modelview and draw the scene
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
-        glTranslatef(*self.translation[:3])
-        glMultMatrixd(self.rotation)
-
-        #let's draw some red boxes, color is inconsequential
-        box_size = self.box_size
-        glColor3f(1.0, 0.0, 0.0)
-
-        # Redo the drawing
-        glPushMatrix()
-        self.centerView()
+        """Allow the user to pick nodes. Returns a list with the id of the
+           nearest node under the mouse, or an empty list.
 
-        # And draw all the cubes
-        # color index variable
-        for node in np.ndindex(*self.dataModel.shape):
-            glLoadName(self.dataModel.coord_to_node[node])
-            glPushMatrix()
-            self.centerNode(node)
-            notGlutSolidCube(box_size)
-            glPopMatrix()
+           Rather than rendering in GL_SELECT mode, the mouse ray is
+           unprojected and walked through the node grid one cell at a time
+           (a 3D DDA), so only the cells along the ray are tested.
+        """
+        origin, direction = self.unproject_ray(event.x(), event.y())
+        cell = self.pickRay(*self.toGrid(origin, direction))
+        if cell is None:
+            return []
 
-        glPopMatrix()
+        node = (cell - self.seam) % self.dataModel.shape
+        return [self.dataModel.coord_to_node[tuple(node)]]
 
-        #pop projection matrix
-        glMatrixMode(GL_PROJECTION)
-        glPopMatrix()
-        glFlush()
-
-        #get the hit buffer
-        glMatrixMode(GL_MODELVIEW)
-        pick_buffer = glRenderMode(GL_RENDER)
-
-        #this code finds the nearest hit.  
-        #Otherwise, populate hitlist with hit[2] for all
-        #pick_buffer has a 3-tuple of info, [near, far, name]
-        nearest = 4294967295
-        hitlist = []
-        for hit in pick_buffer :
-            if hit[0] < nearest :
-              nearest = hit[0]
-              hitlist = [hit[2][0]]
-
-        #go back to normal rendering
-        glEnable(GL_LIGHTING)
-        glEnable(GL_LIGHT0)
-        glPolygonMode(GL_FRONT_AND_BACK,GL_FILL)
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+    def pickRay(self, origin, direction):
+        """Returns the display position of the first node cube hit by the
+           ray, in grid coordinates, or None.
+        """
+        shape = np.array(self.dataModel.shape)
+        direction = np.where(np.abs(direction) < 1e-12, 1e-12, direction)
+        half = self.box_size / 2.0
+        if half <= 0:
+            return None
+
+        # Clip the ray to the box holding all the cells
+        span = ray_box(origin, direction, -0.5 * np.ones(3), shape - 0.5)
+        if span is None:
+            return None
+        t_enter, t_exit = max(span[0], 0.0), span[1]
+
+        # Cells are unit cubes centered on the node positions
+        point = origin + direction * t_enter
+        cell = np.clip(np.floor(point + 0.5), 0, shape - 1).astype(int)
+        step = np.where(direction > 0, 1, -1)
+        t_next = (cell + 0.5 * step - origin) / direction
+        t_delta = np.abs(1.0 / direction)
+
+        while np.all(cell >= 0) and np.all(cell < shape):
+            # Cubes lie inside their cells, so the first hit is the nearest
+            hit = ray_box(origin, direction, cell - half, cell + half)
+            if hit is not None and hit[1] >= 0:
+                return cell
+
+            axis = np.argmin(t_next)
+            if t_next[axis] > t_exit:
+                break
+            cell[axis] += step[axis]
+            t_next[axis] += t_delta[axis]
+
+        return None
+
+    def doBoxPick(self, x0, y0, x1, y1):
+        """Returns the ids of all nodes whose centers fall in the window
+           rectangle with the given corners.
+        """
+        x0, x1 = sorted([x0, x1])
+        y0, y1 = sorted([y0, y1])
 
-        print hitlist
-        return hitlist
+        shape = np.array(self.dataModel.shape)
+        nodes = np.indices(shape).reshape(3, -1).T
+        window, visible = self.project_points(self.nodePositions())
+        inside = visible \
+            & (window[:, 0] >= x0) & (window[:, 0] <= x1) \
+            & (window[:, 1] >= y0) & (window[:, 1] <= y1)
+
+        return [self.dataModel.coord_to_node[tuple(node)]
+            for node in nodes[inside]]
+
+
+def ray_box(origin, direction, low, high):
+    """Slab test of the ray origin + t * direction against the axis aligned
+       box [low, high]. Returns the (enter, exit) values of t, or None if
+       the ray misses. The direction must not have zero components.
+    """
+    t_low = (low - origin) / direction
+    t_high = (high - origin) / direction
+    t_enter = np.max(np.minimum(t_low, t_high))
+    t_exit = np.min(np.maximum(t_low, t_high))
+    if t_enter > t_exit:
+        return None
+    return t_enter, t_exit
 
 class Torus3dView3dRenderTab(QWidget):
 
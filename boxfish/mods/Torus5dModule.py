@@ -27,13 +27,13 @@ from PySide.QtCore import *
 
 from GLModule import *
 from boxfish.gl.GLWidget import GLWidget, set_perspective, \
-    boxfish_glut_initialized, TextDraw, setupPaintEvent
+    boxfish_glut_initialized, TextDraw, setupPaintEvent, drawGLColorBar
 from boxfish.gl.glutils import *
 from OpenGL.GLUT import glutInit
 
 
 import TorusIcons
-from boxfish.ColorMaps import ColorMap, ColorMapWidget, drawGLColorBar
+from boxfish.ColorMaps import ColorMap, ColorMapWidget
 
 class Torus5dFrameDataModel(object):
     """This class is designed to hold data for a view of a 5d Torus.
@@ -622,11 +622,10 @@ class Torus5dGLWidget(GLWidget):
     def updateCubeColors(self):
         """Updates the node colors from the dataModel."""
         self.clearNodes()
-        for node in np.ndindex(*self.dataModel.shape):
-            self.node_colors[node] = self.map_node_color(
-                self.dataModel.node_values[node][0]) \
-                if (self.dataModel.node_values[node][1] \
-                > sys.float_info.epsilon) else self.default_node_color
+        valid = self.dataModel.node_values[..., 1] > sys.float_info.epsilon
+        if valid.any():
+            self.node_colors[valid] = self.map_node_colors(
+                self.dataModel.node_values[..., 0][valid])
         #print 'UPDATING CUBE COLORS:  self.node_colors.shape = ' + str(self.node_colors.shape)
         #self.updateView(nodes = True, links = False)
         #TODO #self.nodeColorChangeSignal.emit()
@@ -634,13 +633,11 @@ class Torus5dGLWidget(GLWidget):
     def updateLinkColors(self):
         """Updates the link colors from the dataModel."""
         self.clearLinks()
-        for node in np.ndindex(*self.dataModel.shape):
-            for dim in range(5):
-                #print 'avg_link_values = ' + str(self.dataModel.avg_link_values[node][dim][0]) + ', link_range = ' + str(link_range)
-                self.link_colors[node][dim] = self.map_link_color(
-                    self.dataModel.link_values[node][dim][0]) \
-                    if (self.dataModel.link_values[node][dim][1] \
-                    > sys.float_info.epsilon) else self.default_link_color
+        link_values = self.dataModel.link_values[..., :5, :]
+        valid = link_values[..., 1] > sys.float_info.epsilon
+        if valid.any():
+            self.link_colors[valid] = self.map_link_colors(
+                link_values[..., 0][valid])
         #self.updateView(nodes = False, links = True)
         #TODO #self.linkColorChangeSignal.emit()
 
@@ -707,6 +704,37 @@ class Torus5dGLWidget(GLWidget):
         else:
             return self.link_cmap.getColor(val, preempt_range)
 
+    def getMiniMapLinkValues(self, axis, w, h, d):
+        """Returns the link values and counts for the minimap looking down
+           axis with w, h across and d as the 4th dimension. Both arrays are
+           indexed [d, e, w, h, dim, axis] where dim is the position of the
+           link dimension in [w, h, axis].
+        """
+        e = [i for i in range(5) if i not in (w, h, axis, d)][0]
+        links = self.dataModel.link_values[..., [w, h, axis], :]
+        links = np.transpose(links, (d, e, w, h, 5, axis, 6))
+        return links[..., 0], links[..., 1]
+
+    def map_node_colors(self, vals, preempt_range = 0):
+        """Turns an array of color values in [0,1] into an array of RGBA
+           colors. Used to map nodes.
+        """
+        vals = np.asarray(vals, dtype=float)
+        colors = self.node_cmap.getColors(vals, preempt_range)
+        colors[(vals < self.lowerBoundNodes-1e-8)
+            | (vals > self.upperBoundNodes+1e-8), 3] = self.outOfRangeOpacity
+        return colors
+
+    def map_link_colors(self, vals, preempt_range = 0):
+        """Turns an array of color values in [0,1] into an array of RGBA
+           colors. Used to map links.
+        """
+        vals = np.asarray(vals, dtype=float)
+        colors = self.link_cmap.getColors(vals, preempt_range)
+        colors[(vals < self.lowerBoundLinks-1e-8)
+            | (vals > self.upperBoundLinks+1e-8), 3] = self.outOfRangeOpacity
+        return colors
+
     def set_all_alphas(self, alpha):
         """Set all nodes and links to the same given alpha value."""
         self.node_colors[:,:,:,:,:,3] = alpha
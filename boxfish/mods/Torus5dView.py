@@ -126,9 +126,9 @@ class Torus5dViewFrame(Torus5dFrame):
         self.glview.slice4d.updateDrawing()
         self.glview.overview.updateDrawing()
         self.glview.slice3d.updateDrawing()
-        # for the minimaps, need to update the data each time view planes change
-        #   since the minimap shows averages of only the selected planes
-        self.glview.minimaps.update()
+        # for the minimaps, need to update the averages each time view planes
+        #   change since the minimap shows averages of only the selected planes
+        self.glview.minimaps.updateViewPlanes()
 
     @Slot(int, int)
     def checkAxisChanged(self, axis, axis_index):
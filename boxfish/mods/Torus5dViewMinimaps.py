@@ -30,6 +30,7 @@ class Torus5dViewMinimaps(Torus5dGLWidget):
         self.show_axis = {0: [0, 1, 2], 1: [0, 1, 2], 2: [0, 1, 2], 3: [0, 1, 2], 4: []}
         self.showTotalVariance = True
         self.valuesInitialized = False
+        self.valuesSource = None # see miniMapValuesSource
         self.reverseDrag = True
         self.left_drag = False
         self.left_press = False
@@ -245,6 +246,11 @@ class Torus5dViewMinimaps(Torus5dGLWidget):
 
         Currently averaging 'd' and 'e' dimensions just like the axis we're looking
          down. Also only works for 5D torus since assumes len(non_slice_indicies) = 2.
+
+        Each minimap is computed with array reductions over a transposed view
+        of the link values, indexed [d, e, w, h, dim, axis]. The sums along
+        the axis are kept for every d/e plane so that changing the view
+        planes only needs updateViewPlaneValues().
         """
 
         self.miniColors = list()
@@ -260,158 +266,182 @@ class Torus5dViewMinimaps(Torus5dGLWidget):
         self.planeStdDevLinkValue = list()
         self.planeLinkSpread = list()
         self.planeMeanLinkValue = list()
-        self.globalMinLinkValue = sys.maxint
-        self.globalMaxLinkValue = -sys.maxint-1
-        min_variance = min_plane_variance = sys.maxint
-        max_variance = max_plane_variance = -sys.maxint - 1
-
-        plane_tot_index = 0 # REMOVE AFTER DEBUGGING
-        plane_avg_index = 0
+        min_plane_variance = sys.maxint
+        max_plane_variance = -sys.maxint - 1
+
+        # Per plane partial sums along the axis, indexed [d, e, w, h, dim],
+        # one entry per minimap. See updateViewPlaneValues.
+        self.miniPlaneDim = list()
+        self.miniAxisSpan = list()
+        self.miniPlaneSum = list()
+        self.miniPlaneSquareSum = list()
+        self.miniPlaneCount = list()
+        self.miniPlaneLinkVariance = list()
+        self.miniPlaneMask = list()
+
+        # Every link along the first four dimensions goes into some minimap
+        all_values = self.dataModel.link_values[..., :4, 0]
+        self.globalMinLinkValue = min(sys.maxint, all_values.min())
+        self.globalMaxLinkValue = max(-sys.maxint-1, all_values.max())
 
         for axis in range(4):
-            aindex = 0
             for w, h, d in self.axis_map[axis]:
-                shape = self.shape[:]
-                slice_shape = [shape[w], shape[h], shape[axis]]
-                slice_indicies = [w, h, axis]
-                non_slice_indicies = [i for i in range(len(shape)) if i not in slice_indicies] # length 2
-                #d_values = [i for i in range(self.shape[d])]
-                d_values = [0]
-                mini_shape = list()
-                if shape[axis] != 0:
-                    shape = list(shape)
-                    # only shape[w] and shape[h] remain in mini_shape; the rest become 1
-                    mini_shape = [shape[i] if i in slice_indicies[:2] else 1 for i in range(len(shape))]
-                    mini_shape = tuple(mini_shape)
-                link_colors = np.tile(self.default_link_color, 
-                  [shape[w], shape[h], 1] + [3,1]) #uses slice dims
-                #store link variance by slice
-                link_variance = np.tile(0., [shape[w], shape[h], 1] + [3]) 
-                plane_link_variance = np.tile(0., [shape[d], shape[4], shape[w], shape[h], 1, 3])
-                # average the link bundles leaving every node in the slice, storing by 4th/5th dimension
-                plane_link_values = np.tile([0. for i in range(self.shape[axis])],
-                  [shape[d], shape[4]] + [shape[w], shape[h], 1] +  [3, 1])
-                #print 'plane_link_values.shape = ' + str(plane_link_values.shape)
-                #print '\nMAX PLANE_TOT_INDEX = ' + str(3*np.product(slice_shape)-1) \
-                #  + ', MAX PLANE_AVG_INDEX = ' + str(3*self.shape[axis]-1)
-                plane_total_variance = np.tile(0., [shape[d], shape[4]])
-                plane_link_spread = np.tile([sys.float_info.max, sys.float_info.min], [shape[d], shape[4], 1])
-                plane_mean_value = np.tile(0., [shape[d], shape[4]])
-                plane_avg_variance = np.tile(0., [shape[d], shape[4]])
-                plane_max_variance = np.tile(0., [shape[d], shape[4]])
-                #print '\tplane_tot_index = ' + str(plane_tot_index)
-                plane_tot_index = 0 # resets for each new 4th and 5th dimension plane
-                for node in np.ndindex(*mini_shape): # 5D node, but non-slice dims (plus axis) are 1
-                    dim_count = 0
-                    #print '\tplane_avg_index = ' + str(plane_avg_index)
-                    for dim in slice_indicies:
-                        val = 0.0
-                        count = 0
-                        subNode = list(node)
-                        link_values = list()
-
-                        val_added_count = 0
-                        for i in range(self.shape[axis]):
-                            for j in range(self.shape[d]):
-                                higher_dims = [t for t in non_slice_indicies if t != d] # == [4] for 5 dim
-                                for k in range(self.shape[higher_dims[0]]):
-                                    subNode[axis] = i
-                                    subNode[non_slice_indicies[0]] = j
-                                    subNode[non_slice_indicies[1]] = k
-                                    current = self.dataModel.link_values[
-                                            tuple(subNode)][dim][0]
-                                    if current > self.globalMaxLinkValue:
-                                        self.globalMaxLinkValue = current
-                                    elif current < self.globalMinLinkValue:
-                                        self.globalMinLinkValue = current
-
-                                    if current < plane_link_spread[j][k][0]:
-                                        plane_link_spread[j][k][0] = current
-                                    elif current > plane_link_spread[j][k][1]:
-                                        plane_link_spread[j][k][1] = current
-
-                                    # TODO:  Check what happens if this is +=current instead of =current
-                                    plane_link_values[j][k][tuple([node[w], node[h], 0])][dim_count][i] = current
-                                    #print '\ncurrent = ' + str(current) + ', plane_link_value = ' + str(plane_link_values[j][k][tuple([node[w], node[h], 0])][dim_count][i])
-                                    if (j, k) in self.view_planes[d]:
-                                        link_values.append(current)
-                                        #print 'link_value = ' + str(link_values[len(link_values)-1])
-                                        val += current
-                                        val_added_count += 1
-                                        count += self.dataModel.link_values[
-                                            tuple(subNode)][dim][1] # TODO : Ask Kate why this is necessary / when it's used?   
-
-                        if shape[axis] != 0:
-                            if count == 0:
-                                mean = 0
-                                variance = 0
-                            else:
-                                mean = val / count
-                                variance = (np.sum(np.square(link_values))/count) - (mean*mean)
-                                link_variance[(node[w], node[h], 0)][dim_count] = variance
-                                #print '\nlink_variance[node()][dim] = ' + str(link_variance[(node[w], node[h], 0)][dim_count])
-                                #print '\nlink_values[node] = ' + str(link_values)
-                                for j in range(self.shape[d]):
-                                    for k in range(self.shape[higher_dims[0]]):
-                                        #print 'plane_link_values[d][e][node][dim] = ' + str(plane_link_values[j][k][(node[w], node[h], 0)][dim_count])
-                                        mean = np.sum(plane_link_values[j][k][(node[w], node[h], 0)][dim_count]) / self.shape[axis]
-                                        #print '\tmean = ' + str(mean)
-                                        variance_plane = (np.sum(np.square(plane_link_values[j][k][(node[w], node[h], 0)][dim_count]))/(self.shape[axis])) - mean*mean
-                                        plane_link_variance[j][k][(node[w], node[h], 0)][dim_count] = variance_plane
-                                        #print 'plane_link_variance[j][k][node()][dim] = ' + str(plane_link_variance[j][k][(node[w], node[h], 0)][dim_count])
-                                        #if variance_plane > 2*variance or variance_plane < 0.5*variance:
-                                            #print 'wrong, axis = ' + str(axis) + ', axis_index = ' + str(aindex) + ', j = ' + str(j) + ', k = ' + str(k) + ', dim = ' + str(dim) + ', dim_count = ' + str(dim_count)
-                            if variance > max_variance: max_variance = variance
-                            if variance < min_variance: min_variance = variance
-                            #print 'val = ' + str(val) + ', count = ' + str(count) + ', val_added_count = ' + str(val_added_count)
-                            #print '\tcalling map_link_color(' + str(val/float(val_added_count)) +', 1.)'
-                            temp = self.map_link_color(
-                                val / float(val_added_count), 1.0) \
-                                if count / float(self.shape[axis]) \
-                                >= 1 else self.default_link_color
-                            if temp[3] != 1.:
-                                pass
-                                #print 'BAD, link_color = ' + str(temp)
-                            link_colors[(node[w], node[h], 0)][dim_count] = self.map_link_color(
-                                val / float(val_added_count), 1.0) \
-                                if count / float(self.shape[axis]) \
-                                >= 1 else self.default_link_color
-
-                        dim_count += 1
-
-                #print 'self.shape = ' + str(self.shape) + ', plane_link_variance[j][k].shape = ' + str(plane_link_variance[j][k].shape)
-                for j in range(self.shape[d]):
-                    for k in range(self.shape[higher_dims[0]]):
-                        total_count = np.product(slice_shape) * 3
-                        avg_count = shape[w] * shape[h] * 3
-                        # TODO:  Check to see when variance dim is used in drawLinkVariance (print out in place)
-                        #   to make sure we want to include dim = axis in this summation
-                        total_mean = np.sum(plane_link_values[j][k])/total_count
-                        plane_mean_value[j][k] = total_mean
-                        plane_total_variance[j][k] = (np.sum(np.square(plane_link_values[j][k]))/total_count) - (total_mean*total_mean)
-                        plane_avg_variance[j][k] = np.sum(plane_link_variance[j][k])/avg_count
-                        if plane_total_variance[j][k] > max_plane_variance: max_plane_variance = plane_total_variance[j][k]
-                        if plane_total_variance[j][k] < min_plane_variance: min_plane_variance = plane_total_variance[j][k]
-
-                #print 'axis = ' + str(axis) + ', map = ' + str(self.axis_map[axis]) + ', plane_total_variance = ' + str(plane_total_variance) + ', link_variance = ' + str(link_variance)
-
-                #print 'plane_avg_variance[j][k] = ' + str(plane_avg_variance[j][k])
-                
-                self.planeMeanLinkValue.append(plane_mean_value.copy())
-                self.planeLinkSpread.append(plane_link_spread.copy())
-                self.planeAvgVariance.append(plane_avg_variance.copy())
-                self.planeTotalVariance.append(plane_total_variance.copy())
-                #print 'planeAvgVariance[axis][aindex] = ' + str(self.planeAvgVariance[axis][aindex]) 
-                self.miniColors.append(link_colors.copy())
-                self.miniVariance.append(link_variance.copy())
-                aindex += 1
-
-        self.min_variance = min_variance
-        self.max_variance = max_variance
+                shape = self.shape
+                values, counts = self.getMiniMapLinkValues(axis, w, h, d)
+
+                plane_sum = values.sum(axis = 5)
+                plane_square_sum = np.square(values).sum(axis = 5)
+                self.miniPlaneDim.append(d)
+                self.miniAxisSpan.append(float(shape[axis]))
+                self.miniPlaneSum.append(plane_sum)
+                self.miniPlaneSquareSum.append(plane_square_sum)
+                self.miniPlaneCount.append(counts.sum(axis = 5))
+                self.miniPlaneMask.append(None)
+
+                # Variance along the axis, per plane
+                plane_mean = plane_sum / float(shape[axis])
+                self.miniPlaneLinkVariance.append(plane_square_sum
+                    / float(shape[axis]) - np.square(plane_mean))
+
+                # Statistics over each whole d/e plane
+                total_count = values[0, 0].size
+                plane_mean_value = plane_sum.sum(axis = (2, 3, 4)) \
+                    / total_count
+                plane_total_variance = plane_square_sum.sum(
+                    axis = (2, 3, 4)) / total_count \
+                    - np.square(plane_mean_value)
+                if plane_total_variance.size:
+                    min_plane_variance = min(min_plane_variance,
+                        plane_total_variance.min())
+                    max_plane_variance = max(max_plane_variance,
+                        plane_total_variance.max())
+
+                self.planeMeanLinkValue.append(plane_mean_value)
+                self.planeLinkSpread.append(self.getPlaneLinkSpread(values,
+                    w, h))
+                self.planeTotalVariance.append(plane_total_variance)
+
+                # Filled in by updateViewPlaneValues
+                self.planeAvgVariance.append(None)
+                self.miniColors.append(None)
+                self.miniVariance.append(None)
+
         self.min_plane_variance = min_plane_variance
         self.max_plane_variance = max_plane_variance
+        self.updateViewPlaneValues()
         self.valuesInitialized = True
-        #print '**************** UPDATED MINIMAP VALUES ********************'
+        self.valuesSource = self.miniMapValuesSource()
+
+    def miniMapValuesSource(self):
+        '''Returns what the minimap values are computed from: the link data,
+        the link color map and its bounds.  The data model makes new link
+        arrays whenever the link data changes.
+        '''
+        return (self.dataModel.link_values, self.link_cmap,
+            (self.lowerBoundLinks, self.upperBoundLinks))
+
+    def miniMapValuesStale(self):
+        '''Returns True if the link data or its coloring changed since the
+        minimap values were last computed.
+        '''
+        link_values, link_cmap, bounds = self.valuesSource
+        current_values, current_cmap, current_bounds \
+            = self.miniMapValuesSource()
+        return link_values is not current_values \
+            or link_cmap is not current_cmap or bounds != current_bounds
+
+    def updateViewPlaneValues(self):
+        """Updates the parts of the minimaps that depend on the selected
+           view planes: link colors, link variance and the average plane
+           variance. Uses the per plane sums from updateMiniMapValues, so the
+           cost is in the number of selected planes rather than all the link
+           data. Minimaps whose d dimension has the same planes selected as
+           last time are skipped.
+        """
+        for index, d in enumerate(self.miniPlaneDim):
+            in_view = self.getViewPlaneMask(d)
+            if self.miniPlaneMask[index] is not None \
+                and np.array_equal(in_view, self.miniPlaneMask[index]):
+                continue
+            self.miniPlaneMask[index] = in_view
+
+            # Links averaged over the axis and the selected d/e planes
+            axis_span = self.miniAxisSpan[index]
+            val = self.miniPlaneSum[index][in_view].sum(axis = 0)
+            count = self.miniPlaneCount[index][in_view].sum(axis = 0)
+            square = self.miniPlaneSquareSum[index][in_view].sum(axis = 0)
+            val_added_count = axis_span * in_view.sum()
+
+            has_count = count != 0
+            safe_count = np.where(has_count, count, 1.)
+            link_variance = np.where(has_count, square / safe_count
+                - np.square(val / safe_count), 0.)
+
+            link_colors = np.tile(self.default_link_color,
+                list(val.shape) + [1])
+            colored = count / axis_span >= 1
+            if colored.any():
+                link_colors[colored] = self.map_link_colors(
+                    val[colored] / val_added_count, 1.0)
+
+            # Only links with data in the selected planes count towards the
+            # average plane variance
+            avg_count = has_count.size
+            self.planeAvgVariance[index] = np.tensordot(
+                self.miniPlaneLinkVariance[index], has_count, 3) / avg_count
+            self.miniColors[index] = link_colors[:, :, np.newaxis]
+            self.miniVariance[index] = link_variance[:, :, np.newaxis]
+
+        self.min_variance = min([sys.maxint] + [variance.min()
+            for variance in self.miniVariance if variance.size])
+        self.max_variance = max([-sys.maxint - 1] + [variance.max()
+            for variance in self.miniVariance if variance.size])
+
+    def updateViewPlanes(self):
+        """Redraws after the view planes have changed, without recomputing
+           anything that does not depend on them unless the link data or
+           its coloring changed since, in which case everything is.
+        """
+        if not self.valuesInitialized or self.miniMapValuesStale():
+            self.update()
+            return
+        self.updateViewPlaneValues()
+        self.updateDrawing()
+
+    def getViewPlaneMask(self, d):
+        """Boolean array over (d, e) that is True for the selected planes."""
+        mask = np.zeros((self.shape[d], self.shape[4]), dtype = bool)
+        for j, k in self.view_planes[d]:
+            if j < mask.shape[0] and k < mask.shape[1]:
+                mask[j, k] = True
+        return mask
+
+    def getPlaneLinkSpread(self, values, w, h):
+        """Returns the [low, high] spread of link values in each d/e plane.
+
+        This matches the running min/max (with an elif) that the spread has
+        always been computed with: a value only raises the high end when it
+        did not lower the low end at its place in the scan. The scan is in
+        node order, then link dimension, then axis.
+        """
+        if w > h:
+            values = values.swapaxes(2, 3)
+        scan = values.reshape(values.shape[:2] + (-1,))
+        spread = np.empty(values.shape[:2] + (2,))
+        if scan.shape[2] == 0:
+            spread[:] = [sys.float_info.max, sys.float_info.min]
+            return spread
+
+        low_so_far = np.minimum.accumulate(scan, axis = 2)
+        previous_low = np.empty_like(scan)
+        previous_low[..., 0] = sys.float_info.max
+        previous_low[..., 1:] = low_so_far[..., :-1]
+        lowered = scan < previous_low
+
+        spread[..., 0] = np.minimum(sys.float_info.max, low_so_far[..., -1])
+        spread[..., 1] = np.maximum(sys.float_info.min,
+            np.where(lowered, -np.inf, scan).max(axis = 2))
+        return spread
 
 
     # ***************************    Calculate     *****************************
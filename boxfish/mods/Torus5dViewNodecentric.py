@@ -28,7 +28,8 @@ class Torus5dViewNodecentric(Torus5dGLWidget):
         self.systemMaxHops = 3
         self.widgetLists = []
         self.widget2dLists = []
-        self.nodeObjectList=[]
+        self.layoutNodes = []
+        self.layoutChildren = []
         # TODO:  Uncomment this
         self.widgetLists.append(self.layoutList)
         self.widget2dLists.append(self.labelList)
@@ -103,7 +104,7 @@ class Torus5dViewNodecentric(Torus5dGLWidget):
                         self.maxHopOpacity -= self.opacitySteps[self.currentMaxHops]
                         self.updateDrawing()
 
-        super(Torus5dViewNodecentric, self).orient_scene(
+        super(Torus5dViewNodecentric, self).orient_scene()
 
     def resetView(self):
         spans = self.getViewSpan()
@@ -211,9 +212,10 @@ class Torus5dViewNodecentric(Torus5dGLWidget):
         #print 'self.linkRadii = ' + str(self.linkRadii)
         
     def updateLayoutValues(self):
-        '''Stores node and link information in tree-like list structure.  Each
-        node has an index, a path (integer list), XY position, node color, and
-        link colors (for 10 links leaving that node).
+        '''Stores the nodes reached at each hop from the start node and the
+        average link color of every node.  getNodeObject(path) looks up the
+        node at the end of a path (integer list) along with its average link
+        color.
 
         Positions are initialized to (-1, -1) and updated in drawLayout. Resize
         events will call updateLayoutSizes and then updateDrawing, which calls
@@ -249,79 +251,75 @@ class Torus5dViewNodecentric(Torus5dGLWidget):
         # first store the angles for the endpoints of the lines in a circle
         self.circleAngles = np.linspace(0, 2*np.pi, self.circleNumPts)
 
-        # node number, path from start_node, opengl position, avg_link_color
-        emptyNode = [tuple(), tuple(), tuple(), None]
-
-        # nodeObjectList starts off with just the first center node
-        #   explicitly calc the link colors for this node for cleaner code below
-        total_link_val = 0
-        for dim in range(len(self.startNode)):
-            total_link_val += self.dataModel.pos_link_values[tuple(self.startNode)][dim][0]
-            total_link_val += self.dataModel.neg_link_values[tuple(self.startNode)][dim][0]
-        
+        # average link color of every node, looked up while drawing
         # ******** TODO:  Send in the preempt_range, see Torus5dModule.Torus5dGLWidget.updateLinkColors() ********
-        avg_link_color = self.map_link_color(total_link_val/(2*len(self.startNode)), 1.0)
-        nodeObjectList = [np.array([tuple(self.startNode), tuple(), (0, 0), tuple(avg_link_color)])]
-
-        # pre-calculate avg's for systemMaxHops, not just currentMaxHops to allow
+        num_dims = len(self.shape)
+        total_link_vals = self.dataModel.pos_link_values[..., :num_dims, 0] \
+            + self.dataModel.neg_link_values[..., :num_dims, 0]
+        self.avgLinkColors = self.map_link_colors(
+            total_link_vals.sum(axis = -1) / (2*num_dims), 1.0)
+
+        # Breadth first expansion from the start node. Each hop only keeps
+        # the distinct nodes it reaches (layoutNodes) and, for every one of
+        # them, the index of the node at the end of each of its 2*num_dims
+        # links in the next hop (layoutChildren). This grows with the number
+        # of nodes in reach rather than (2*num_dims)^hops; the path tree
+        # drawn from it in drawLayout shares the data of identical nodes.
+        # Link index 0-4 is positive a-e, 5-9 is negative a-e
+        offsets = np.vstack((np.identity(num_dims, dtype = int),
+            -np.identity(num_dims, dtype = int)))
+        level = np.array([self.startNode], dtype = int)
+        self.layoutNodes = [level]
+        self.layoutChildren = []
+
+        # pre-calculate for systemMaxHops, not just currentMaxHops to allow
         #   zooming updates to call updateDrawing() instead of update()
         for hop in range(self.systemMaxHops):
-            
-            #print 'Hop = ' + str(hop)
-            
-            # append an an array for the nodes belonging to the next hop
-            next_hop_shape = [2*len(self.startNode) for i in range(hop+1)]
-            nodeObjectList.append(np.tile(emptyNode, next_hop_shape + [1]))
-
-            # extra dim in current_shape to calc avg colors of leaf nodes
-            current_shape = [2*len(self.startNode) for i in range(hop)]
-            #print 'current_shape = ' + str(current_shape)
-            for current_path in np.ndindex(tuple(current_shape)): 
-                #print '\tcurrent_path = ' + str(current_path)
-                nodeObject = nodeObjectList[hop][current_path]
-                #for nodeObject in nodeObjectList[hop][current_path]:
-                # calculate the link colors and new paths for 10 outward links
-                node = nodeObject[0] # keep a tuple
-                
-                #print '\tCurrent_path = ' + str(current_path) + ', Node = ' + str(node) + ', Path = ' + str(nodeObject[1])
-                
-                path = list(nodeObject[1])
-                total_link_val = 0
-                #link_colors = np.array([[0, 0, 0, 1] for i in range(2*len(node))])
-                for dim in range(len(node)):                     
-                    # get new nodes for this dim, positive and negative
-                    pos_dim_node = self.getNextNode(node, dim, 1)
-                    neg_dim_node = self.getNextNode(node, dim, -1)
-
-                    # calculate path for these two nodes, appending to current path
-                    # path value 0-4 is positive a-e, 5-9 is negative a-e
-                    pos_path = path + [dim] 
-                    neg_path = path + [dim + len(node)] 
-
-                    # calculate the avg link color for the new pos and neg dim nodes
-                    total_link_val_pos = 0
-                    total_link_val_neg = 0
-                    for dim2 in range(len(node)):
-                        total_link_val_pos += self.dataModel.pos_link_values[tuple(pos_dim_node)][dim2][0]
-                        total_link_val_pos += self.dataModel.neg_link_values[tuple(pos_dim_node)][dim2][0]
-                        total_link_val_neg += self.dataModel.pos_link_values[tuple(neg_dim_node)][dim2][0]
-                        total_link_val_neg += self.dataModel.neg_link_values[tuple(neg_dim_node)][dim2][0]
-                    # ******** TODO:  Send in the preempt_range, see Torus5dModule.Torus5dGLWidget.updateLinkColors() ********
-                    avg_link_color_pos = self.map_link_color(total_link_val_pos/(2*len(node)), 1.0)
-                    #print 'pos_node = ' + str(pos_dim_node) + ', color_val[0] = ' + str(total_link_val_pos/10) + ', color = ' + str(avg_link_color_pos)
-                    
-                    # ******** TODO:  Send in the preempt_range, see Torus5dModule.Torus5dGLWidget.updateLinkColors() ********
-                    avg_link_color_neg = self.map_link_color(total_link_val_neg/(2*len(node)), 1.0)
-                    #print 'neg_node = ' + str(neg_dim_node) + ', color_val[0] = ' + str(total_link_val_neg/10) + ', color = ' + str(avg_link_color_neg)
-                    
-                    #print '\t\tAdding pos: dim = ' + str(dim) + ', node = ' + str(pos_dim_node) + ', path = ' + str(pos_path)
-                    #print '\t\tAdding neg: dim = ' + str(dim) + ', node = ' + str(neg_dim_node) + ', path = ' + str(neg_path)
-                    
-                    # insert positions as (-1, -1) so it will be an error if used before setting correctly
-                    nodeObjectList[hop+1][tuple(pos_path)] = ([tuple(pos_dim_node), tuple(pos_path), (-1, -1), tuple(avg_link_color_pos)])
-                    nodeObjectList[hop+1][tuple(neg_path)] = ([tuple(neg_dim_node), tuple(neg_path), (-1, -1), tuple(avg_link_color_neg)])
-        self.nodeObjectList = nodeObjectList
-        
+            next_nodes = (level[:, np.newaxis, :] + offsets) % self.shape
+            next_ids = np.ravel_multi_index(
+                next_nodes.reshape(-1, num_dims).T, self.shape)
+            unique_ids, children = np.unique(next_ids, return_inverse = True)
+            self.layoutChildren.append(children.reshape(len(level),
+                2*num_dims))
+            level = np.array(np.unravel_index(unique_ids, self.shape)).T
+            self.layoutNodes.append(level)
+
+    def getNodeObject(self, path):
+        """Returns the node reached by following path (link indices) from
+           the start node as [node, path, position, avg_link_color].
+           Positions are not stored and are always (-1, -1).
+        """
+        index = 0
+        for hop, link in enumerate(path):
+            index = self.layoutChildren[hop][index, link]
+        return self.layoutNodeObject(len(path), index, path)
+
+    def layoutNodeObject(self, hop, index, path):
+        """Returns the object of the index-th node of the given hop in
+           layoutNodes, reached by path, as getNodeObject does.
+        """
+        node = tuple(self.layoutNodes[hop][index].tolist())
+        return [node, tuple(path), (-1, -1), tuple(self.avgLinkColors[node])]
+
+    def layoutTree(self, hops):
+        """Returns for each hop up to the given one the index in layoutNodes
+           and the (x, y) position of the node at the end of every path of
+           that many links, in the order of np.ndindex over the paths. A
+           node is placed at the end of the last link of its path, at the
+           hop's link radius from its parent.
+        """
+        num_links = 2*len(self.shape)
+        angles = np.asarray(self.linkAngles[:num_links])
+        indices = [np.zeros(1, dtype = int)]
+        positions = [np.zeros((1, 2))]
+        for hop in range(hops):
+            indices.append(self.layoutChildren[hop][indices[hop]].reshape(-1))
+            theta = angles + hop * self.linkAngles[1]/2.
+            steps = self.linkRadii[hop] \
+                * np.column_stack((np.cos(theta), np.sin(theta)))
+            positions.append((positions[hop][:, np.newaxis, :]
+                + steps).reshape(-1, 2))
+        return indices, positions
 
     # ***************************    Calculate     *****************************
 
@@ -340,18 +338,6 @@ class Torus5dViewNodecentric(Torus5dGLWidget):
         #print 'returning node = ' + str(new_node)
         return new_node
 
-    def getNextPath(self, path):
-        #print '\t\tincr path = ' + str(path) + ', len(path) = ' + str(len(path))
-        while len(path) > 0 and path[len(path)-1] == 2*len(self.shape)-1:
-            # reached max index, chop off 1 from end
-            path = path[:len(path)-1]
-            #print '\t\tchopping off, path = ' + str(path)
-        if len(path) > 0:
-            path[len(path)-1] += 1
-            #print '\t\tdone chopping, inc path = ' + str(path)
-        #print '\t\t\treturning ' + str(path)
-        return path
-
     def getViewSpan(self, hops = None):
         if hops == None:
             hops = self.currentMaxHops
@@ -427,16 +413,21 @@ class Torus5dViewNodecentric(Torus5dGLWidget):
             #glLoadIdentity() # remove this if doing perspective projection
             #glTranslatef(self.width()/2, self.height()/2, 0)
 
-        self.drawNodeCircle(self.nodeObjectList[0][()])
-        self.drawLinkLines(self.nodeObjectList[0][()])
-
-        #print 'drawing n/l at path = []'
-
-        if self.currentMaxHops > 0:
-            #print 'Drawing with maxHopOpacity = ' + str(self.maxHopOpacity) + ', zoomLevel = ' + str(self.translation[2])
-            for angle in range(2*len(self.shape)):
-                path = [angle]
-                self.drawLocalRegion(path)
+        # The end of every path is drawn with its links, except at the last
+        # hop, where only its average link color is shown
+        indices, positions = self.layoutTree(self.currentMaxHops)
+        for hop in range(self.currentMaxHops + 1):
+            paths = np.ndindex(*([2*len(self.shape)] * hop))
+            for path, index, (x, y) in zip(paths, indices[hop].tolist(),
+                positions[hop].tolist()):
+                nodeObject = self.layoutNodeObject(hop, index, path)
+                if hop > 0 and hop == self.currentMaxHops:
+                    self.drawNodeCircle(nodeObject, [x, y, 0])
+                else:
+                    with glMatrix():
+                        glTranslatef(x, y, 0)
+                        self.drawNodeCircle(nodeObject)
+                        self.drawLinkLines(nodeObject)
                     
     def drawLabels(self):
         w = self.width()*0.2
@@ -541,59 +532,6 @@ class Torus5dViewNodecentric(Torus5dGLWidget):
                 glVertex3f(0, 0, 0)
                 glVertex3f(end_x, end_y, 0)
 
-    def drawLocalRegion(self, path):
-        # len(path) should NEVER be 0!  always called for a hop >= 1 away from startNode
-
-        done = False
-        push = 0
-        while not done: # there's more to do
-            #print 'new path = ' + str(path)
-            if len(path) != self.currentMaxHops: #depth first
-                # called from path = [0] for example, but before drawing, need
-                #   to translate by linkRadii[0], so linkRadii[len(path)-1]
-                r = self.linkRadii[len(path)-1] # radius is based on hop #
-                #print '*** Translating by linkRadii[' + str(len(path)-1) + '] == r = ' + str(r) + ' ***'
-                # translate by the direction in the last path value
-                theta = self.linkAngles[path[len(path)-1]]
-                theta += (len(path)-1) * self.linkAngles[1]/2.
-
-                glPushMatrix()
-                push += 1
-                #print 'pushing matrix, path = ' + str(path) + ', push = ' + str(push)
-
-                glTranslatef(r*np.cos(theta), r*np.sin(theta), 0)
-                #if (path[0] == 0):
-                #print 'drawing n/l at path = ' + str(path)
-                self.drawNodeCircle(self.nodeObjectList[len(path)][tuple(path)])
-                self.drawLinkLines(self.nodeObjectList[len(path)][tuple(path)])
-                path += [0]
-                continue
-            else:
-                # called from path = [0,0] for example (if maxHops == 2) and
-                #   currently at center of path = [0], so need to draw using
-                #   linkRadii[1], or linkRadii[len(path)-1]
-                for i in range(len(2*self.shape)):
-                    path[self.currentMaxHops-1] = i
-                    r = self.linkRadii[len(path)-1] # radius is based on hop #
-                    theta = self.linkAngles[path[len(path)-1]]
-                    theta += (len(path)-1) * self.linkAngles[1]/2.
-                    center = [r*np.cos(theta), r*np.sin(theta), 0]
-                    #print 'drawing n/l avg at path = ' + str(path)
-                    self.drawNodeCircle(self.nodeObjectList[len(path)][tuple(path)], center)
-                # how ever many values we chopped off the path, pop modelview matrix
-                #   when we chop off from path, we're moving back inward - erase translation
-                new_path = self.getNextPath(path)
-                # when new_path = [] we pop 1 too many, so take max of len(new_path) and 1
-                num_pop_matricies = len(path) - max(1, len(new_path))
-                for i in range(num_pop_matricies):
-                    push -= 1
-                    #print 'popping matrix, path = ' + str(path) + ', new_path = ' + str(new_path) + ', push = ' + str(push)
-                    glPopMatrix()
-                path = new_path
-
-            if len(path) <= 1:
-                done = True
-
     def drawNodeCircle(self, nodeObject, center = [0, 0, 0], avgLinks = True):
         ''' Draw all 1 node as a circle.  Always called from len(path) >= 0.'''
 
@@ -137,119 +137,29 @@ class Torus5dViewOverview(Torus5dGLWidget):
         self.paintEvent(None)
 
     def updateMiniMapValues(self):
-        '''Same as updateMiniMapValues, but does all planes.  Not currently doing anything
-        with variance data, but calculating it - so remove this if final decision is not 
-        to include it.
+        '''Same as updateMiniMapValues, but does all planes.  Link values are
+        averaged along the axis for every d/e plane at once, using the
+        [d, e, w, h, dim, axis] view of the link values, and the averages are
+        colored in one map_link_colors call per minimap.
         '''
-        #self.miniColors = list()
-        #self.miniVariance = list()
-        #self.planeAvgVariance = list()
-        #self.planeMaxVariance = list()
-        #self.planeTotalVariance = list()
         self.planeLinkColors = list()
-        #min_variance = sys.maxint
-        #max_variance = -sys.maxint - 1
-        plane_tot_index = 0 # REMOVE AFTER DEBUGGING
-        plane_avg_index = 0
         for axis in range(4):
-            aindex = 0
             for w, h, d in self.axis_map[axis]:
-                shape = self.shape[:]
-                slice_shape = [shape[w], shape[h], shape[axis]]
-                slice_indicies = [w, h, axis]
-                non_slice_indicies = [i for i in range(len(shape)) if i not in slice_indicies] # length 2
-                #d_values = [i for i in range(self.shape[d])]
-                d_values = [0]
-                mini_shape = list()
-                if shape[axis] != 0:
-                    shape = list(shape)
-                    # only shape[w] and shape[h] remain in mini_shape; the rest become 1
-                    mini_shape = [shape[i] if i in slice_indicies[:2] else 1 for i in range(len(shape))]
-                    mini_shape = tuple(mini_shape)
-                #link_colors = np.tile(self.default_link_color, [shape[w], shape[h], 1] + [3,1]) #uses slice dims
-                #link_variance = np.tile(0., [shape[w], shape[h], 1] + [3]) #store link variance by slice
-                plane_link_colors = np.tile(self.default_link_color, [shape[d], shape[4], shape[w], shape[h], 1] + [3,1]) #uses slice dims
-                #plane_link_variance = np.tile(0., [shape[d], shape[4], shape[w], shape[h], 1, 3])
-                # average the link bundles leaving every node in the slice, storing by 4th/5th dimension
-                plane_link_values = np.tile([0. for i in range(self.shape[axis])], [shape[d], shape[4]] + [shape[w], shape[h], 1] +  [3, 1])
-                #plane_total_variance = np.tile(0., [shape[d], shape[4]])
-                #plane_avg_variance = np.tile(0., [shape[d], shape[4]])
-                #plane_max_variance = np.tile(0., [shape[d], shape[4]])
-                #print '\tplane_tot_index = ' + str(plane_tot_index)
-                plane_tot_index = 0 # resets for each new 4th and 5th dimension plane
-                for node in np.ndindex(*mini_shape): # 5D node, but non-slice dims (plus axis) are 1
-                    dim_count = 0
-                    #print '\tplane_avg_index = ' + str(plane_avg_index)
-                    for dim in slice_indicies:
-                        val = [[0.0 for k in range(self.shape[4])] for j in range(self.shape[d])]
-                        count = [[0 for k in range(self.shape[4])] for j in range(self.shape[d])]
-                        subNode = list(node)
-                        link_values = [[[] for k in range(self.shape[4])] for j in range(self.shape[d])]
-
-                        #val_added_count = [[0 for k in range(self.shape[4])] for j in range(self.shape[d])]
-                        for i in range(self.shape[axis]):
-                            for j in range(self.shape[d]):
-                                higher_dims = [t for t in non_slice_indicies if t != d] # == [4] for 5 dim
-                                for k in range(self.shape[higher_dims[0]]):
-                                    subNode[axis] = i
-                                    subNode[non_slice_indicies[0]] = j
-                                    subNode[non_slice_indicies[1]] = k
-                                    current = self.dataModel.link_values[
-                                            tuple(subNode)][dim][0]
-                                    
-                                    # TODO:  Check what happens if this is +=current instead of =current
-                                    plane_link_values[j][k][tuple([node[w], node[h], 0])][dim_count][i] = current
-                                    val[j][k] += current
-                                    #val_added_count[j][k] += 1 
-                                    count[j][k] += self.dataModel.link_values[
-                                        tuple(subNode)][dim][1] # TODO : Ask Kate why this is necessary / when it's used?   
-
-                        if shape[axis] != 0:
-                            for j in range(self.shape[d]):
-                                for k in range(self.shape[higher_dims[0]]):
-                                    #if count[j][k] == 0:
-                                    #    mean = 0
-                                    #    variance_plane = 0
-                                    #else:
-                                    #    mean = np.sum(plane_link_values[j][k][(node[w], node[h], 0)][dim_count]) / self.shape[axis]
-                                    #   variance_plane = (np.sum(np.square(plane_link_values[j][k][(node[w], node[h], 0)][dim_count]))/(self.shape[axis])) - mean*mean
-                                    #plane_link_variance[j][k][(node[w], node[h], 0)][dim_count] = variance_plane
-                                    plane_link_colors[j][k][(node[w], node[h], 0)][dim_count] = self.map_link_color(
-                                        val[j][k] / float(self.shape[axis]), 1.0) \
-                                        if count[j][k] / float(self.shape[axis]) \
-                                        >= 1 else self.default_link_color
-                            
-                            # if including variance, comment back in and see GLMiniMaps.updateMiniMapValues
-                            #if variance > max_variance: max_variance = variance
-                            #if variance < min_variance: min_variance = variance
-
-                        dim_count += 1
-
-                '''
-                for j in range(self.shape[d]):
-                    for k in range(self.shape[higher_dims[0]]):
-                        total_count = np.product(slice_shape) * 3
-                        avg_count = shape[w] * shape[h] * 3
-                        # TODO:  Check to see when variance dim is used in drawLinkVariance (print out in place)
-                        #   to make sure we want to include dim = axis in this summation
-                        total_mean = np.sum(plane_link_values[j][k])/total_count
-                        plane_total_variance[j][k] = (np.sum(np.square(plane_link_values[j][k]))/total_count) - (total_mean*total_mean)
-                        plane_avg_variance[j][k] = np.sum(plane_link_variance[j][k])/avg_count
-                '''
-
-                #print 'axis = ' + str(axis) + ', map = ' + str(self.axis_map[axis]) + ', plane_total_variance = ' + str(plane_total_variance) + ', link_variance = ' + str(link_variance)
-
-                #print 'plane_avg_variance[j][k] = ' + str(plane_avg_variance[j][k])
-                
-                #self.planeAvgVariance.append(plane_avg_variance.copy())
-                #self.planeTotalVariance.append(plane_total_variance.copy())
-                self.planeLinkColors.append(plane_link_colors.copy())
-                #self.miniColors.append(link_colors.copy())
-                #self.miniVariance.append(link_variance.copy())
-                aindex += 1
-
-        #self.min_variance = min_variance
-        #self.max_variance = max_variance
+                values, counts = self.getMiniMapLinkValues(axis, w, h, d)
+                axis_span = float(self.shape[axis])
+
+                # average the link bundles leaving every node in the slice,
+                #   storing by 4th/5th dimension
+                plane_link_colors = np.tile(self.default_link_color,
+                    list(values.shape[:5]) + [1])
+                if axis_span != 0:
+                    colored = counts.sum(axis = 5) / axis_span >= 1
+                    if colored.any():
+                        plane_link_colors[colored] = self.map_link_colors(
+                            values.sum(axis = 5)[colored] / axis_span, 1.0)
+                self.planeLinkColors.append(
+                    plane_link_colors[:, :, :, :, np.newaxis])
+
         self.valuesInitialized = True
 
 
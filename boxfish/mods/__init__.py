@@ -1,9 +1,39 @@
 # __init__.py for Boxfish modules package
-import PlotModule
-import GLModule
-import Torus3dModule
-import Torus3dView2d
-import Torus3dView3d
-import TableModule
-import Torus5dModule
-import Torus5dView
+#
+# Modules are listed by the display names in their @Module decorators. The
+# decorators are read from the source files rather than imported so that
+# OpenGL, GLE and matplotlib are only loaded once a module using them is
+# first created. See loadModule.
+import os
+import re
+import importlib
+
+module_pattern = re.compile(r'^@Module\(\s*[\'"]([^\'"]+)[\'"]', re.MULTILINE)
+
+# Display name -> name of the Python module in this package defining it
+registry = dict()
+
+def findModules():
+    """Returns a dict from the display name of each Boxfish module in this
+       package to the Python module defining it, without importing them.
+    """
+    if not registry:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for filename in sorted(os.listdir(directory)):
+            name, extension = os.path.splitext(filename)
+            if extension != '.py' or name == '__init__':
+                continue
+            with open(os.path.join(directory, filename)) as source:
+                for display_name in module_pattern.findall(source.read()):
+                    registry[display_name] = name
+    return registry
+
+def loadModule(display_name):
+    """Imports the Python module defining the Boxfish module with the
+       given display name. Returns False if there is no such module.
+    """
+    name = findModules().get(display_name)
+    if name is None:
+        return False
+    importlib.import_module(__name__ + '.' + name)
+    return True
@@ -0,0 +1,71 @@
+import numpy as np
+
+class GridIndex(object):
+    """This class implements a uniform grid over a set of 2D points for
+       quickly finding the points inside a rectangle or nearest to a
+       position. The grid is sized so each cell holds about
+       points_per_cell points when they are evenly spread.
+    """
+    def __init__(self, xs, ys, points_per_cell = 8):
+        """Bin the points into the grid, storing the point indices sorted
+           by cell so each cell's points are a contiguous run."""
+        self.xs = np.asarray(xs, dtype = float)
+        self.ys = np.asarray(ys, dtype = float)
+        self.cells = max(1, int(np.sqrt(len(self.xs) / points_per_cell)))
+
+        finite = np.isfinite(self.xs) & np.isfinite(self.ys)
+        if finite.any():
+            self.low = np.array([self.xs[finite].min(),
+                self.ys[finite].min()])
+            high = np.array([self.xs[finite].max(), self.ys[finite].max()])
+        else:
+            self.low = np.zeros(2)
+            high = np.ones(2)
+        self.size = np.where(high > self.low,
+            (high - self.low) / self.cells, 1.0)
+
+        column, row = self.cellOf(self.xs, self.ys)
+        keys = column * self.cells + row
+        self.order = np.argsort(keys, kind = 'mergesort')
+        self.starts = np.searchsorted(keys[self.order],
+            np.arange(self.cells * self.cells + 1))
+
+    def cellOf(self, xs, ys):
+        """Get the grid column and row of the given positions. Positions
+           outside the grid are clamped to the border cells."""
+        with np.errstate(invalid = 'ignore'):
+            column = np.nan_to_num((np.asarray(xs) - self.low[0])
+                / self.size[0])
+            row = np.nan_to_num((np.asarray(ys) - self.low[1]) / self.size[1])
+        return (np.clip(column, 0, self.cells - 1).astype(int),
+            np.clip(row, 0, self.cells - 1).astype(int))
+
+    def within(self, xmin, xmax, ymin, ymax):
+        """Get the sorted indices of the points inside the rectangle,
+           bounds included."""
+        (column_low, column_high), (row_low, row_high) \
+            = self.cellOf([xmin, xmax], [ymin, ymax])
+
+        # Within a column, the rows of the rectangle are contiguous keys
+        candidates = [self.order[self.starts[column * self.cells + row_low]
+            :self.starts[column * self.cells + row_high + 1]]
+            for column in range(column_low, column_high + 1)]
+        candidates = np.concatenate(candidates)
+
+        xs = self.xs[candidates]
+        ys = self.ys[candidates]
+        inside = (xs >= xmin) & (xs <= xmax) & (ys >= ymin) & (ys <= ymax)
+        return np.sort(candidates[inside])
+
+    def nearest(self, x, y, dx, dy):
+        """Get the index of the point nearest (x, y), with distances
+           measured in units of dx along x and dy along y. Only points
+           within one unit are considered. Returns None if there are none.
+        """
+        candidates = self.within(x - dx, x + dx, y - dy, y + dy)
+        distances = ((self.xs[candidates] - x) / dx)**2 \
+            + ((self.ys[candidates] - y) / dy)**2
+        candidates = candidates[distances <= 1]
+        if len(candidates) == 0:
+            return None
+        return candidates[distances[distances <= 1].argmin()]
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+class LRUCache(object):
+    """This class implements a bounded dict-like cache. When more than
+       capacity entries are stored, the least recently used entries
+       are evicted first. Both lookups and stores count as uses.
+    """
+    def __init__(self, capacity):
+        """Init the cache to hold at most capacity entries."""
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """Membership test. This does not count as a use of the key."""
+        return key in self.entries
+
+    def __getitem__(self, key):
+        """Get the value stored for key, marking it most recently used."""
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        """Store value for key, evicting the least recently used entries
+           if the cache has grown beyond its capacity.
+        """
+        if key in self.entries:
+            del self.entries[key]
+        self.entries[key] = value
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last = False)
+
+    def get(self, key, default = None):
+        """Get the value stored for key, or default if there is none."""
+        if key in self.entries:
+            return self[key]
+        return default
+
+    def __delitem__(self, key):
+        """Remove the entry for key."""
+        del self.entries[key]
+
+    def keys(self):
+        """Return the list of keys, least recently used first."""
+        return list(self.entries.keys())
+
+    def clear(self):
+        """Remove all entries."""
+        self.entries.clear()
@@ -1 +1,2 @@
 import IndexCache
+import LRUCache
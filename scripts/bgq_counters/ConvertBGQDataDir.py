@@ -40,28 +40,115 @@ About:  This script file converts BG/Q data into a Boxfish compatible format.
 
 import os
 import sys
+import time
+import traceback
+import multiprocessing
 from optparse import OptionParser
 import numpy as np
 import ConvertBGQDataRun
 
-def convertAllData(source_dir, dest_dir, subdir_names, map_names, verbose, debug, print_help):
+def convertAllData(source_dir, dest_dir, subdir_names, map_names, verbose, debug, print_help,
+    jobs = 1, binary = False, force = False):
     ''' Converts all data for this source directory and destination directory.
     If source directory consists of sub directories, they are converted instead
     of the source directory itself.  Cannot convert both the source directory
     and sub directories, only one or the other.
+
+    The runs of all directories are converted by a pool of jobs processes.
+    Runs whose outputs are newer than their inputs and in the asked for
+    format are skipped unless force is set.  Prints a summary of the
+    throughput at the end and returns the number of runs that failed.
     '''  
 
     if subdir_names == None: # only convert source_dir
-        dirData = DataDirConverter(source_dir, dest_dir, map_names,
-            verbose, debug)
-        dirData.convertDir(print_help)
+        dirDataList = [DataDirConverter(source_dir, dest_dir, map_names,
+            verbose, debug, binary)]
     else:
+        dirDataList = list()
         for name in subdir_names:
             src_path = os.path.join(source_dir, name)
             dst_path = os.path.join(dest_dir, name)
-            dirData = DataDirConverter(src_path, dst_path, map_names,
-            verbose, debug)
-            dirData.convertDir(print_help)
+            dirDataList.append(DataDirConverter(src_path, dst_path, map_names,
+            verbose, debug, binary))
+
+    runs = list()
+    for dirData in dirDataList:
+        runs.extend(dirData.findRuns(print_help))
+
+    todo = [run for run in runs if force or not isUpToDate(run)]
+    skipped = len(runs) - len(todo)
+    if verbose and skipped:
+        print 'Skipping ' + str(skipped) + ' runs that are up to date.'
+
+    start = time.time()
+    if jobs > 1 and len(todo) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(todo)))
+        results = pool.imap_unordered(convertRun, todo)
+    else:
+        pool = None
+        results = (convertRun(run) for run in todo)
+
+    converted = failed = 0
+    input_bytes = 0
+    for imap_str, size, error in results:
+        if error is None:
+            converted += 1
+            input_bytes += size
+        else:
+            failed += 1
+            print '*** Error: Converting ' + imap_str + ' failed. ***'
+            print error
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    elapsed = max(time.time() - start, 1e-6)
+    print ('Converted %d runs (%.1f MB) in %.1f s: %.2f runs/s, %.2f MB/s. '
+        + 'Skipped %d up to date, %d failed.') % (converted, input_bytes / 1e6,
+        elapsed, converted / elapsed, input_bytes / 1e6 / elapsed, skipped, failed)
+    return failed
+
+def isBinaryTable(filename):
+    ''' Returns True if the header of the Boxfish table file says its records
+    are binary, see ConvertBGQDataRun.DataConverter.writeTable.
+    '''
+    with open(filename, 'rb') as tableFile:
+        tableFile.readline() # the --- opening the header
+        for line in iter(tableFile.readline, ''):
+            if line.startswith('---'):
+                break
+            if line.strip() == 'encoding: binary':
+                return True
+    return False
+
+def isUpToDate(run):
+    ''' Returns True if all outputs of the run exist, are newer than its
+    inputs and the converter script itself, as make would decide, and have
+    the table format asked for with -b.
+    '''
+    imap_str, argv, inputs, outputs = run
+    if not all(os.path.exists(output) for output in outputs):
+        return False
+    tables = [output for output in outputs if not output.endswith('_meta.yaml')]
+    if any(isBinaryTable(table) != ('-b' in argv) for table in tables):
+        return False
+    sources = inputs + [os.path.splitext(ConvertBGQDataRun.__file__)[0] + '.py']
+    newest_input = max(os.path.getmtime(source) for source in sources
+        if os.path.exists(source))
+    return min(os.path.getmtime(output) for output in outputs) >= newest_input
+
+def convertRun(run):
+    ''' Converts a single run found by DataDirConverter.findRuns.  Returns the
+    run map name, the size of its input data and the error text or None, so
+    one bad run does not stop the others.
+    '''
+    imap_str, argv, inputs, outputs = run
+    try:
+        ConvertBGQDataRun.DataConverter(argv)
+    except (Exception, SystemExit):
+        return imap_str, 0, traceback.format_exc()
+    return imap_str, sum(os.path.getsize(path) for path in inputs), None
 
 def parseCommandLine(parser):
     ''' Returns a list containing source directories, and destination directory.
@@ -74,6 +161,12 @@ def parseCommandLine(parser):
         default=False, help = "print file name arguments passed to ConvertBGQDataRun.py")
     parser.add_option("-d", "--debug", dest="debugMode", action = "store_true",
         default=False, help = "print node and link data being output to .yaml files")
+    parser.add_option("-j", "--jobs", dest="jobs", type = "int",
+        default=multiprocessing.cpu_count(), help = "number of runs to convert in parallel")
+    parser.add_option("-b", "--binary", dest="binaryMode", action = "store_true",
+        default=False, help = "write tables as binary records instead of text")
+    parser.add_option("-f", "--force", dest="force", action = "store_true",
+        default=False, help = "convert runs even if their outputs are up to date")
     options, args = parser.parse_args()
 
     if len(args) < 4:
@@ -103,7 +196,8 @@ def parseCommandLine(parser):
                     print 'Creating destination directory: ' + str(os.path.join(args[1], path_name))
 
     return (args[0], args[1], options.sub_dirs, args[2:], 
-        options.verboseMode, options.debugMode)
+        options.verboseMode, options.debugMode, options.jobs,
+        options.binaryMode, options.force)
 
 
 class DataDirConverter():
@@ -111,11 +205,12 @@ class DataDirConverter():
     tuples for each tiling, which generally consists of many runs.
     '''
 
-    def __init__(self, src_path, dst_path, map_names, verbose, debug):
+    def __init__(self, src_path, dst_path, map_names, verbose, debug, binary = False):
         self.runFileNames = list()
         self.destPath = dst_path
         self.verboseMode = verbose
         self.debugMode = debug
+        self.binaryMode = binary
         self.formatFileNames(src_path, map_names)
 
         # process data
@@ -144,6 +239,14 @@ class DataDirConverter():
         happen if user types '--subdir= size1 size64' instead of '--subdir=size1 size64'
         '--subdir size1 size64'. 
         '''
+        for imap_str, argv, inputs, outputs in self.findRuns(print_help):
+            runData = ConvertBGQDataRun.DataConverter(argv)
+
+    def findRuns(self, print_help):
+        ''' Returns a list of (map name, ConvertBGQDataRun argv, input files,
+        output files) tuples for each run in the directory, see convertDir.
+        '''
+        runs = list()
         for start_name, end_name in self.runFileNames:
              # strip the right-most integers for calculating intermediate file names
              # first get the start number
@@ -184,15 +287,22 @@ class DataDirConverter():
                     "--ometa", ometa_str]
                 if self.debugMode:
                     argv.append("-d")
+                if self.binaryMode:
+                    argv.append("-b")
                 if self.verboseMode: 
                     argv.append("-v")
                     print '\nConvertBGQDataRun(argv), argv = ' + str(argv)
 
-                runData = ConvertBGQDataRun.DataConverter(argv)
+                runs.append((imap_str, argv, [imap_str, idata_str],
+                    [omap_str, onodes_str, olinks_str, ometa_str]))
+        return runs
 
 if __name__ == "__main__":
     usage = "Usage: " + sys.argv[0] + " [options] source_dir dest_dir tile1_first_map tile1_last_map [tile2_first_map tile2_last_map...]"
     parser = OptionParser(usage)
-    source_dir, dest_dir, subdir_names, map_names, verbose, debug = parseCommandLine(parser)
-    convertAllData(source_dir, dest_dir, subdir_names, map_names, verbose, debug, parser.print_help)
+    source_dir, dest_dir, subdir_names, map_names, verbose, debug, jobs, binary, force \
+        = parseCommandLine(parser)
+    failed = convertAllData(source_dir, dest_dir, subdir_names, map_names, verbose, debug,
+        parser.print_help, jobs, binary, force)
+    sys.exit(1 if failed else 0)
 
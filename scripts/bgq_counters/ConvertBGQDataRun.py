@@ -9,7 +9,9 @@ About:  This script file converts data from a single BG/Q run into a Boxfish
    which hold the rank map and node/link data, respectively.  Outputs four .yaml 
    files for Boxfish (i.e. map-1_rank_map.yaml, map-1_nodes.yaml, map-1_links.yaml, 
    map-1_meta.yaml) which hold the correctly formatted mpi_rank map, node
-   ids, link data, and the meta data file, respectively.  
+   ids, link data, and the meta data file, respectively.  With -b the tables
+   are written as binary records after their YAML header, which Boxfish loads
+   much faster than text.
 
    For command line arguments and more detailed information see README.txt.
 '''
@@ -23,8 +25,20 @@ class DataConverter():
    ''' Converts data from a single run (i.e. map-1, map-1.cnt) into four files 
    for Boxfish (i.e. map-1_rank_map.yaml, map-1_nodes.yaml, map-1_links.yaml,
    map-1_meta.yaml).
+
+   The link counters are held in a (nodes, 10, 5) integer array indexed by
+   node id, link number and counter.  Node ids increase first in the a
+   dimension, then b, c, d, e.  Link numbers are [a-, a+, b-, b+, c-, c+, d-,
+   d+, e-, e+] and the counters are linkCounters below.
    '''
 
+   # counters kept for each link, the col_packets column is ignored
+   linkCounters = ['sent_chunks', 'dynamic_chunks', 'deterministic_chunks',
+      'recv_packets', 'fifo_length']
+
+   # columns of the 6 values per link in the input that hold linkCounters
+   linkColumns = [0, 1, 2, 4, 5]
+
    def __init__(self, argv):
       # class vars
       self.iMap = ''  # file name of input map, i.e. map-1
@@ -36,8 +50,9 @@ class DataConverter():
       self.shape = tuple() # number of coordinate values in each node dimension
       self.verboseMode = False  # print out what files currently processing
       self.debugMode = False # for debugging output data
-      self.mpiRank = list()  # stores the mpi rank for thread (a, b, c, d, e, t)
-      self.nodeData = list() # stores 10 LinkData obj. for node (a, b, c, d, e) 
+      self.binaryMode = False # write tables as binary records instead of text
+      self.mpiRank = None  # stores the mpi rank of the t = 0 thread per node
+      self.linkData = None # (nodes, 10, 5) array of link counters
 
       # initialize file names
       self.parseCommandLine(argv)
@@ -45,201 +60,129 @@ class DataConverter():
       # process the data
       self.processData()
 
-   def getDestNode(self, node, link_num):
-      if link_num == 0: # a_minus link
-         return self.getNextNode(node, 0, False)
-      elif link_num == 1: # a_positive link
-         return self.getNextNode(node, 0, True)
-      elif link_num == 2: # b_minus link
-         return self.getNextNode(node, 1, False)
-      elif link_num == 3: # b_positive link
-         return self.getNextNode(node, 1, True)
-      elif link_num == 4: # c_minus link
-         return self.getNextNode(node, 2, False)
-      elif link_num == 5: # c_positive link
-         return self.getNextNode(node, 2, True)
-      elif link_num == 6: # d_minus link
-         return self.getNextNode(node, 3, False)
-      elif link_num == 7: # d_positive link
-         return self.getNextNode(node, 3, True)
-      elif link_num == 8: # e_minus link
-         return self.getNextNode(node, 4, False)
-      elif link_num == 9: # e_positive link
-         return self.getNextNode(node, 4, True)
-      else:
-         return [-1 for i in range(len(node))]
-      
-   def getNextNode(self, node, dim, inc = True):
-      if inc and node[dim] == self.shape[dim]-1:
-         return node[:dim] + [0] + node[dim+1:]
-      elif inc:
-         return node[:dim] + [node[dim]+1] + node[dim+1:]
-      elif not inc and node[dim] == 0:
-         return node[:dim] + [self.shape[dim]-1] + node[dim+1:]
-      elif not inc:
-         return node[:dim] + [node[dim]-1] + node[dim+1:]
-      else:
-         return [-1 for i in range(len(node))]
+   def nodeCoords(self):
+      ''' Returns a (nodes, 5) array of the (a, b, c, d, e) coordinates of
+      every node in node id order.
+      '''
+      node_ids = np.arange(np.prod(self.shape))
+      return np.array(np.unravel_index(node_ids, self.shape, order = 'F')).T
+
+   def destCoords(self, coords):
+      ''' Returns a (nodes, 10, 5) array of the coordinates of the node at
+      the other end of each link of the given nodes, wrapping around the torus.
+      '''
+      # link 2*dim goes one step down dim, link 2*dim+1 one step up
+      steps = np.zeros((10, 5), dtype = int)
+      steps[np.arange(0, 10, 2), np.arange(5)] = -1
+      steps[np.arange(1, 10, 2), np.arange(5)] = 1
+      return (coords[:, np.newaxis, :] + steps) % np.array(self.shape)
 
    def inputData(self):
-      # for input map file, store mpi rank for each (a, b, c, d, e, t)
-      # to get size/dimensions of numpy array, get max a, b, c, d, e, t - as of
-      #     now this is just last line of iMap, but that may change so find max
-
-      #with open(self.iMap) as iMapFile:
-      with open(self.iData) as iMapFile:
-         max_a = max_b = max_c = max_d = max_e = max_t = 0
-         # iMap = <a b c d e t>, line_number = mpi_rank
-         # find max node dimensions to set up numpy array
-         for line in iMapFile:
-            split_line = line.split(' ', 8)
-            #split_line = line.split(' ', 5)
-            #for i in range(len(split_line)):
-            for i in range(len(split_line) - 1):
-               split_line[i] = int(split_line[i])
-            ignore, rank, a, b, c, d, e, t, cruft = split_line
-            #a, b, c, d, e, t = split_line
-            max_a = max(a, max_a)
-            max_b = max(b, max_b)
-            max_c = max(c, max_c)
-            max_d = max(d, max_d)
-            max_e = max(e, max_e)
-            max_t = max(t, max_t)
-
-         # initialize numpy array, move read ptr to start again
-         self.shape = list([max_a+1, max_b+1, max_c+1, max_d+1, max_e+1])
-         self.mpiRank = np.tile(0, self.shape + [max_t+1])
-         iMapFile.seek(0)
-         line_num = 0
-         for line in iMapFile:
-            split_line = line.split(' ', 8)
-            #split_line = line.split(' ', 5)
-            #for i in range(len(split_line)):
-            for i in range(len(split_line) - 1):
-               split_line[i] = int(split_line[i])
-            ignore, rank, a, b, c, d, e, t, cruft = split_line
-            #a, b, c, d, e, t = split_line
-            self.mpiRank[(a, b, c, d, e, t)] = rank
-            #self.mpiRank[(a, b, c, d, e, t)] = line_num
-            #if self.debugMode:
-            #   print 'mpiRank(',a,b,c,d,e,t,') = ', self.mpiRank[(a, b, c, d, e, t)]
-            #line_num += 1
-         
-      # for input data file, store link data for each node (a, b, c, d, e)
-      # link data stored as [a-, a+, b-, b+, c-, c+, d-, d+, e-, e+], where
-      #  each element in the list is a linkData object, which stores 5 scalars
-      #  for that link direction
+      # Each line of the input data file is
+      #    <ignored> <mpi rank> <a> <b> <c> <d> <e> <t> ... ** <60 values>
+      # holding 6 values per link direction [a-, a+, b-, ..., e+].  Every
+      #    line is checked to have the layout of the first, then the file is
+      #    converted in bulk into a table of tokens, one row per line.
       with open(self.iData) as iDataFile:
-         temp_link_data = [-1 for i in range(5)]
-         self.nodeData = np.tile([LinkData(temp_link_data) for i in range(10)],\
-            self.shape + [1])
-         for line in iDataFile:
-            node_string, link_string = line.split('**', 1)
-            node_string = node_string.split(' ')
-            # don't include the empty string link_string[0], from space after **
-            #   nor empty string at the end of link_string, from trailing space
-            link_data = link_string.split(' ')[1:-1]
-
-            # node coordinates abcdet are columns 2-7 (starting at 0)
-            node = node_string[2:8]
-            for i in range(len(node)):
-               node[i] = int(node[i])
-            node = tuple(node)
-
-            # link data are 6 values per direction, 10 directions
-            for i in range(len(link_data)):
-               link_data[i] = int(link_data[i])
-
-            # store the link data, ignore the 4th value, col_packets
-            print '\n'
-            for i in range(10):
-               start = i*6
-               if self.debugMode:
-                  print 'Map = ' + str(self.iMap) + ', Setting node (a,b,c,d,e,t) = ' + \
-                     str(node) + ', mpi_rank = ' + str(self.mpiRank[node]) + ', link_num = ' + str(i)
-               single_link_data = link_data[start:start+3]+ \
-                  link_data[start+4:start+6]
-               self.nodeData[node[:-1]][i].setLinkData(single_link_data, self.debugMode)
-       
-   def outputData(self):
-      #print 'OutputData, map = ' + str(self.iMap)
-
-      with open(self.oMap, 'w') as oMapFile:
-         # use the oMap file name (without extension) as the key
-         key_string = '---\nkey: ' + 'bgq_'+os.path.basename(self.iMap) + '\n---\n- '\
-            + '[mpirank, int32]\n- [nodeid, int32]\n...\n'
-         oMapFile.write(key_string)
-         rev_shape = list(self.shape)
-         rev_shape.reverse()
-         node_id = 0
-         # node_id increases first in the a dim, then b, c, d, e
-         #    ndindex iterates through last dim first, then second-last, etc
-         #    so need to reverse order, iterate with ndindex, then reverse back
-         for rev_node in np.ndindex(*tuple(rev_shape)):
-            node = list(rev_node)
-            node.reverse()
-            # since the link data for each node is for the t = 0 thread, use 0
-            mpi_rank = self.mpiRank[tuple(node)][0]
-            oMapFile.write(str(mpi_rank) + ' ' + str(node_id) + ' \n')
-            node_id += 1
-
-      with open(self.oNodes, 'w') as oNodesFile:
-         # use the oNodes file name (without extension) as the key
-         key_string = '---\nkey: ' + 'bgq_'+os.path.basename(self.iMap) + '\n---\n- ' \
-            + '[nodeid, int32]\n- [a, int32]\n- [b, int32]\n- [c, int32]\n- ' \
-            + '[d, int32]\n- [e, int32]\n...\n'
-         oNodesFile.write(key_string)
-         rev_shape = list(self.shape)
-         rev_shape.reverse()
-         node_id = 0
-         # node_id increases first in the a dim, then b, c, d, e
-         #    ndindex iterates through last dim first, then second-last, etc
-         #    so need to reverse order, iterate with ndindex, then reverse back
-         for rev_node in np.ndindex(*tuple(rev_shape)):
-            node = list(rev_node)
-            node.reverse()
-            node_str = ''
-            for i in range(len(node)):
-               node_str += str(node[i]) + ' '
-            oNodesFile.write(str(node_id) + ' ' + node_str + '\n')
-            node_id += 1
-
-      with open(self.oLinks, 'w') as oLinksFile:
-         # use the oLinks file name (without extension) as the key
-         key_string = '---\nkey: ' + 'bgq_'+os.path.basename(self.iMap) + '\n---\n- ' \
-            + '[linkid, int32]\n- [sa, int32]\n- [sb, int32]\n- [sc, int32]\n' \
-            + '- [sd, int32]\n- [se, int32]\n- [ta, int32]\n- [tb, int32]\n' \
-            + '- [tc, int32]\n- [td, int32]\n- [te, int32]\n- [sent_chunks, ' \
-            + 'int64]\n- [dynamic_chunks, int64]\n- [deterministic_chunks, ' \
-            + 'int64]\n- [recv_packets, int64]\n- [fifo_length, int64]\n...\n'
-         oLinksFile.write(key_string)
-         rev_shape = list(self.shape)
-         rev_shape.reverse()
-         node_id = 0
-         # node_id increases first in the a dim, then b, c, d, e
-         #    ndindex iterates through last dim first, then second-last, etc
-         #    so need to reverse order, iterate with ndindex, then reverse back
-         for rev_node in np.ndindex(*tuple(rev_shape)):
-            node = list(rev_node)
-            node.reverse()
-            node_str = ''
-            for i in range(len(node)):
-               node_str += str(node[i]) + ' '
+         lines = [(number, line.split())
+            for number, line in enumerate(iDataFile, 1) if line.strip()]
+
+      if not lines:
+         raise ValueError(self.iData + ' has no data.')
+
+      first_number, first_row = lines[0]
+      if '**' not in first_row:
+         raise ValueError(self.iData + ' line ' + str(first_number) \
+            + ' has no ** separator.')
+      separator = first_row.index('**')
+      row_length = separator + 1 + 60
+      for number, row in lines:
+         if len(row) != row_length or row[separator] != '**':
+            raise ValueError(self.iData + ' line ' + str(number) + ' has ' \
+               + str(len(row)) + ' values, expected ' + str(row_length) \
+               + ' with ** at column ' + str(separator) + '.')
+      tokens = np.array([row for number, row in lines])
+      del lines
+
+      ranks = tokens[:, 1].astype(np.int64)
+      threads = tokens[:, 7].astype(np.int64)
+      coords = tokens[:, 2:7].astype(np.int64)
+      links = tokens[:, separator + 1:].astype(np.int64).reshape(-1, 10, 6)
+      del tokens
+
+      # the torus spans the largest coordinates found
+      self.shape = list(coords.max(axis = 0) + 1)
+      num_nodes = np.prod(self.shape)
+      node_ids = np.ravel_multi_index(coords.T, self.shape, order = 'F')
+
+      # nodes may be listed once per thread, the last line of a node wins
+      last_lines = len(node_ids) - 1 \
+         - np.unique(node_ids[::-1], return_index = True)[1]
+      self.linkData = np.tile(-1, (num_nodes, 10, 5))
+      self.linkData[node_ids[last_lines]] = \
+         links[last_lines][:, :, self.linkColumns]
+
+      # the link data is for the t = 0 thread so that is the rank we keep
+      self.mpiRank = np.zeros(num_nodes, dtype = np.int64)
+      thread_zero = threads == 0
+      self.mpiRank[node_ids[thread_zero]] = ranks[thread_zero]
 
+      if self.debugMode:
+         all_coords = self.nodeCoords()
+         for node_id in node_ids[last_lines]:
+            print 'Map = ' + str(self.iMap) + ', node (a,b,c,d,e) = ' + \
+               str(tuple(all_coords[node_id])) + ', mpi_rank = ' + \
+               str(self.mpiRank[node_id])
             for link_num in range(10):
-               link_id = node_id*10 + link_num
-               dest_node = self.getDestNode(node, link_num)
-               dest_node_str = ''
-               for i in range(len(dest_node)):
-                  dest_node_str += str(dest_node[i]) + ' '
-               node_t = tuple(node)
-               oLinksFile.write(str(link_id) + ' ' + node_str + dest_node_str+\
-                  str(self.nodeData[node_t][link_num].sentChunks) + ' ' + \
-                  str(self.nodeData[node_t][link_num].dynamicChunks) + ' ' + \
-                  str(self.nodeData[node_t][link_num].deterministicChunks) + \
-                  ' ' + str(self.nodeData[node_t][link_num].recvPackets) + \
-                  ' ' + str(self.nodeData[node_t][link_num].fifoLength) + ' \n')
-            node_id += 1
+               counters = zip(self.linkCounters, self.linkData[node_id, link_num])
+               print '\tlink_num = ' + str(link_num) + ', ' + \
+                  ', '.join([name + ' = ' + str(value) for name, value in counters])
+
+   def writeTable(self, filename, fields, columns):
+      ''' Writes a Boxfish table with the given (name, type) fields and a 2D
+      array of columns holding one row per table row.  As text by default or
+      as binary records with the -b option.
+      '''
+      with open(filename, 'wb') as oFile:
+         # use the input map file name as the key
+         header = '---\nkey: ' + 'bgq_' + os.path.basename(self.iMap) + '\n'
+         if self.binaryMode:
+            header += 'encoding: binary\n'
+         header += '---\n' + ''.join('- [' + name + ', ' + data_type + ']\n'
+            for name, data_type in fields) + '...\n'
+         oFile.write(header)
+
+         if self.binaryMode:
+            records = np.empty(len(columns), dtype = np.dtype(fields))
+            for i, (name, data_type) in enumerate(fields):
+               records[name] = columns[:, i]
+            records.tofile(oFile)
+         else:
+            np.savetxt(oFile, columns, fmt = '%d')
+
+   def outputData(self):
+      #print 'OutputData, map = ' + str(self.iMap)
+      coords = self.nodeCoords()
+      num_nodes = len(coords)
+      node_ids = np.arange(num_nodes)
+
+      self.writeTable(self.oMap, [('mpirank', 'int32'), ('nodeid', 'int32')],
+         np.column_stack((self.mpiRank, node_ids)))
+
+      self.writeTable(self.oNodes, [('nodeid', 'int32')] \
+         + [(dim, 'int32') for dim in 'abcde'],
+         np.column_stack((node_ids, coords)))
+
+      # link_id = node_id * 10 + link_num
+      link_ids = np.arange(num_nodes * 10)
+      source = np.repeat(coords, 10, axis = 0)
+      dest = self.destCoords(coords).reshape(-1, 5)
+      self.writeTable(self.oLinks, [('linkid', 'int32')] \
+         + [('s' + dim, 'int32') for dim in 'abcde'] \
+         + [('t' + dim, 'int32') for dim in 'abcde'] \
+         + [(name, 'int64') for name in self.linkCounters],
+         np.column_stack((link_ids, source, dest,
+         self.linkData.reshape(-1, 5))))
 
       with open(self.oMeta, 'w') as oMetaFile:
          key_string = '---\nkey: ' + 'bgq_'+os.path.basename(self.iMap) + '\nhardware' \
@@ -275,11 +218,11 @@ class DataConverter():
       usageMessage = 'Usage: ' + sys.argv[0] + ' --imap <input_map_file> --idata' \
             + ' <input_data_file> --omap <output_rank_map_file> --onodes' \
             + ' <output_nodes_file> --olinks <output_links_file> --ometa' \
-            + ' <output_data_file>\n'
+            + ' <output_data_file> [-b]\n'
       
       # store command line args
       try:
-         opts, args = getopt.getopt(argv, "vd", ["imap=","idata=","omap=",
+         opts, args = getopt.getopt(argv, "vdb", ["imap=","idata=","omap=",
             "onodes=", "olinks=", "ometa="])
       except getopt.GetoptError:
          print "\n*** Fatal Error: Unknown command line argument given. ***"
@@ -292,6 +235,8 @@ class DataConverter():
             self.verboseMode = True
          if opt == '-d':
             self.debugMode = True
+         if opt == '-b':
+            self.binaryMode = True
 
       status_msg = ''
       if self.verboseMode:
@@ -351,28 +296,5 @@ class DataConverter():
       self.outputData()
 
 
-class LinkData():
-   ''' Struct to hold the link data. Attributes are sent_chunks, dynamic_chunks,
-   deterministic_chunks, recv_packets, fifo_length.  
-
-   The attribute col_packets are ignored as of now.  Each node in self.nodeData
-   has a list of LinkData objects, one per dimension link, plus and minus.
-   '''
-
-   def __init__(self, data):
-      self.setLinkData(data)
-
-   def setLinkData(self, data, debug_mode = False):
-      self.sentChunks = data[0]
-      self.dynamicChunks = data[1]
-      self.deterministicChunks = data[2]
-      self.recvPackets = data[3]
-      self.fifoLength = data[4]
-      if debug_mode:
-         print '\tsent_chunks =',self.sentChunks,', dynamic_chunks =', \
-         self.dynamicChunks,', deterministic_chunks =',self.deterministicChunks\
-         ,', recv_packets =',self.recvPackets,', fifo_length =',self.fifoLength
-
 if __name__ == "__main__":
    runData = DataConverter(sys.argv[1:])
-   runData.processData()
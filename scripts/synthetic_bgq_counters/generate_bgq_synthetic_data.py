@@ -1,116 +1,281 @@
+#!/usr/bin/env python
+
+'''
+About:  Generates synthetic torus network data for Boxfish at any scale, for
+    testing and benchmarking without production data.  Writes the nodes,
+    links, rank map and meta files of a 3D or 5D torus, with one set of
+    link values per code region (or time step).
+
+    The defaults generate a data set like the example bgq_synthetic, a
+    [a, b, c, d, e] = [6, 5, 4, 3, 2] torus with two code regions and link
+    values increasing outwards from the center.  Sequoia scale is
+    --shape 16x16x16x12x2.
+
+    For command line arguments and more detailed information see README.txt.
+'''
+
+import os
+import argparse
 import numpy as np
 
-link_data_file = open('bgq_synthetic_links.yaml', 'w')
-node_data_file = open('bgq_synthetic_nodes.yaml', 'w')
-
-def next(current, max, forward):
-	if current == max-1:
-		return (0 if forward else current - 1)
-	elif current == 0:
-		return (1 if forward else max - 1)
-	else:
-		return (current + 1 if forward else current - 1)
-
-def linkVal(e, d, c, b, a):
-	# return a * 10000 + b * 1000 + c * 100 + d * 10 + e   # standard bg/q synthetic data
-	return (abs(a-2.5) + abs(c-1.5)) * 10000  # increasing outwards from the center when looking down the b-direction of a 3-d torus
-
-# Write node data to an intermediate file
-node_data_file.write('---\n')
-node_data_file.write('key: TEST_5D_TORUS\n')
-node_data_file.write('---\n')
-node_data_file.write('- [nodeid, int32]\n')
-node_data_file.write('- [a, int32]\n')
-node_data_file.write('- [b, int32]\n')
-node_data_file.write('- [c, int32]\n')
-node_data_file.write('- [d, int32]\n')
-node_data_file.write('- [e, int32]\n')
-node_data_file.write('- [code_region, int32]\n')
-node_data_file.write('...\n')
-
-for j in [1,2]:
-	count = 0
-	for i in np.ndindex(2, 3, 4, 5, 6):
-		s = str(count) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + str(i[2]) +  ' ' + \
-			str(i[1]) + ' ' + str(i[0]) + ' ' + str(j) + ' \n'
-		node_data_file.write(s)
-		count += 1
-		
-# Write link data to an intermediate file
-
-link_data_file.write('---\n')
-link_data_file.write('key: TEST_5D_TORUS\n')
-link_data_file.write('---\n')
-link_data_file.write('- [linkid, int32]\n')
-link_data_file.write('- [sa, int32]\n')
-link_data_file.write('- [sb, int32]\n')
-link_data_file.write('- [sc, int32]\n')
-link_data_file.write('- [sd, int32]\n')
-link_data_file.write('- [se, int32]\n')
-link_data_file.write('- [ta, int32]\n')
-link_data_file.write('- [tb, int32]\n')
-link_data_file.write('- [tc, int32]\n')
-link_data_file.write('- [td, int32]\n')
-link_data_file.write('- [te, int32]\n')
-link_data_file.write('- [code_region, int32]\n')
-link_data_file.write('- [packets, int32]\n')
-link_data_file.write('...\n')
-
-for j in [1,2]:
-	count = 0
-	for i in np.ndindex(2, 3, 4, 5, 6):
-		s = str(count) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + str(i[2]) + ' ' + \
-			str(i[1]) + ' ' + str(i[0]) + ' ' + str(next(i[4], 6, True)) + ' ' + \
-			str(i[3]) + ' ' + str(i[2]) + ' ' + str(i[1]) + ' ' + str(i[0]) + ' ' + \
-			str(j) + ' ' + str(linkVal(*i)) + ' \n'
-		link_data_file.write(s)
-		count += 1
-		s = str(count) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + str(i[2]) + ' ' + \
-			str(i[1]) + ' ' + str(i[0]) + ' ' + str(next(i[4], 6, False)) + ' ' + \
-			str(i[3]) + ' ' + str(i[2]) + ' ' + str(i[1]) + ' ' + str(i[0]) + ' ' + \
-			str(j) + ' ' + str(linkVal(*i)) + ' \n'
-		link_data_file.write(s)
-		count += 1
-		s = str(count) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + str(i[2]) + ' ' + \
-			str(i[1]) + ' ' + str(i[0]) + ' ' + str(i[4]) + ' ' + \
-			str(next(i[3], 5, True)) + ' ' + str(i[2]) + ' ' + str(i[1]) + ' ' + str(i[0]) + ' ' + \
-			str(j) + ' ' + str(linkVal(*i)) + ' \n'
-		link_data_file.write(s)
-		count += 1
-		s = str(count) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + str(i[2]) + ' ' + \
-			str(i[1]) + ' ' + str(i[0]) + ' ' + str(i[4]) + ' ' + \
-			str(next(i[3], 5, False)) + ' ' + str(i[2]) + ' ' + str(i[1]) + ' ' + str(i[0]) + ' ' + \
-			str(j) + ' ' + str(linkVal(*i)) + ' \n'
-		link_data_file.write(s)
-		count += 1
-		s = str(count) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + str(i[2]) + ' ' + \
-			str(i[1]) + ' ' + str(i[0]) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + \
-			str(next(i[2], 4, True)) + ' ' + str(i[1]) + ' ' + str(i[0]) + ' ' + \
-			str(j) + ' ' + str(linkVal(*i)) + ' \n'
-		link_data_file.write(s)
-		count += 1
-		s = str(count) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + str(i[2]) + ' ' + \
-			str(i[1]) + ' ' + str(i[0]) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + \
-			str(next(i[2], 4, False)) + ' ' + str(i[1]) + ' ' + str(i[0]) + ' ' + \
-			str(j) + ' ' + str(linkVal(*i)) + ' \n'
-		link_data_file.write(s)
-		count += 1
-		s = str(count) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + str(i[2]) + ' ' + \
-			str(i[1]) + ' ' + str(i[0]) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + \
-			str(i[2]) + ' ' + str(next(i[1], 3, True)) + ' ' + str(i[0]) + ' ' + \
-			str(j) + ' ' + str(linkVal(*i)) + ' \n'
-		link_data_file.write(s)
-		count += 1
-		s = str(count) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + str(i[2]) + ' ' + \
-			str(i[1]) + ' ' + str(i[0]) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + \
-			str(i[2]) + ' ' + str(next(i[1], 3, False)) + ' ' + str(i[0]) + ' ' + \
-			str(j) + ' ' + str(linkVal(*i)) + ' \n'
-		link_data_file.write(s)
-		count += 1
-		s = str(count) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + str(i[2]) + ' ' + \
-			str(i[1]) + ' ' + str(i[0]) + ' ' + str(i[4]) + ' ' + str(i[3]) + ' ' + \
-			str(i[2]) + ' ' + str(i[1]) + ' ' + str(next(i[0], 2, True)) + ' ' + \
-			str(j) + ' ' + str(linkVal(*i)) + ' \n'
-		link_data_file.write(s)
-		count += 1
-		
\ No newline at end of file
+coord_names = {3 : 'xyz', 5 : 'abcde'}
+
+
+def linkSteps(shape):
+    ''' Returns a (links per node, dims) array of the coordinate step taken
+    by each link of a node: +a, -a, +b, -b, ... as in the original data.  In
+    a dimension of size 2 or less the - link would reach the same node as
+    the + link, and the projection tells links apart by their coordinates,
+    so only the + link is kept, as in the original data.
+    '''
+    steps = list()
+    for dim, size in enumerate(shape):
+        for step in ([1, -1] if size > 2 else [1]):
+            steps.append(np.zeros(len(shape), dtype = int))
+            steps[-1][dim] = step
+    return np.array(steps)
+
+def nodeCoords(shape):
+    ''' Returns a (nodes, dims) array of the coordinates of every node in node
+    id order, which increases first in the first dimension.
+    '''
+    node_ids = np.arange(np.prod(shape))
+    return np.array(np.unravel_index(node_ids, shape, order = 'F')).T
+
+def linkValues(source, shape, distribution, rng):
+    ''' Returns the packet counts of the links with the given (links, dims)
+    source coordinates for one code region, drawn from the distribution.
+    '''
+    shape = np.array(shape)
+    if distribution == 'center':
+        # increasing outwards from the center when looking down the second
+        # dimension of a 3D torus, for the 2D projection figures
+        center = (shape - 1) / 2.0
+        values = (np.abs(source[:, 0] - center[0])
+            + np.abs(source[:, 2] - center[2])) * 10000
+    elif distribution == 'coords':
+        # a * 10000 + b * 1000 + c * 100 + d * 10 + e
+        weights = 10 ** np.arange(len(shape) - 1, -1, -1)
+        values = (source * weights).sum(axis = 1)
+    elif distribution == 'uniform':
+        values = rng.uniform(0, 100000, len(source))
+    elif distribution == 'normal':
+        values = np.maximum(rng.normal(50000, 15000, len(source)), 0)
+    elif distribution == 'hotspot':
+        # decays with torus distance from a random node, different per region
+        hotspot = np.array([rng.randint(0, size) for size in shape])
+        distance = np.abs(source - hotspot)
+        distance = np.minimum(distance, shape - distance).sum(axis = 1)
+        values = 100000 * np.exp(-distance / 2.0)
+    else:
+        raise ValueError('Unknown distribution ' + distribution)
+    return np.round(values).astype(np.int64)
+
+def rankMap(num_nodes, ranks_per_node, shuffle, rng):
+    ''' Returns a (ranks, 2) array of (mpirank, nodeid) rows placing
+    ranks_per_node consecutive ranks on each node, in node id order or in a
+    random node order if shuffle is set.
+    '''
+    nodes = np.arange(num_nodes)
+    if shuffle:
+        nodes = rng.permutation(num_nodes)
+    node_ids = np.repeat(nodes, ranks_per_node)
+    return np.column_stack((np.arange(len(node_ids)), node_ids))
+
+
+class TableWriter(object):
+    ''' Writes a Boxfish table with the given (name, type) fields as text or,
+    if binary is set, as binary records.  Rows are added in blocks by write(),
+    a 2D array holding one row per table row.  Any extra (name, value) pairs
+    are added to the header meta information.
+    '''
+
+    def __init__(self, filename, key, fields, binary = False, extra = ()):
+        self.fields = fields
+        self.binary = binary
+        self.file = open(filename, 'wb')
+
+        header = '---\nkey: ' + key + '\n'
+        if binary:
+            header += 'encoding: binary\n'
+        for name, value in extra:
+            header += name + ': ' + str(value) + '\n'
+        header += '---\n' + ''.join('- [' + name + ', ' + data_type + ']\n'
+            for name, data_type in fields) + '...\n'
+        self.file.write(header)
+
+    def write(self, columns):
+        if self.binary:
+            records = np.empty(len(columns), dtype = np.dtype(self.fields))
+            for i, (name, data_type) in enumerate(self.fields):
+                records[name] = columns[:, i]
+            records.tofile(self.file)
+        else:
+            np.savetxt(self.file, columns, fmt = '%d')
+
+    def close(self):
+        self.file.close()
+
+
+def writeMeta(filename, key, shape, names, files, has_map, time_field = None):
+    ''' Writes the meta file of the data set.  If time_field is given, the
+    links are a time series of snapshots with that time attribute.
+    '''
+    coords = ', '.join(names)
+    dims = ', '.join(name + ': ' + str(size) for name, size in zip(names, shape))
+    source = ', '.join(name + ': s' + name for name in names)
+    dest = ', '.join(name + ': t' + name for name in names)
+
+    meta = '---\nkey: ' + key + '\nhardware: {\n network: torus,\n nodes: ' \
+        + str(np.prod(shape)) + ',\n coords: [' + coords + '],\n coords_table: ' \
+        + files['nodes'] + ',\n dim: {' + dims + '},\n source_coords: {' \
+        + source + '},\n destination_coords: {' + dest + '},\n link_coords_table: ' \
+        + files['links'] + ',\n}\n'
+    meta += '---\nfiletype: table\nfilename: ' + files['nodes'] \
+        + '\ndomain: HW\ntype: NODE\nfield: nodeid\nflags: 0\n'
+    if time_field is None:
+        meta += '---\nfiletype: table\nfilename: ' + files['links']
+    else:
+        meta += '---\nfiletype: timeseries\nfilename: ' + files['links'] \
+            + '\ntime: ' + time_field
+    meta += '\ndomain: HW\ntype: LINK\nfield: linkid\nflags: 0\n'
+    if has_map:
+        meta += '---\nfiletype: projection\ntype: file\nfilename: ' + files['map'] \
+            + '\nsubdomain:\n- { domain: HW, type: NODE, field: nodeid }\n' \
+            + '- { domain: COMM, type: RANK, field: mpirank }\nflags: 0\n'
+    meta += '---\nfiletype: projection\ntype: node link\nnode_policy: Source\n' \
+        + 'link_policy: Source\nsubdomain:\n- { domain: HW, type: NODE, ' \
+        + 'field: nodeid }\n- { domain: HW, type: LINK, field: linkid }\n' \
+        + 'flags: 0\n...\n'
+
+    with open(filename, 'w') as meta_file:
+        meta_file.write(meta)
+
+def generate(shape, regions, region_field, distribution, ranks_per_node,
+    shuffle_ranks, binary, output, name, key, seed, timeseries = False):
+    ''' Generates the data set and returns the list of files written.  With
+    timeseries set, the links of each code region are written as a separate
+    snapshot, region_field being the time.
+    '''
+    rng = np.random.RandomState(seed)
+    names = coord_names[len(shape)]
+    files = {'nodes' : name + '_nodes.yaml', 'links' : name + '_links.yaml',
+        'map' : name + '_map.yaml', 'meta' : name + '_meta.yaml'}
+    paths = dict((kind, os.path.join(output, filename))
+        for kind, filename in files.items())
+    if timeseries:
+        files['links'] = name + '_links_*.yaml'
+    written = list()
+
+    coords = nodeCoords(shape)
+    num_nodes = len(coords)
+    node_ids = np.arange(num_nodes)
+
+    # Nodes are listed once per code region, like the original data
+    nodes = TableWriter(paths['nodes'], key, [('nodeid', 'int32')]
+        + [(dim, 'int32') for dim in names] + [(region_field, 'int32')], binary)
+    for region in range(1, regions + 1):
+        nodes.write(np.column_stack((node_ids, coords,
+            np.repeat(region, num_nodes))))
+    nodes.close()
+    written.append(paths['nodes'])
+
+    # link_id = node_id * links per node + link number
+    steps = linkSteps(shape)
+    source = np.repeat(coords, len(steps), axis = 0)
+    dest = ((coords[:, np.newaxis, :] + steps) % np.array(shape)).reshape(
+        -1, len(shape))
+    link_ids = np.arange(len(source))
+
+    link_fields = [('linkid', 'int32')] \
+        + [('s' + dim, 'int32') for dim in names] \
+        + [('t' + dim, 'int32') for dim in names] \
+        + [(region_field, 'int32'), ('packets', 'int64')]
+    links = None
+    for region in range(1, regions + 1):
+        if timeseries:
+            # one snapshot per region, the time is in the header
+            links_path = os.path.join(output, name + '_links_%d.yaml' % region)
+            links = TableWriter(links_path, key, link_fields, binary,
+                [(region_field, region)])
+            written.append(links_path)
+        elif links is None:
+            links = TableWriter(paths['links'], key, link_fields, binary)
+            written.append(paths['links'])
+
+        values = linkValues(source, shape, distribution, rng)
+        links.write(np.column_stack((link_ids, source, dest,
+            np.repeat(region, len(link_ids)), values)))
+        if timeseries:
+            links.close()
+    if not timeseries:
+        links.close()
+
+    if ranks_per_node > 0:
+        rank_map = TableWriter(paths['map'], key, [('mpirank', 'int32'),
+            ('nodeid', 'int32')], binary)
+        rank_map.write(rankMap(num_nodes, ranks_per_node, shuffle_ranks, rng))
+        rank_map.close()
+        written.append(paths['map'])
+
+    writeMeta(paths['meta'], key, shape, names, files, ranks_per_node > 0,
+        region_field if timeseries else None)
+    written.append(paths['meta'])
+    return written
+
+def parseShape(text):
+    ''' Parses a torus shape such as 6x5x4x3x2 into a list of sizes. '''
+    try:
+        shape = [int(size) for size in text.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Shape must look like 6x5x4x3x2')
+    if len(shape) not in coord_names or min(shape) < 1:
+        raise argparse.ArgumentTypeError('Shape must have 3 or 5 positive sizes')
+    return shape
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Generates synthetic '
+        + 'torus network data for Boxfish.')
+    parser.add_argument('-s', '--shape', type = parseShape, default = [6, 5, 4, 3, 2],
+        help = 'torus size in each dimension, 3D (x, y, z) or 5D (a, b, c, d, e)')
+    parser.add_argument('-r', '--regions', type = int, default = 2,
+        help = 'number of code regions or time steps with link values')
+    parser.add_argument('--region-field', default = 'code_region',
+        help = 'name of the code region column, e.g. timestep')
+    parser.add_argument('-d', '--distribution', default = 'center',
+        choices = ['center', 'coords', 'uniform', 'normal', 'hotspot'],
+        help = 'how link values are distributed over the torus')
+    parser.add_argument('-m', '--ranks-per-node', type = int, default = 0,
+        help = 'write a rank map with this many ranks on each node')
+    parser.add_argument('--shuffle-ranks', action = 'store_true', default = False,
+        help = 'place the ranks on the nodes in random order')
+    parser.add_argument('-t', '--timeseries', action = 'store_true',
+        default = False, help = 'write the links of each code region as a '
+        + 'separate snapshot of a time series')
+    parser.add_argument('-b', '--binary', action = 'store_true', default = False,
+        help = 'write tables as binary records instead of text')
+    parser.add_argument('-o', '--output', default = '.',
+        help = 'directory in which to write the files')
+    parser.add_argument('-n', '--name', default = 'bgq_synthetic',
+        help = 'prefix of the file names')
+    parser.add_argument('-k', '--key',
+        help = 'key of the data set in every file, defaults to TEST_5D_TORUS '
+        + 'or TEST_3D_TORUS')
+    parser.add_argument('--seed', type = int, default = 0,
+        help = 'seed of the random distributions and rank shuffling')
+    args = parser.parse_args(argv)
+
+    if args.key is None:
+        args.key = 'TEST_' + str(len(args.shape)) + 'D_TORUS'
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    for path in generate(args.shape, args.regions, args.region_field,
+        args.distribution, args.ranks_per_node, args.shuffle_ranks,
+        args.binary, args.output, args.name, args.key, args.seed,
+        args.timeseries):
+        print path
+
+if __name__ == '__main__':
+    main()
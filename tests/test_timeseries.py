@@ -0,0 +1,79 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# The tests run against the source tree, like the benchmarks.
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'scripts', 'synthetic_bgq_counters'))
+
+import generate_bgq_synthetic_data as synthetic
+import boxfish.TimeSeries as TimeSeries
+from boxfish.DataItems import loadRun
+
+
+class TimeSeriesTest(unittest.TestCase):
+    """Loads time series runs whose snapshots were written just now, less
+       than settle_seconds before they are read.
+    """
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.regions = 3
+        synthetic.generate([4, 3, 2], self.regions + 1, 'timestep',
+            'coords', 0, False, False, self.output, 'fresh', 'TEST_3D_TORUS',
+            0, timeseries = True)
+
+        # The last snapshot is held back to be written later
+        self.later = tempfile.mkdtemp()
+        shutil.move(self.snapshot(self.output), self.snapshot(self.later))
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+        shutil.rmtree(self.later)
+
+    def snapshot(self, directory):
+        return os.path.join(directory,
+            'fresh_links_%d.yaml' % (self.regions + 1))
+
+    def links(self, run):
+        tables = run.timeSeriesTables()
+        self.assertEqual(len(tables), 1)
+        return tables[0]._table
+
+    def test_load_fresh_run(self):
+        run = loadRun(os.path.join(self.output, 'fresh_meta.yaml'))
+        links = self.links(run)
+        self.assertEqual(links.chunkCount(), self.regions)
+        self.assertEqual(links.pending, dict())
+
+    def test_refresh_waits_for_new_snapshot(self):
+        run = loadRun(os.path.join(self.output, 'fresh_meta.yaml'))
+        links = self.links(run)
+
+        shutil.copy(self.snapshot(self.later), self.output)
+        self.assertEqual(links.refresh(), 0)
+        self.assertEqual(len(links.pending), 1)
+
+        # Unchanged since the last refresh, so completely written
+        self.assertEqual(links.refresh(), 1)
+        self.assertEqual(links.chunkCount(), self.regions + 1)
+        self.assertEqual(links.times[-1], self.regions + 1)
+        self.assertEqual(links.pending, dict())
+
+    def test_new_snapshot_read_once_settled(self):
+        run = loadRun(os.path.join(self.output, 'fresh_meta.yaml'))
+        links = self.links(run)
+
+        snapshot = self.snapshot(self.output)
+        shutil.copy(self.snapshot(self.later), snapshot)
+        modified = os.path.getmtime(snapshot) - TimeSeries.settle_seconds - 1
+        os.utime(snapshot, (modified, modified))
+        self.assertEqual(links.refresh(), 1)
+        self.assertEqual(links.chunkCount(), self.regions + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()